@@ -0,0 +1 @@
+"""Benchmarks of itunes-iap. Run ``python -m benchmarks.run --help``."""
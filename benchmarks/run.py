@@ -0,0 +1,338 @@
+"""Benchmarks of the parsing, mapping and transport hot paths.
+
+Run from the repository root:
+
+.. sourcecode:: shell
+
+    $ python -m benchmarks.run --output before.json
+    $ python -m benchmarks.run --output after.json --compare before.json
+    $ python -m benchmarks.run --filter receipt --min-time 0.05
+
+Each benchmark is timed in `repeat` rounds of calibrated loops and reported in
+seconds per operation. The JSON output has the environment and the results of
+each benchmark so runs can be compared later.
+"""
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+import platform
+import datetime
+import contextlib
+
+import itunesiap
+from itunesiap import receipt
+from itunesiap.tools import monotonic
+from itunesiap.testing.synth import Synth
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function takes no argument and returns the callable to
+    time. It also can return a context manager of the callable for setup and
+    teardown.
+    """
+    def decorator(function):
+        BENCHMARKS.append((name, function))
+        return function
+    return decorator
+
+
+def measure(function, min_time=0.2, repeat=5):
+    """Time `function` and return the statistics in seconds per call."""
+    loops = 1
+    while True:
+        started_at = monotonic()
+        for _ in range(loops):
+            function()
+        elapsed = monotonic() - started_at
+        if elapsed >= min_time / 10.0 or loops >= 10 ** 7:
+            break
+        loops *= 10
+    if elapsed > 0.0:
+        loops = max(1, int(loops * min_time / elapsed))
+
+    times = []
+    for _ in range(repeat):
+        started_at = monotonic()
+        for _ in range(loops):
+            function()
+        times.append((monotonic() - started_at) / loops)
+    times.sort()
+    mean = sum(times) / len(times)
+    stdev = (sum((t - mean) ** 2 for t in times) / len(times)) ** 0.5
+    return {
+        'loops': loops,
+        'repeat': repeat,
+        'best': times[0],
+        'median': times[len(times) // 2],
+        'mean': mean,
+        'stdev': stdev,
+        'ops_per_second': 1.0 / times[0] if times[0] else None,
+    }
+
+
+def synthetic_receipt(size):
+    """Return receipt data with `size` items of `in_app` generated by
+    :class:`itunesiap.testing.synth.Synth`.
+    """
+    synth = Synth(seed=0)
+    return synth.receipt(synth.iter_in_app(size))
+
+
+@benchmark('date.rfc3339_to_datetime.apple')
+def bench_rfc3339_apple():
+    return lambda: receipt._rfc3339_to_datetime('2013-01-01 00:00:00 Etc/GMT')
+
+
+@benchmark('date.rfc3339_to_datetime.iso')
+def bench_rfc3339_iso():
+    return lambda: receipt._rfc3339_to_datetime('2013-01-01T00:00:00Z')
+
+
+@benchmark('date.ms_to_datetime')
+def bench_ms_to_datetime():
+    return lambda: receipt._ms_to_datetime('1356998400000')
+
+
+@benchmark('mapper.first_access')
+def bench_mapper_first_access():
+    data = synthetic_receipt(1)['in_app'][0]
+    return lambda: receipt.InApp(data).quantity
+
+
+@benchmark('mapper.repeated_access')
+def bench_mapper_repeated_access():
+    in_app = receipt.InApp(synthetic_receipt(1)['in_app'][0])
+    in_app.quantity
+    return lambda: in_app.quantity
+
+
+@benchmark('mapper.opaque_access')
+def bench_mapper_opaque_access():
+    in_app = receipt.InApp(synthetic_receipt(1)['in_app'][0])
+    return lambda: in_app.product_id
+
+
+def _bench_in_app(size):
+    data = synthetic_receipt(size)
+    return lambda: receipt.Receipt(data).in_app
+
+
+def _bench_last_in_app(size):
+    data = synthetic_receipt(size)
+    return lambda: receipt.Receipt(data).last_in_app
+
+
+for _size in (10, 1000, 10000):
+    benchmark('receipt.in_app.{0}'.format(_size))(
+        lambda size=_size: _bench_in_app(size))
+    benchmark('receipt.last_in_app.{0}'.format(_size))(
+        lambda size=_size: _bench_last_in_app(size))
+
+
+@benchmark('response.construct')
+def bench_response_construct():
+    data = {'status': 0, 'receipt': synthetic_receipt(10)}
+    return lambda: receipt.Response(data).status
+
+
+@benchmark('response.decode_and_construct.1000')
+def bench_response_decode():
+    body = json.dumps({'status': 0, 'receipt': synthetic_receipt(1000)})
+    return lambda: receipt.Response(json.loads(body)).receipt
+
+
+@benchmark('response.to_bytes.1000')
+def bench_response_to_bytes():
+    response = receipt.Response({'status': 0, 'receipt': synthetic_receipt(1000)})
+    return response.to_bytes
+
+
+@benchmark('response.from_bytes.status.1000')
+def bench_response_from_bytes():
+    data = receipt.Response({'status': 0, 'receipt': synthetic_receipt(1000)}).to_bytes()
+    return lambda: receipt.Response.from_bytes(data).status
+
+
+@benchmark('response.from_bytes.in_app.1000')
+def bench_response_from_bytes_in_app():
+    data = receipt.Response({'status': 0, 'receipt': synthetic_receipt(1000)}).to_bytes()
+    return lambda: [in_app.product_id for in_app in receipt.Response.from_bytes(data).receipt.in_app]
+
+
+@benchmark('storage.write.in_app.1000')
+@contextlib.contextmanager
+def bench_storage_write():
+    import shutil
+    import tempfile
+    from itunesiap.storage import PurchaseStore
+    directory = tempfile.mkdtemp()
+    store = PurchaseStore(directory + '/purchases.db')
+    response = receipt.Response({'status': 0, 'receipt': synthetic_receipt(1000)})
+    yield lambda: store.write(response)
+    store.close()
+    shutil.rmtree(directory)
+
+
+@benchmark('ledger.lookup.unseen')
+@contextlib.contextmanager
+def bench_ledger_lookup():
+    import shutil
+    import tempfile
+    from itunesiap.ledger import Ledger
+    directory = tempfile.mkdtemp()
+    ledger = Ledger(directory + '/ledger.db', capacity=100000)
+    ledger.load((str(i), str(i), 'account') for i in range(100000))
+    yield lambda: ledger.lookup('unseen')
+    ledger.close()
+    shutil.rmtree(directory)
+
+
+@benchmark('snapshot.entitled.100000')
+@contextlib.contextmanager
+def bench_snapshot_entitled():
+    import shutil
+    import tempfile
+    from itunesiap.snapshot import SnapshotBuilder, SnapshotReader
+    directory = tempfile.mkdtemp()
+    builder = SnapshotBuilder()
+    for i in range(100000):
+        builder.add(i, 'com.example.premium', expires_ms=i)
+    builder.write(directory + '/entitlements')
+    reader = SnapshotReader(directory + '/entitlements')
+    yield lambda: reader.entitled(12345, 'com.example.premium')
+    shutil.rmtree(directory)
+
+
+@benchmark('response.diff.unchanged.1000')
+def bench_response_diff():
+    data = {'status': 0, 'receipt': synthetic_receipt(1000)}
+    state = receipt.Response(data).diff().state
+    return lambda: receipt.Response(data).diff(state)
+
+
+@benchmark('transport.verify')
+@contextlib.contextmanager
+def bench_verify():
+    from itunesiap.testing import FakeItunesServer
+    with FakeItunesServer() as server:
+        request = server.bind(itunesiap.Request('receipt'))
+        yield request.verify
+
+
+@benchmark('synth.iter_in_app.10000')
+def bench_synth():
+    synth = Synth(seed=0)
+    return lambda: sum(1 for _ in synth.iter_in_app(10000))
+
+
+@benchmark('transport.verify.in_app.1000')
+@contextlib.contextmanager
+def bench_verify_large():
+    from itunesiap.testing import FakeItunesServer
+    responder = Synth(seed=0).responder(in_app=900, subscriptions=10, renewals=20)
+    with FakeItunesServer(responder=responder) as server:
+        request = server.bind(itunesiap.Request('receipt'))
+        yield request.verify
+
+
+@benchmark('transport.verify.pooled')
+@contextlib.contextmanager
+def bench_verify_pooled():
+    from itunesiap.bulkhead import Bulkhead
+    from itunesiap.testing import FakeItunesServer
+    with FakeItunesServer() as server:
+        request = server.bind(itunesiap.Request('receipt'))
+        bulkhead = Bulkhead()
+        env = itunesiap.env.production.clone(bulkhead=bulkhead)
+        yield lambda: request.verify(env=env)
+        bulkhead.close()
+
+
+@benchmark('transport.aioverify')
+@contextlib.contextmanager
+def bench_aioverify():
+    import asyncio
+    from itunesiap.testing import FakeItunesServer
+    loop = asyncio.new_event_loop()
+    with FakeItunesServer() as server:
+        request = server.bind(itunesiap.Request('receipt'))
+        yield lambda: loop.run_until_complete(request.aioverify())
+    loop.close()
+
+
+def run(names=None, min_time=0.2, repeat=5, out=None):
+    """Run the benchmarks and return the report as a :class:`dict`.
+
+    :param names: Substrings to select benchmarks. Every benchmark if empty.
+    """
+    results = {}
+    for name, factory in BENCHMARKS:
+        if names and not any(pattern in name for pattern in names):
+            continue
+        target = factory()
+        if hasattr(target, '__enter__'):
+            with target as function:
+                result = measure(function, min_time, repeat)
+        else:
+            result = measure(target, min_time, repeat)
+        results[name] = result
+        if out is not None:
+            print(u'{0:<40} {1:>12.3f} us/op'.format(name, result['best'] * 1e6), file=out)
+    return {
+        'version': 1,
+        'created_at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'itunesiap': itunesiap.__version__,
+        'min_time': min_time,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(report, baseline, out):
+    """Print the ratio of `report` to `baseline` for the common benchmarks."""
+    for name in sorted(report['results']):
+        if name not in baseline['results']:
+            continue
+        current = report['results'][name]['best']
+        previous = baseline['results'][name]['best']
+        print(u'{0:<40} {1:>12.3f} -> {2:>12.3f} us/op  x{3:.2f}'.format(
+            name, previous * 1e6, current * 1e6, current / previous), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--filter', action='append', default=[], help='run benchmarks containing the text')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds of each round')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds of each benchmark')
+    parser.add_argument('--output', help='JSON file to write the results')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, _ in BENCHMARKS:
+            print(name)
+        return 0
+    report = run(args.filter, args.min_time, args.repeat, out=sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(file=sys.stdout)
+        compare(report, baseline, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
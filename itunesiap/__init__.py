@@ -14,6 +14,8 @@ from .shortcut import verify, aioverify
 
 from . import exceptions
 from . import environment
+from . import retry
+from . import instrument
 
 exc = exceptions
 env = environment  # env.default, env.sandbox, env.review
@@ -23,4 +25,5 @@ __version__ = '2.6.1'
 __all__ = (
     '__version__', 'Request', 'Response', 'Receipt', 'InApp',
     'verify', 'aioverify',
-    'exceptions', 'exc', 'environment', 'env')
+    'exceptions', 'exc', 'environment', 'env', 'retry',
+    'instrument')
@@ -0,0 +1,80 @@
+""":mod:`itunesiap.adaptive`
+
+Adaptive timeouts driven by the observed latencies.
+
+A fixed `timeout` is either too generous during incidents or too tight for
+slow but valid calls. :class:`AdaptiveTimeout` keeps the recent latencies of
+each verification URL and sets the timeout of each attempt to a percentile of
+them plus headroom, clamped between `minimum` and `maximum`.
+
+.. sourcecode:: python
+
+    >>> adaptive = itunesiap.adaptive.AdaptiveTimeout(percentile=0.99, headroom=0.5, minimum=1.0, maximum=30.0)
+    >>> env = itunesiap.env.production.clone(adaptive_timeout=adaptive)
+    >>> itunesiap.verify(receipt, env=env)
+
+Until `min_samples` latencies are observed, the `timeout` of the environment
+is used. An attempt timed out is recorded at its timeout, so the timeouts grow
+when the latency rises above them.
+"""
+from .stats import LatencyWindows
+
+__all__ = ('AdaptiveTimeout',)
+
+
+class AdaptiveTimeout(object):
+    """Timeout policy by the observed latency of each verification URL.
+
+    The timeout is `percentile latency * factor + headroom` clamped between
+    `minimum` and `maximum`.
+
+    :param float percentile: The quantile of the recent latencies.
+    :param float factor: The multiplier of the percentile latency.
+    :param float headroom: Seconds added to the percentile latency.
+    :param float minimum: The lower bound of the timeout in seconds.
+    :param float maximum: The upper bound of the timeout in seconds.
+    :param int min_samples: The minimum number of latencies to adapt.
+    :param int window: The number of recent latencies to keep for each URL.
+    """
+
+    def __init__(
+            self, percentile=0.99, factor=1.0, headroom=0.5, minimum=1.0,
+            maximum=30.0, min_samples=20, window=1000):
+        assert minimum <= maximum
+        self.percentile = percentile
+        self.factor = factor
+        self.headroom = headroom
+        self.minimum = minimum
+        self.maximum = maximum
+        self.min_samples = min_samples
+        self.latencies = LatencyWindows(window)
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} percentile={self.percentile} headroom={self.headroom} minimum={self.minimum} maximum={self.maximum}>'.format(self=self)
+
+    def timeout_for(self, url, default=None):
+        """Return the timeout for `url`. `default` is returned, clamped, when
+        not enough latencies are observed.
+        """
+        window = self.latencies[url]
+        if window.count < self.min_samples:
+            timeout = default
+        else:
+            timeout = window.percentile(self.percentile) * self.factor + self.headroom
+        if timeout is None:
+            return self.maximum
+        return min(self.maximum, max(self.minimum, timeout))
+
+    def record(self, url, seconds):
+        """Record the latency of an answered request."""
+        self.latencies.add(url, seconds)
+
+    def record_timeout(self, url, timeout, seconds):
+        """Record an attempt which failed without an answer after `seconds`.
+
+        When the attempt ran out of `timeout`, the latency is at least the
+        timeout and it is recorded as a sample. Quicker failures, e.g. refused
+        connections, tell nothing about the latency.
+        """
+        if timeout is not None and seconds >= timeout:
+            self.latencies.add(url, timeout)
@@ -0,0 +1,246 @@
+""":mod:`itunesiap.bulkhead`
+
+Bulkheads isolate production and sandbox verifications. Each server has its
+own connection pool and its own limit of concurrent requests, so a slow
+sandbox server cannot take connections and worker slots that production
+verifications need.
+
+.. sourcecode:: python
+
+    >>> bulkhead = itunesiap.bulkhead.Bulkhead(production=20, sandbox=2, timeout=1.0)
+    >>> env = itunesiap.env.review.clone(bulkhead=bulkhead)
+    >>> itunesiap.verify(receipt, env=env)
+
+A request waits for a free slot of its server up to `timeout` seconds and
+raises :class:`itunesiap.exceptions.BulkheadFull` after that.
+
+The pools are reused by every verification with the environment. Close them
+by :meth:`Bulkhead.close` and :meth:`Bulkhead.aioclose` for :mod:`asyncio`.
+The pools of :mod:`asyncio` belong to an event loop and the ones of the
+closed loops are dropped.
+
+A hedged request of :mod:`itunesiap.hedge` takes a free slot of its server
+too, and it is not sent when there is no free slot.
+"""
+import threading
+
+from . import exceptions
+from .tools import monotonic
+
+__all__ = ('Bulkhead',)
+
+
+class _Slots(object):
+    """A counting semaphore with timeout and statistics."""
+
+    def __init__(self, size):
+        self.size = size
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._condition = threading.Condition(threading.Lock())
+
+    def acquire(self, timeout=None):
+        with self._condition:
+            if self.in_use < self.size:
+                self.in_use += 1
+                return True
+            if timeout is not None:
+                expires_at = monotonic() + timeout
+            self.waiting += 1
+            try:
+                while self.in_use >= self.size:
+                    if timeout is None:
+                        self._condition.wait()
+                        continue
+                    remaining = expires_at - monotonic()
+                    if remaining <= 0.0:
+                        self.rejected += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_use += 1
+            return True
+
+    def try_acquire(self):
+        """Take a free slot without waiting. Return whether it is taken."""
+        with self._condition:
+            if self.in_use < self.size:
+                self.in_use += 1
+                return True
+            return False
+
+    def release(self):
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+
+class _AioSlots(object):
+    """The :class:`asyncio.Semaphore` of an event loop with statistics.
+    They are updated by the slots of :mod:`itunesiap.verify_aiohttp`.
+    """
+
+    def __init__(self, size):
+        import asyncio
+        self.size = size
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.semaphore = asyncio.Semaphore(size)
+
+    def release(self):
+        self.in_use -= 1
+        self.semaphore.release()
+
+
+class _Slot(object):
+
+    def __init__(self, slots, tier, timeout):
+        self.slots = slots
+        self.tier = tier
+        self.timeout = timeout
+
+    def __enter__(self):
+        if not self.slots.acquire(self.timeout):
+            raise exceptions.BulkheadFull(tier=self.tier)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.slots.release()
+
+
+class Bulkhead(object):
+    """Isolated connection pools and concurrency limits for each server.
+
+    :param int production: The pool size and the maximum number of
+        concurrent requests to production server.
+    :param int sandbox: The pool size and the maximum number of concurrent
+        requests to sandbox server.
+    :param float timeout: The maximum seconds to wait for a free slot.
+        `None` means no limit except the deadline of the verification.
+    """
+
+    def __init__(self, production=10, sandbox=2, timeout=None):
+        self.sizes = {'production': production, 'sandbox': sandbox}
+        self.timeout = timeout
+        self._slots = dict(
+            (tier, _Slots(size)) for tier, size in self.sizes.items())
+        self._sessions = {}
+        # event loop to tier to the session or the slots. They refer to
+        # their loop, so the closed loops are dropped instead of weak keys.
+        self._aiosessions = {}
+        self._aioslots = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} sizes={self.sizes!r} timeout={self.timeout}>'.format(self=self)
+
+    def slot(self, tier, deadline=None):
+        """Return a context manager holding a request slot of `tier`."""
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = deadline.timeout(timeout)
+        return _Slot(self._slots[tier], tier, timeout)
+
+    def try_acquire(self, tier):
+        """Take a free slot of `tier` without waiting for a hedged request.
+        Return whether it is taken. Give it back by :meth:`release`.
+        """
+        return self._slots[tier].try_acquire()
+
+    def release(self, tier):
+        """Give back a slot of :meth:`try_acquire`."""
+        self._slots[tier].release()
+
+    def session(self, tier):
+        """Return the :class:`requests.Session` of `tier`."""
+        try:
+            return self._sessions[tier]
+        except KeyError:
+            pass
+        import requests
+        with self._lock:
+            if tier not in self._sessions:
+                size = self.sizes[tier]
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=size)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[tier] = session
+            return self._sessions[tier]
+
+    def aiosession(self, tier):
+        """Return the :class:`aiohttp.ClientSession` of `tier` for the running
+        event loop. Call it in a coroutine.
+        """
+        import asyncio
+        import aiohttp
+        sessions = self._loop_values(self._aiosessions, asyncio.get_event_loop())
+        session = sessions.get(tier)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.sizes[tier])
+            session = sessions[tier] = aiohttp.ClientSession(connector=connector)
+        return session
+
+    def aioslots(self, tier):
+        """Return the slots of `tier` for the running event loop. Call it
+        in a coroutine.
+        """
+        import asyncio
+        slots = self._loop_values(self._aioslots, asyncio.get_event_loop())
+        if tier not in slots:
+            slots[tier] = _AioSlots(self.sizes[tier])
+        return slots[tier]
+
+    def aiosemaphore(self, tier):
+        """Return the :class:`asyncio.Semaphore` of `tier` for the running
+        event loop. Call it in a coroutine.
+        """
+        return self.aioslots(tier).semaphore
+
+    @staticmethod
+    def _loop_values(values, loop):
+        for other in list(values):
+            if other.is_closed():
+                # the sessions can't be closed without their loop
+                del values[other]
+        return values.setdefault(loop, {})
+
+    def close(self):
+        """Close the pools of :func:`itunesiap.verify`."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def aioclose(self):
+        """Close the pools of :func:`itunesiap.aioverify` for the running
+        event loop. Return an awaitable.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        sessions = self._aiosessions.pop(loop, {})
+        self._aioslots.pop(loop, None)
+        return asyncio.gather(*[session.close() for session in sessions.values()])
+
+    def stats(self):
+        """Return a :class:`dict` of tier to the usage of the slots. The
+        usage of the slots of the event loops is summed in `aio`.
+        """
+        stats = {}
+        for tier, slots in self._slots.items():
+            aio = {'loops': 0, 'in_use': 0, 'waiting': 0, 'rejected': 0}
+            for loop, aioslots in list(self._aioslots.items()):
+                if tier in aioslots and not loop.is_closed():
+                    aio['loops'] += 1
+                    for name in ('in_use', 'waiting', 'rejected'):
+                        aio[name] += getattr(aioslots[tier], name)
+            stats[tier] = {
+                'size': slots.size, 'in_use': slots.in_use,
+                'waiting': slots.waiting, 'rejected': slots.rejected,
+                'aio': aio}
+        return stats
@@ -0,0 +1,518 @@
+""":mod:`itunesiap.cache`
+
+Caching of verified responses with pluggable backends.
+
+.. sourcecode:: python
+
+    >>> cache = itunesiap.cache.ResponseCache(
+    ...     itunesiap.cache.SQLiteCache('/var/run/itunesiap-cache.db'), ttl=300.0)
+    >>> env = itunesiap.env.review.clone(cache=cache)
+    >>> itunesiap.verify(receipt, env=env)  # verified by iTunes server
+    >>> itunesiap.verify(receipt, env=env)  # from the cache
+
+Backends store :class:`bytes` values by text keys with optional TTL:
+
+- :class:`LRUCache`: In a process.
+- :class:`SQLiteCache`: Shared by every worker process on a host through a
+  SQLite database in WAL mode.
+- :class:`MemcachedCache`: Shared by hosts through memcached servers with
+  the text protocol.
+
+Any object with the methods of :class:`CacheBackend` can be a backend.
+Failures of a backend raise :class:`itunesiap.exceptions.CacheError` and
+:class:`ResponseCache` takes them as misses, so a broken cache never fails
+verifications.
+"""
+import time
+import socket
+import struct
+import sqlite3
+import hashlib
+import binascii
+import threading
+from collections import OrderedDict
+
+import six
+
+from . import exceptions
+from .compact import Mapping, Sequence
+from .receipt import Response
+from .tools import monotonic, SQLiteConnections
+
+__all__ = (
+    'CacheBackend', 'LRUCache', 'SQLiteCache', 'MemcachedCache',
+    'ResponseCache')
+
+
+# the failures of decoding corrupted values
+_DECODE_ERRORS = (ValueError, LookupError, TypeError, struct.error)
+
+
+def _validate(value):
+    """Decode every level of the lazy `value`. The decoded levels are kept
+    by the lazy values, so they are not decoded again on access.
+    """
+    if isinstance(value, Mapping):
+        for item in value.values():
+            _validate(item)
+    elif isinstance(value, Sequence) and not isinstance(value, six.string_types):
+        for item in value:
+            _validate(item)
+
+
+class CacheBackend(object):
+    """The protocol of cache backends.
+
+    `ttl` is the lifetime of a value in seconds. `None` means the default TTL
+    of the backend.
+
+    :param float default_ttl: The TTL when `ttl` is not given. `None` means
+        values never expire.
+    """
+
+    #: The methods block on I/O. :func:`itunesiap.aioverify` calls them in
+    #: the default executor of the event loop.
+    blocking = False
+
+    def __init__(self, default_ttl=None):
+        self.default_ttl = default_ttl
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} default_ttl={self.default_ttl}>'.format(self=self)
+
+    def _ttl(self, ttl):
+        return self.default_ttl if ttl is None else ttl
+
+    def get(self, key):
+        """Return the value of `key` or `None` if missing or expired."""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Return a :class:`dict` of the found values of `keys`."""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, key, value, ttl=None):
+        """Store :class:`bytes` `value` for `ttl` seconds."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove `key` if exists."""
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """The least recently used values in a process.
+
+    :param int maxsize: The maximum number of values.
+    :param float default_ttl: See :class:`CacheBackend`.
+    """
+
+    def __init__(self, maxsize=1024, default_ttl=None):
+        super(LRUCache, self).__init__(default_ttl)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} maxsize={self.maxsize} default_ttl={self.default_ttl}>'.format(self=self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= monotonic():
+                return None
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self._ttl(ttl)
+        expires_at = None if ttl is None else monotonic() + ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(CacheBackend):
+    """Values in a SQLite database shared by the processes on a host.
+
+    The database is in WAL mode, so readers don't block the writer. Each
+    thread has its own connection and forked processes reconnect. Expired
+    rows are purged every `purge_interval` writes of a connection.
+
+    :param str path: The database file.
+    :param float default_ttl: See :class:`CacheBackend`.
+    :param float timeout: Seconds to wait for the lock of the database.
+    :param int purge_interval: The number of writes between purges.
+    """
+
+    blocking = True
+    TABLE = 'itunesiap_cache'
+    #: The maximum number of variables of a statement in old SQLite.
+    MAX_VARIABLES = 999
+
+    def __init__(self, path, default_ttl=None, timeout=5.0, purge_interval=1000):
+        super(SQLiteCache, self).__init__(default_ttl)
+        self.path = path
+        self.timeout = timeout
+        self.purge_interval = purge_interval
+        self._connections = SQLiteConnections(path, timeout)
+        self._writes = threading.local()
+        self._execute(lambda connection: connection.execute(
+            'CREATE TABLE IF NOT EXISTS {0} ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)'.format(self.TABLE)))
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} path={self.path!r} default_ttl={self.default_ttl}>'.format(self=self)
+
+    def _execute(self, function):
+        try:
+            return function(self._connections())
+        except sqlite3.Error as e:
+            raise exceptions.CacheError(exc=e)
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = {}
+        now = time.time()
+
+        def select(connection):
+            for offset in range(0, len(keys), self.MAX_VARIABLES):
+                chunk = keys[offset:offset + self.MAX_VARIABLES]
+                rows = connection.execute(
+                    'SELECT key, value, expires_at FROM {0} WHERE key IN ({1})'.format(
+                        self.TABLE, ','.join('?' * len(chunk))),
+                    chunk)
+                for key, value, expires_at in rows:
+                    if expires_at is None or expires_at > now:
+                        values[key] = bytes(value)
+        self._execute(select)
+        return values
+
+    def set(self, key, value, ttl=None):
+        ttl = self._ttl(ttl)
+        expires_at = None if ttl is None else time.time() + ttl
+
+        def insert(connection):
+            connection.execute(
+                'INSERT OR REPLACE INTO {0} (key, value, expires_at) VALUES (?, ?, ?)'.format(self.TABLE),
+                (key, sqlite3.Binary(value), expires_at))
+            writes = self._writes.__dict__.get('count', 0) + 1
+            self._writes.count = writes
+            if writes % self.purge_interval == 0:
+                self._purge(connection)
+        self._execute(insert)
+
+    def delete(self, key):
+        self._execute(lambda connection: connection.execute(
+            'DELETE FROM {0} WHERE key = ?'.format(self.TABLE), (key,)))
+
+    def _purge(self, connection):
+        return connection.execute(
+            'DELETE FROM {0} WHERE expires_at <= ?'.format(self.TABLE),
+            (time.time(),)).rowcount
+
+    def purge(self):
+        """Delete the expired rows and return the number of them."""
+        return self._execute(self._purge)
+
+    def close(self):
+        """Close the connection of the current thread."""
+        self._connections.close()
+
+
+class _MemcachedConnection(object):
+
+    def __init__(self, address, timeout):
+        host, _, port = address.rpartition(':')
+        self.socket = socket.create_connection((host, int(port)), timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.socket.makefile('rb')
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def command(self, line, data=None):
+        payload = line + b'\r\n'
+        if data is not None:
+            payload += data + b'\r\n'
+        self.socket.sendall(payload)
+
+    def readline(self):
+        line = self.file.readline()
+        if not line.endswith(b'\r\n'):
+            raise socket.error(u'Connection closed')
+        return line[:-2]
+
+    def read(self, size):
+        data = self.file.read(size + 2)
+        if len(data) != size + 2:
+            raise socket.error(u'Connection closed')
+        return data[:-2]
+
+
+class MemcachedCache(CacheBackend):
+    """Values in memcached servers by the text protocol.
+
+    Keys are distributed to `servers` by their CRC32. Each thread keeps a
+    connection to each server and reconnects once on a broken connection.
+    A connection is dropped on any failure, so its stream is never out of
+    sync.
+
+    :param servers: The addresses of the servers in `host:port`.
+    :param float default_ttl: See :class:`CacheBackend`.
+    :param float timeout: The socket timeout in seconds.
+    """
+
+    blocking = True
+    #: TTL longer than this is sent as an absolute UNIX time.
+    MAX_RELATIVE_TTL = 60 * 60 * 24 * 30
+    MAX_KEY_LENGTH = 250
+
+    def __init__(self, servers=('127.0.0.1:11211',), default_ttl=None, timeout=1.0):
+        super(MemcachedCache, self).__init__(default_ttl)
+        if isinstance(servers, six.string_types):
+            servers = (servers,)
+        if not servers:
+            raise ValueError(u'No memcached server')
+        self.servers = tuple(servers)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} servers={self.servers!r} default_ttl={self.default_ttl}>'.format(self=self)
+
+    def _key(self, key):
+        encoded = key.encode('utf-8') if isinstance(key, six.text_type) else key
+        if len(encoded) > self.MAX_KEY_LENGTH or len(encoded.split()) != 1 or b'\x00' in encoded:
+            raise ValueError(u'Invalid memcached key {0!r}'.format(key))
+        return encoded
+
+    def _server(self, key):
+        return self.servers[(binascii.crc32(key) & 0xffffffff) % len(self.servers)]
+
+    def _call(self, server, function):
+        connections = self._local.__dict__.setdefault('connections', {})
+        for retry in (True, False):
+            connection = connections.get(server)
+            try:
+                if connection is None:
+                    connection = connections[server] = _MemcachedConnection(server, self.timeout)
+                return function(connection)
+            except Exception as e:
+                # the stream may be out of sync
+                connections.pop(server, None)
+                if connection is not None:
+                    connection.close()
+                if isinstance(e, exceptions.CacheError):
+                    raise
+                if not retry or not isinstance(e, (socket.error, IOError)):
+                    raise exceptions.CacheError(exc=e)
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        by_server = {}
+        encoded_keys = {}
+        for key in keys:
+            encoded = self._key(key)
+            encoded_keys[encoded] = key
+            by_server.setdefault(self._server(encoded), []).append(encoded)
+        values = {}
+
+        def get(connection, chunk):
+            connection.command(b'get ' + b' '.join(chunk))
+            while True:
+                line = connection.readline()
+                if line == b'END':
+                    return
+                parts = line.split()
+                if len(parts) < 4 or parts[0] != b'VALUE' or parts[1] not in encoded_keys:
+                    raise exceptions.CacheError(line)
+                values[encoded_keys[parts[1]]] = connection.read(int(parts[3]))
+        for server, chunk in by_server.items():
+            self._call(server, lambda connection: get(connection, chunk))
+        return values
+
+    def _exptime(self, ttl):
+        ttl = self._ttl(ttl)
+        if ttl is None:
+            return 0
+        seconds = max(1, int(ttl + 0.999))
+        if seconds > self.MAX_RELATIVE_TTL:
+            return int(time.time()) + seconds
+        return seconds
+
+    def set(self, key, value, ttl=None):
+        key = self._key(key)
+        line = b'set ' + key + ' 0 {0} {1}'.format(self._exptime(ttl), len(value)).encode('ascii')
+
+        def store(connection):
+            connection.command(line, value)
+            reply = connection.readline()
+            if reply != b'STORED':
+                raise exceptions.CacheError(reply)
+        self._call(self._server(key), store)
+
+    def delete(self, key):
+        key = self._key(key)
+
+        def delete(connection):
+            connection.command(b'delete ' + key)
+            reply = connection.readline()
+            if reply not in (b'DELETED', b'NOT_FOUND'):
+                raise exceptions.CacheError(reply)
+        self._call(self._server(key), delete)
+
+    def close(self):
+        """Close the connections of the current thread."""
+        for connection in self._local.__dict__.pop('connections', {}).values():
+            connection.close()
+
+
+class ResponseCache(object):
+    """The cache policy of verified responses in an environment.
+
+    Responses are cached by the receipt data, the password and
+    `exclude_old_transactions` of the requests, and the tiers and the
+    endpoints of the environments. So an environment sharing the cache never
+    gets the responses of a tier it doesn't verify with. Only verified responses are
+    cached and errors are always verified again. They are stored in the
+    format of :meth:`itunesiap.receipt.Response.to_bytes` and validated on
+    hits. Corrupted values are deleted and taken as misses.
+
+    :param backend: A :class:`CacheBackend`.
+    :param float ttl: The lifetime of responses in seconds. Keep it short
+        because renewals and refunds are not seen until it expires. `None`
+        means the default TTL of `backend`.
+    :param str prefix: The prefix of keys to share a backend.
+    :param fields: The projection of the fields to store like
+        :func:`itunesiap.compact.without_bloat`. See
+        :func:`itunesiap.compact.dumps`. `None` stores every field.
+    """
+
+    #: The version of stored values. Changed values are not read.
+    FORMAT = 2
+
+    def __init__(self, backend, ttl=300.0, prefix='itunesiap', fields=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.fields = fields
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} backend={self.backend!r} ttl={self.ttl}>'.format(self=self)
+
+    def key(self, request, env=None):
+        """The key of the response of `request` verified in `env`."""
+        parts = [request.receipt_data, request.password]
+        if env is not None:
+            for tier, used in (('production', env.use_production), ('sandbox', env.use_sandbox)):
+                if not used:
+                    parts.append(None)
+                elif env.endpoints is not None:
+                    parts.append(u' '.join(env.endpoints[tier].urls))
+                elif tier == 'sandbox':
+                    parts.append(request.SANDBOX_VALIDATION_URL)
+                else:
+                    parts.append(request.PRODUCTION_VALIDATION_URL)
+        digest = hashlib.sha256()
+        for part in parts:
+            if part is None:
+                part = b''
+            elif isinstance(part, six.text_type):
+                part = part.encode('utf-8')
+            digest.update(part)
+            digest.update(b'\x00')
+        digest.update(b'1' if request.exclude_old_transactions else b'0')
+        return '{0}:{1}:{2}'.format(self.prefix, self.FORMAT, digest.hexdigest())
+
+    def dumps(self, response):
+        """Serialize `response` into :class:`bytes`."""
+        return response.to_bytes(self.fields)
+
+    @staticmethod
+    def loads(value):
+        """Deserialize :class:`bytes` `value` into a response.
+
+        :raises ValueError: When `value` is corrupted.
+        """
+        response = Response.from_bytes(value)
+        try:
+            _validate(response._)
+        except _DECODE_ERRORS as e:
+            if isinstance(e, ValueError):
+                raise
+            raise ValueError(u'Corrupted response: {0!r}'.format(e))
+        return response
+
+    def _load(self, key, value):
+        if value is None:
+            return None
+        try:
+            return self.loads(value)
+        except _DECODE_ERRORS:
+            self._delete(key)
+            return None
+
+    def get(self, request, env=None):
+        """Return the cached response of `request` in `env` or `None`."""
+        key = self.key(request, env)
+        try:
+            value = self.backend.get(key)
+        except exceptions.CacheError:
+            return None
+        return self._load(key, value)
+
+    def get_many(self, requests, env=None):
+        """Return the list of cached responses or `None` of `requests` in
+        `env`.
+        """
+        keys = [self.key(request, env) for request in requests]
+        try:
+            values = self.backend.get_many(keys)
+        except exceptions.CacheError:
+            values = {}
+        return [self._load(key, values.get(key)) for key in keys]
+
+    def set(self, request, response, env=None):
+        """Cache `response` of `request` in `env`."""
+        try:
+            self.backend.set(self.key(request, env), self.dumps(response), self.ttl)
+        except exceptions.CacheError:
+            pass
+
+    def _delete(self, key):
+        try:
+            self.backend.delete(key)
+        except exceptions.CacheError:
+            pass
+
+    def delete(self, request, env=None):
+        """Forget the response of `request` in `env`."""
+        self._delete(self.key(request, env))
@@ -0,0 +1,239 @@
+""":mod:`itunesiap.circuitbreaker`
+
+A circuit breaker stops sending requests to a degraded verifying server for a
+while. Instead of waiting for the full `timeout` of each request, a request to
+an open circuit fails fast with
+:class:`itunesiap.exceptions.CircuitOpen`.
+
+Each verification URL has its own :class:`CircuitBreaker` in
+:class:`CircuitBreakers`. Set it to the environment as `circuit_breaker` and
+share the environment between callers.
+
+.. sourcecode:: python
+
+    >>> breakers = itunesiap.circuitbreaker.CircuitBreakers(failure_threshold=5, recovery_timeout=30.0)
+    >>> env = itunesiap.env.review.clone(circuit_breaker=breakers)
+    >>> itunesiap.verify(receipt, env=env)
+    >>> breakers.states()
+    {'https://buy.itunes.apple.com/verifyReceipt': 'closed', ...}
+
+States
+------
+
+- `closed`: Requests pass. Failures are counted.
+- `open`: Requests fail fast until `recovery_timeout` is passed.
+- `half-open`: Up to `half_open_max_calls` probe requests pass. A successful
+  probe closes the circuit and a failed probe opens it again.
+"""
+import threading
+from collections import deque
+
+from . import exceptions
+from .retry import RETRYABLE_STATUSES
+from .tools import monotonic
+
+__all__ = (
+    'CLOSED', 'OPEN', 'HALF_OPEN', 'CircuitBreaker', 'CircuitBreakers')
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """Circuit breaker for a verifying server.
+
+    Transport failures and the receipt statuses in `failure_statuses` are
+    failures. Any other response, including invalid receipts, is a success
+    because the server answered.
+
+    :param int failure_threshold: Open the circuit after this number of
+        consecutive failures. `None` to disable.
+    :param float failure_rate: Open the circuit when the ratio of failures in
+        the last `window` calls reaches this value. `None` to disable.
+    :param int window: The number of recent calls for `failure_rate`.
+    :param int min_calls: The minimum number of recent calls to evaluate
+        `failure_rate`.
+    :param float recovery_timeout: Seconds to keep the circuit open before
+        letting probe requests through.
+    :param int half_open_max_calls: The number of concurrent probe requests.
+    :param failure_statuses: Receipt status codes regarded as failures.
+    """
+
+    def __init__(
+            self, failure_threshold=5, failure_rate=None, window=20,
+            min_calls=10, recovery_timeout=30.0, half_open_max_calls=1,
+            failure_statuses=RETRYABLE_STATUSES):
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.failure_statuses = frozenset(failure_statuses)
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self._rejected = 0
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} state={self.state}>'.format(self=self)
+
+    def _update_state(self):
+        if self._state == OPEN and \
+                monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = monotonic()
+        self._outcomes.clear()
+
+    def _close(self):
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._outcomes.clear()
+
+    @property
+    def state(self):
+        """One of `closed`, `open` and `half-open`."""
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def allow(self):
+        """Test a request can be sent now. In `half-open` state, a `True`
+        result takes a probe slot until the outcome is recorded.
+        """
+        with self._lock:
+            self._update_state()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and \
+                    self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._close()
+                return
+            self._consecutive_failures = 0
+            self._outcomes.append(False)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            if self._state == OPEN:
+                return
+            self._consecutive_failures += 1
+            self._outcomes.append(True)
+            if self.failure_threshold is not None and \
+                    self._consecutive_failures >= self.failure_threshold:
+                self._open()
+            elif self.failure_rate is not None and \
+                    len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) >= self.failure_rate * len(self._outcomes):
+                self._open()
+
+    def release(self):
+        """Return a probe slot without an outcome, e.g. on cancellation."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def is_failure(self, error):
+        """Test the given exception from a request is a server failure."""
+        if isinstance(error, exceptions.InvalidReceipt):
+            return error.status in self.failure_statuses
+        return isinstance(error, exceptions.ItunesServerNotAvailable)
+
+    def record(self, error):
+        """Record the outcome of a request. `error` is `None` for success.
+
+        An attempt cut by the deadline of the caller tells nothing about the
+        server, so :class:`itunesiap.exceptions.DeadlineExceeded` is not
+        recorded.
+        """
+        if isinstance(error, exceptions.DeadlineExceeded):
+            self.release()
+        elif error is None:
+            self.record_success()
+        elif self.is_failure(error):
+            self.record_failure()
+        elif isinstance(error, exceptions.RequestError):
+            self.record_success()
+        else:
+            self.release()
+
+    def reset(self):
+        with self._lock:
+            self._close()
+
+    def stats(self):
+        """Return the inspectable state as a :class:`dict`."""
+        with self._lock:
+            self._update_state()
+            calls = len(self._outcomes)
+            return {
+                'state': self._state,
+                'consecutive_failures': self._consecutive_failures,
+                'recent_calls': calls,
+                'recent_failure_rate': float(sum(self._outcomes)) / calls if calls else 0.0,
+                'opened_at': self._opened_at,
+                'rejected': self._rejected,
+            }
+
+    def __enter__(self):
+        if not self.allow():
+            raise exceptions.CircuitOpen(state=self.state)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.record(exc_value)
+
+
+class CircuitBreakers(object):
+    """The collection of :class:`CircuitBreaker` for each verification URL.
+
+    Breakers are created on demand with the given options.
+    See :class:`CircuitBreaker` for the options.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} {states}>'.format(self=self, states=self.states())
+
+    def get(self, url):
+        """Return the breaker for `url`."""
+        try:
+            return self._breakers[url]
+        except KeyError:
+            with self._lock:
+                if url not in self._breakers:
+                    self._breakers[url] = CircuitBreaker(**self.options)
+                return self._breakers[url]
+
+    __getitem__ = get
+
+    def states(self):
+        """Return a :class:`dict` of url to the state."""
+        return dict((url, breaker.state) for url, breaker in list(self._breakers.items()))
+
+    def stats(self):
+        """Return a :class:`dict` of url to :meth:`CircuitBreaker.stats`."""
+        return dict((url, breaker.stats()) for url, breaker in list(self._breakers.items()))
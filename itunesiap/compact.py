@@ -0,0 +1,572 @@
+""":mod:`itunesiap.compact`
+
+Compact binary serialization of the JSON data of responses.
+
+It is the format of :meth:`itunesiap.receipt.Response.to_bytes` to cache and
+queue responses without JSON:
+
+.. sourcecode:: python
+
+    >>> data = response.to_bytes(fields=itunesiap.compact.without_bloat)
+    >>> response = itunesiap.Response.from_bytes(data)
+    >>> response.status  # only the top level is decoded
+
+- Field names are encoded as the indexes of :data:`FIELD_NAMES` and the
+  table of the other names in the header.
+- Decimal strings like `*_ms` fields and transaction IDs are varints.
+  Dates like `2013-01-01 00:00:00 Etc/GMT` are varints of the seconds
+  with the time zone name.
+- Strings repeated in the data are stored once in the table of strings.
+- Objects and arrays are prefixed by their sizes, so they are skipped
+  without decoding.
+
+Decoding is lazy. :func:`loads` returns read-only :class:`LazyObject` and
+:class:`LazyArray` which decode their own level on the first access and
+leave the nested ones encoded until they are accessed. Use
+:func:`materialize` to get plain :class:`dict` and :class:`list`, for
+example to dump JSON. A corrupted level raises :exc:`ValueError` when it is
+decoded.
+"""
+import re
+import time
+import struct
+import calendar
+
+import six
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:  # pragma: no cover
+    from collections import Mapping, Sequence
+
+__all__ = (
+    'FIELD_NAMES', 'dumps', 'loads', 'materialize', 'without_bloat',
+    'LazyObject', 'LazyArray')
+
+
+MAGIC = b'IAP'
+VERSION = 1
+
+#: Field names encoded as their indexes. Only appending is compatible.
+FIELD_NAMES = (
+    'status', 'environment', 'receipt', 'latest_receipt', 'latest_receipt_info',
+    'latest_expired_receipt_info', 'pending_renewal_info', 'is-retryable',
+    'receipt_type', 'adam_id', 'app_item_id', 'bundle_id',
+    'application_version', 'download_id', 'version_external_identifier',
+    'receipt_creation_date', 'receipt_creation_date_ms',
+    'receipt_creation_date_pst', 'request_date', 'request_date_ms',
+    'request_date_pst', 'original_purchase_date', 'original_purchase_date_ms',
+    'original_purchase_date_pst', 'original_application_version',
+    'expiration_date', 'expiration_date_ms', 'expiration_date_pst', 'in_app',
+    'quantity', 'product_id', 'transaction_id', 'original_transaction_id',
+    'purchase_date', 'purchase_date_ms', 'purchase_date_pst', 'expires_date',
+    'expires_date_ms', 'expires_date_pst', 'expires_date_formatted',
+    'expires_date_formatted_pst', 'web_order_line_item_id', 'is_trial_period',
+    'is_in_intro_offer_period', 'cancellation_date', 'cancellation_date_ms',
+    'cancellation_date_pst', 'cancellation_reason', 'auto_renew_product_id',
+    'auto_renew_status', 'expiration_intent', 'is_in_billing_retry_period',
+    'price_consent_status', 'grace_period_expires_date',
+    'grace_period_expires_date_ms', 'grace_period_expires_date_pst',
+    'subscription_group_identifier', 'promotional_offer_id',
+    'offer_code_ref_name', 'in_app_ownership_type', 'is_upgraded',
+    'unique_identifier', 'unique_vendor_identifier', 'item_id', 'bid', 'bvrs',
+    'app_account_token', 'signing-status', 'pod',
+)
+_FIELD_INDEXES = dict((name, index) for index, name in enumerate(FIELD_NAMES))
+
+NULL = 0
+FALSE = 1
+TRUE = 2
+INTEGER = 3
+STRING = 4
+DIGITS = 5
+FLOAT = 6
+OBJECT = 7
+ARRAY = 8
+REFERENCE = 9
+DATE = 10
+
+_DIGITS = re.compile(r'(?:0|[1-9][0-9]{0,17})\Z')
+_DATE = re.compile(r'([0-9]{4}-[0-9]{2}-[0-9]{2}) ([01][0-9]|2[0-3]):([0-5][0-9]):([0-5][0-9]) ([A-Za-z][A-Za-z0-9_/+-]*)\Z')
+_DAY_FORMAT = '%Y-%m-%d'
+_FLOAT = struct.Struct('<d')
+
+
+def without_bloat(name):
+    """A projection for :func:`dumps` dropping `*_pst` dates and
+    `latest_receipt`, which are not needed to check purchases.
+    """
+    return not name.endswith('_pst') and name != 'latest_receipt'
+
+
+def _projection(fields):
+    if fields is None or callable(fields):
+        return fields
+    return frozenset(fields).__contains__
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _day_seconds(day):
+    """Return the seconds of `YYYY-MM-DD` or `None` if it is not a valid
+    date.
+    """
+    try:
+        seconds = calendar.timegm(time.strptime(day, _DAY_FORMAT))
+    except (ValueError, OverflowError):
+        return None
+    # keep only the days formatted back to the same text
+    if time.strftime(_DAY_FORMAT, time.gmtime(seconds)) != day:
+        return None
+    return seconds
+
+
+def _format_date(seconds, zone, days):
+    """Format the local time `seconds` like `2013-01-01 00:00:00 Etc/GMT`.
+    `days` caches the formatted days.
+    """
+    day, seconds = divmod(seconds, 86400)
+    text = days.get(day)
+    if text is None:
+        text = days[day] = time.strftime(_DAY_FORMAT, time.gmtime(day * 86400))
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return u'{0} {1:02d}:{2:02d}:{3:02d} {4}'.format(text, hour, minute, second, zone)
+
+
+class _Encoder(object):
+
+    def __init__(self, projection):
+        self.projection = projection
+        self.names = {}
+        self.strings = {}
+        self.counts = {}
+        # the counted strings by the value
+        self.counted = {}
+        # encoded strings and names by the value
+        self.tokens = {}
+        self.keys = {}
+        self.days = {}
+
+    def _items(self, value):
+        projection = self.projection
+        if projection is None:
+            return value.items()
+        return [(key, item) for key, item in value.items() if projection(key)]
+
+    def count(self, value):
+        """Collect the unknown names and the repeated strings."""
+        if isinstance(value, (dict, Mapping)):
+            names = self.names
+            for key, item in self._items(value):
+                if key not in _FIELD_INDEXES and key not in names:
+                    names[key] = len(FIELD_NAMES) + len(names)
+                self._count(item)
+        elif isinstance(value, (list, Sequence)) and not isinstance(value, six.string_types):
+            for item in value:
+                self._count(item)
+        else:
+            self._count(value)
+
+    def _count(self, value):
+        # strings are counted inline as most of the values are
+        if isinstance(value, six.string_types):
+            counted = self.counted.get(value)
+            if counted is None:
+                counted = self.counted[value] = self._counted(value)
+            if counted:
+                self.counts[counted] = self.counts.get(counted, 0) + 1
+        elif value is not None and not isinstance(value, (bool, float) + six.integer_types):
+            self.count(value)
+
+    @staticmethod
+    def _counted(value):
+        if len(value) <= 3 or _DIGITS.match(value):
+            return ''
+        match = _DATE.match(value)
+        if match is not None:
+            return match.group(5)
+        return value
+
+    def parse_date(self, value):
+        """Return the seconds of the local time and the time zone name of a
+        date like `2013-01-01 00:00:00 Etc/GMT` or `None` if it is not
+        exactly restorable.
+        """
+        match = _DATE.match(value)
+        if match is None:
+            return None
+        day, hour, minute, second, zone = match.groups()
+        seconds = self.days.get(day, False)
+        if seconds is False:
+            seconds = self.days[day] = _day_seconds(day)
+        if seconds is None:
+            return None
+        return seconds + int(hour) * 3600 + int(minute) * 60 + int(second), zone
+
+    def header(self, out):
+        for value, count in self.counts.items():
+            if count > 1:
+                self.strings[value] = len(self.strings)
+        for table in (self.names, self.strings):
+            _write_varint(out, len(table))
+            for value in sorted(table, key=table.__getitem__):
+                self.write_string(out, value)
+
+    @staticmethod
+    def write_string(out, value):
+        if isinstance(value, six.text_type):
+            value = value.encode('utf-8')
+        _write_varint(out, len(value))
+        out += value
+
+    def token(self, value):
+        """Encode the string `value`."""
+        token = bytearray()
+        index = self.strings.get(value)
+        if index is not None:
+            token.append(REFERENCE)
+            _write_varint(token, index)
+        elif _DIGITS.match(value):
+            token.append(DIGITS)
+            _write_varint(token, int(value))
+        else:
+            date = self.parse_date(value) if value[:1].isdigit() else None
+            if date is not None:
+                token.append(DATE)
+                _write_varint(token, _zigzag(date[0]))
+                token += self.tokens.get(date[1]) or self.token(date[1])
+            else:
+                token.append(STRING)
+                self.write_string(token, value)
+        self.tokens[value] = token
+        return token
+
+    def write(self, out, value):
+        if isinstance(value, six.string_types):
+            out += self.tokens.get(value) or self.token(value)
+        elif isinstance(value, dict):
+            self.write_object(out, value)
+        elif value is None:
+            out.append(NULL)
+        elif value is True:
+            out.append(TRUE)
+        elif value is False:
+            out.append(FALSE)
+        elif isinstance(value, six.integer_types):
+            out.append(INTEGER)
+            _write_varint(out, _zigzag(value))
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += _FLOAT.pack(value)
+        elif isinstance(value, Mapping):
+            self.write_object(out, value)
+        elif isinstance(value, Sequence):
+            body = bytearray()
+            for item in value:
+                self.write(body, item)
+            out.append(ARRAY)
+            _write_varint(out, len(body))
+            out += body
+        else:
+            raise TypeError(u'Not serializable {0!r}'.format(value))
+
+    def write_object(self, out, value):
+        body = bytearray()
+        tokens = self.tokens
+        keys = self.keys
+        string_types = six.string_types
+        for key, item in self._items(value):
+            key_token = keys.get(key)
+            if key_token is None:
+                key_token = keys[key] = bytearray()
+                index = _FIELD_INDEXES.get(key)
+                _write_varint(key_token, self.names[key] if index is None else index)
+            body += key_token
+            if isinstance(item, string_types):
+                body += tokens.get(item) or self.token(item)
+            else:
+                self.write(body, item)
+        out.append(OBJECT)
+        _write_varint(out, len(body))
+        out += body
+
+
+def dumps(value, fields=None):
+    """Serialize the JSON compatible `value` into :class:`bytes`.
+
+    :param fields: The projection of the fields of the objects in every level.
+        Only the names in it are kept if it is a collection of names. A
+        callable taking a name and returning whether to keep it also can be
+        given like :func:`without_bloat`. `None` keeps every field.
+    """
+    if isinstance(value, LazyObject) and value._message.root is value and fields is None:
+        return value._message.data
+    encoder = _Encoder(_projection(fields))
+    encoder.count(value)
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    encoder.header(out)
+    encoder.write(out, value)
+    return bytes(out)
+
+
+def _read_varint(data, pos):
+    byte = data[pos]
+    pos += 1
+    if byte < 0x80:
+        return byte, pos
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+class _Message(object):
+    """The buffer and the tables shared by the lazy values of a message."""
+
+    def __init__(self, data):
+        self.data = data
+        self.buffer = bytearray(data) if six.PY2 else data
+        self.names = list(FIELD_NAMES)
+        self.strings = []
+        self.dates = {}
+        self.days = {}
+        self.root = None
+
+    def read_string(self, pos):
+        length, pos = _read_varint(self.buffer, pos)
+        end = pos + length
+        if end > len(self.data):
+            raise ValueError(u'Truncated string at {0}'.format(pos))
+        return self.data[pos:end].decode('utf-8'), end
+
+    def string(self, index, pos):
+        if index >= len(self.strings):
+            raise ValueError(u'Unknown string {0} at {1}'.format(index, pos))
+        return self.strings[index]
+
+    def read(self, pos):
+        """Read the value at `pos` and return it with the next offset.
+
+        :raises IndexError: When the buffer ends in the value.
+        """
+        buffer = self.buffer
+        tag = buffer[pos]
+        pos += 1
+        if tag == REFERENCE and buffer[pos] < 0x80:
+            return self.string(buffer[pos], pos), pos + 1
+        if tag == DIGITS:
+            value, pos = _read_varint(buffer, pos)
+            return six.text_type(value), pos
+        if tag == REFERENCE:
+            index, pos = _read_varint(buffer, pos)
+            return self.string(index, pos), pos
+        if tag == STRING:
+            return self.read_string(pos)
+        if tag == DATE:
+            value, pos = _read_varint(buffer, pos)
+            zone, pos = self.read(pos)
+            if not isinstance(zone, six.text_type):
+                raise ValueError(u'Invalid time zone at {0}'.format(pos))
+            date = self.dates.get((value, zone))
+            if date is None:
+                try:
+                    date = _format_date(_unzigzag(value), zone, self.days)
+                except (OverflowError, OSError):
+                    raise ValueError(u'Invalid date at {0}'.format(pos))
+                self.dates[value, zone] = date
+            return date, pos
+        if tag == OBJECT or tag == ARRAY:
+            length, pos = _read_varint(buffer, pos)
+            end = pos + length
+            if end > len(buffer):
+                raise ValueError(u'Truncated value at {0}'.format(pos))
+            cls = LazyObject if tag == OBJECT else LazyArray
+            return cls(self, pos, end), end
+        if tag == INTEGER:
+            value, pos = _read_varint(buffer, pos)
+            return _unzigzag(value), pos
+        if tag == NULL:
+            return None, pos
+        if tag == TRUE:
+            return True, pos
+        if tag == FALSE:
+            return False, pos
+        if tag == FLOAT:
+            if pos + _FLOAT.size > len(buffer):
+                raise ValueError(u'Truncated float at {0}'.format(pos))
+            return _FLOAT.unpack_from(self.data, pos)[0], pos + _FLOAT.size
+        raise ValueError(u'Unknown tag {0} at {1}'.format(tag, pos - 1))
+
+
+class LazyObject(Mapping):
+    """A read-only JSON object decoded on the first access."""
+    __slots__ = ('_message', '_start', '_end', '_items')
+
+    def __init__(self, message, start, end):
+        self._message = message
+        self._start = start
+        self._end = end
+        self._items = None
+
+    def _load(self):
+        items = self._items
+        if items is None:
+            message = self._message
+            buffer = message.buffer
+            names = message.names
+            items = {}
+            pos = self._start
+            end = self._end
+            read = message.read
+            try:
+                while pos < end:
+                    index = buffer[pos]
+                    if index < 0x80:
+                        pos += 1
+                    else:
+                        index, pos = _read_varint(buffer, pos)
+                    if index >= len(names):
+                        raise ValueError(u'Unknown name {0} at {1}'.format(index, pos))
+                    items[names[index]], pos = read(pos)
+            except IndexError:
+                raise ValueError(u'Truncated object at {0}'.format(self._start))
+            if pos != end:
+                raise ValueError(u'Overrun object at {0}'.format(self._start))
+            self._items = items
+        return items
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        return repr(self._load())
+
+    def __reduce__(self):
+        return dict, (materialize(self),)
+
+
+class LazyArray(Sequence):
+    """A read-only JSON array decoded on the first access."""
+    __slots__ = ('_message', '_start', '_end', '_items')
+
+    def __init__(self, message, start, end):
+        self._message = message
+        self._start = start
+        self._end = end
+        self._items = None
+
+    def _load(self):
+        items = self._items
+        if items is None:
+            read = self._message.read
+            items = []
+            pos = self._start
+            end = self._end
+            try:
+                while pos < end:
+                    item, pos = read(pos)
+                    items.append(item)
+            except IndexError:
+                raise ValueError(u'Truncated array at {0}'.format(self._start))
+            if pos != end:
+                raise ValueError(u'Overrun array at {0}'.format(self._start))
+            self._items = items
+        return items
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, six.string_types):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._load())
+
+    def __reduce__(self):
+        return list, (materialize(self),)
+
+
+def loads(data):
+    """Deserialize :class:`bytes` from :func:`dumps`. Objects and arrays are
+    returned as :class:`LazyObject` and :class:`LazyArray`.
+
+    :raises ValueError: When `data` is not in the format.
+    """
+    data = bytes(data)
+    if data[:len(MAGIC)] != MAGIC or len(data) <= len(MAGIC):
+        raise ValueError(u'Not a compact response')
+    message = _Message(data)
+    pos = len(MAGIC)
+    version = message.buffer[pos]
+    if version != VERSION:
+        raise ValueError(u'Unsupported version {0}'.format(version))
+    pos += 1
+    try:
+        for table in (message.names, message.strings):
+            count, pos = _read_varint(message.buffer, pos)
+            for _ in range(count):
+                value, pos = message.read_string(pos)
+                table.append(value)
+        value, pos = message.read(pos)
+    except IndexError:
+        raise ValueError(u'Truncated compact response')
+    if isinstance(value, LazyObject):
+        message.root = value
+    return value
+
+
+def materialize(value):
+    """Return `value` with plain :class:`dict` and :class:`list` instead of
+    the lazy ones.
+    """
+    if isinstance(value, Mapping):
+        return dict((key, materialize(item)) for key, item in value.items())
+    if isinstance(value, (LazyArray, list)):
+        return [materialize(item) for item in value]
+    return value
@@ -0,0 +1,41 @@
+""":mod:`itunesiap.deadline`
+
+:class:`Deadline` is the total time budget of a verification. It covers every
+attempt including retries and the sandbox fallback in review mode.
+
+.. sourcecode:: python
+
+    >>> itunesiap.verify(receipt, env=itunesiap.env.review, deadline=5.0)
+"""
+from .tools import monotonic
+
+__all__ = ('Deadline',)
+
+
+class Deadline(object):
+    """A time budget which started at the creation.
+
+    :param float budget: The total time budget in seconds.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = monotonic() + budget
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} budget={self.budget} remaining={remaining:.3f}>'.format(self=self, remaining=self.remaining())
+
+    def remaining(self):
+        """The remaining budget in seconds. Never less than 0."""
+        return max(0.0, self.expires_at - monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0.0
+
+    def timeout(self, timeout=None):
+        """Return `timeout` shortened to the remaining budget."""
+        remaining = self.remaining()
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
@@ -0,0 +1,234 @@
+""":mod:`itunesiap.delta`
+
+Changes of a response since the previous verification of the receipt.
+
+.. sourcecode:: python
+
+    >>> response = itunesiap.verify(receipt, exclude_old_transactions=True)
+    >>> delta = response.diff(state)
+    >>> for purchase in delta.purchases:  # only the new ones
+    ...     grant(purchase)
+    >>> for purchase in delta.cancelled:
+    ...     revoke(purchase)
+    >>> state = delta.state  # for the next time, see State.to_bytes()
+
+Only the transaction ids of the raw records are looked up in the hashed sets
+of the previous ones, so the unchanged history is not wrapped nor parsed.
+The state keeps the transaction ids of the previous responses too, so it
+pairs with `exclude_old_transactions`, which omits the old renewals.
+
+The new state shares the sets of the previous one and adds a layer of the new
+transaction ids. The layers are merged like a binary counter when a layer is
+not smaller than the one below it, so a state has O(log n) layers and a new
+transaction id is copied O(log n) times over the lifetime of the states.
+"""
+import six
+
+from . import compact
+
+__all__ = ('State', 'Delta', 'diff', 'RENEWAL_FIELDS')
+
+
+#: The fields of `pending_renewal_info` compared by :func:`diff`.
+RENEWAL_FIELDS = (
+    'auto_renew_status', 'auto_renew_product_id', 'is_in_billing_retry_period',
+    'expiration_intent', 'grace_period_expires_date_ms', 'price_consent_status')
+
+_EMPTY = frozenset()
+
+
+def _records(data):
+    """Return the raw purchase records of the response data."""
+    receipt = data.get('receipt') or {}
+    records = receipt.get('in_app')
+    if records is None:
+        records = [receipt] if 'transaction_id' in receipt else []
+    latest = data.get('latest_receipt_info')
+    if not latest:
+        return records
+    if isinstance(latest, compact.Mapping):  # iOS6 style
+        return list(records) + [latest]
+    return list(records) + list(latest)
+
+
+def _add_layer(layers, keys):
+    """Return the tuple of disjoint frozensets `layers` with the new `keys`
+    on the top.
+    """
+    layers = list(layers)
+    top = frozenset(keys)
+    while layers and len(layers[-1]) <= len(top):
+        top = layers.pop() | top
+    layers.append(top)
+    return tuple(layers)
+
+
+def _merge(layers):
+    if not layers:
+        return _EMPTY
+    if len(layers) == 1:
+        return layers[0]
+    return frozenset().union(*layers)
+
+
+def _is_cancelled(record):
+    return bool(record.get('cancellation_date_ms') or record.get('cancellation_date'))
+
+
+class State(object):
+    """The digest of the verified responses of a receipt to compute the
+    next :class:`Delta`.
+
+    :param transaction_ids: The seen transaction ids.
+    :param cancelled: The transaction ids seen cancelled.
+    :param dict renewals: The values of :data:`RENEWAL_FIELDS` by
+        `original_transaction_id`.
+    """
+
+    def __init__(self, transaction_ids=_EMPTY, cancelled=_EMPTY, renewals=None):
+        transaction_ids = frozenset(transaction_ids)
+        cancelled = frozenset(cancelled)
+        self._transaction_ids = (transaction_ids,) if transaction_ids else ()
+        self._cancelled = (cancelled,) if cancelled else ()
+        self.renewals = dict(renewals or {})
+
+    @classmethod
+    def _from_layers(cls, transaction_ids, cancelled, renewals):
+        state = cls.__new__(cls)
+        state._transaction_ids = transaction_ids
+        state._cancelled = cancelled
+        state.renewals = renewals
+        return state
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} transactions={count}>'.format(
+            self=self, count=len(self))
+
+    def __len__(self):
+        return sum(len(layer) for layer in self._transaction_ids)
+
+    @property
+    def transaction_ids(self):
+        """The :class:`frozenset` of the seen transaction ids."""
+        merged = _merge(self._transaction_ids)
+        self._transaction_ids = (merged,) if merged else ()
+        return merged
+
+    @property
+    def cancelled(self):
+        """The :class:`frozenset` of the transaction ids seen cancelled."""
+        merged = _merge(self._cancelled)
+        self._cancelled = (merged,) if merged else ()
+        return merged
+
+    def __eq__(self, other):
+        return isinstance(other, State) and (
+            self.transaction_ids, self.cancelled, self.renewals) == (
+            other.transaction_ids, other.cancelled, other.renewals)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def to_bytes(self):
+        """Serialize the state into the compact format of
+        :mod:`itunesiap.compact`.
+        """
+        return compact.dumps({
+            'transaction_ids': sorted(self.transaction_ids),
+            'cancelled': sorted(self.cancelled),
+            'renewals': dict((key, list(values)) for key, values in self.renewals.items()),
+        })
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a state from :meth:`to_bytes`.
+
+        :raises ValueError: When `data` is not in the format.
+        """
+        try:
+            value = compact.materialize(compact.loads(data))
+            return cls(
+                value['transaction_ids'], value['cancelled'],
+                dict((key, tuple(values)) for key, values in value['renewals'].items()))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ValueError('Not a state')
+
+
+class Delta(object):
+    """The changes of a response since a :class:`State`.
+
+    :ivar purchases: The list of :class:`itunesiap.receipt.InApp` of the new
+        transaction ids.
+    :ivar cancelled: The list of :class:`itunesiap.receipt.InApp` cancelled
+        since the state, including the new ones.
+    :ivar renewals: The list of :class:`itunesiap.receipt.PendingRenewalInfo`
+        whose :data:`RENEWAL_FIELDS` are changed or new.
+    :ivar state: The :class:`State` including the response.
+    """
+
+    def __init__(self, purchases, cancelled, renewals, state):
+        self.purchases = purchases
+        self.cancelled = cancelled
+        self.renewals = renewals
+        self.state = state
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} purchases={purchases} cancelled={cancelled} renewals={renewals}>'.format(
+            purchases=len(self.purchases), cancelled=len(self.cancelled),
+            renewals=len(self.renewals), self=self)
+
+    def __bool__(self):
+        return bool(self.purchases or self.cancelled or self.renewals)
+
+    __nonzero__ = __bool__
+
+
+def diff(response, previous=None):
+    """Return the :class:`Delta` of `response` since `previous`.
+
+    :param response: A :class:`itunesiap.receipt.Response`.
+    :param previous: A :class:`State`, the previous
+        :class:`itunesiap.receipt.Response` or `None` for the first one.
+    :rtype: :class:`Delta`
+    """
+    from .receipt import InApp, PendingRenewalInfo
+    if previous is None:
+        previous = State()
+    elif not isinstance(previous, State):
+        previous = diff(previous).state
+
+    seen = previous._transaction_ids
+    seen_cancelled = previous._cancelled
+    new_ids = set()
+    new_cancelled = set()
+    purchases = []
+    cancelled = []
+    for record in _records(response._):
+        transaction_id = six.text_type(record['transaction_id'])
+        if transaction_id not in new_ids and not any(transaction_id in layer for layer in seen):
+            new_ids.add(transaction_id)
+            purchases.append(InApp(record))
+        if transaction_id not in new_cancelled and _is_cancelled(record) and \
+                not any(transaction_id in layer for layer in seen_cancelled):
+            new_cancelled.add(transaction_id)
+            cancelled.append(InApp(record))
+
+    renewals = []
+    renewal_values = previous.renewals
+    for info in response._.get('pending_renewal_info') or ():
+        original_transaction_id = six.text_type(info.get('original_transaction_id'))
+        values = tuple(info.get(field) for field in RENEWAL_FIELDS)
+        if renewal_values.get(original_transaction_id) != values:
+            if renewal_values is previous.renewals:
+                renewal_values = dict(renewal_values)
+            renewal_values[original_transaction_id] = values
+            renewals.append(PendingRenewalInfo(info))
+
+    # the layers are shared, and the state too when nothing changed
+    state = previous
+    if new_ids or new_cancelled or renewals:
+        state = State._from_layers(
+            _add_layer(seen, new_ids) if new_ids else seen,
+            _add_layer(seen_cancelled, new_cancelled) if new_cancelled else seen_cancelled,
+            renewal_values)
+    return Delta(purchases, cancelled, renewals, state)
@@ -0,0 +1,152 @@
+""":mod:`itunesiap.dispatcher`
+
+Priority-aware admission of :func:`itunesiap.aioverify` calls. Only
+available in python3.5+.
+
+A process may run both purchase confirmations, which a user is waiting for,
+and background jobs like subscription refreshes. :class:`PriorityDispatcher`
+limits the number of concurrent requests to Apple and decides who goes next:
+
+- An `interactive` request always gets the next free slot.
+- A `background` request is admitted only when more than `reserved` slots are
+  free, so some capacity is always left for interactive requests.
+
+.. sourcecode:: python
+
+    >>> dispatcher = itunesiap.dispatcher.PriorityDispatcher(capacity=20, reserved=5)
+    >>> env = itunesiap.env.production.clone(dispatcher=dispatcher)
+    >>> await itunesiap.aioverify(receipt, env=env)  # interactive
+    >>> await itunesiap.aioverify(receipt, env=env, priority='background')
+    >>> dispatcher.stats()['background']['queued']
+"""
+import asyncio
+from collections import deque
+
+from .tools import monotonic
+
+__all__ = ('INTERACTIVE', 'BACKGROUND', 'PRIORITIES', 'PriorityDispatcher')
+
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+#: Priority classes in the order of precedence.
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+
+class _ClassStats(object):
+
+    def __init__(self):
+        self.admitted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait):
+        self.admitted += 1
+        self.wait_total += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+
+
+class _DispatcherSlot:
+
+    def __init__(self, dispatcher, priority):
+        self.dispatcher = dispatcher
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.dispatcher.acquire(self.priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        self.dispatcher.release()
+
+
+class PriorityDispatcher(object):
+    """Admission control of concurrent verifications by priority classes.
+
+    A dispatcher belongs to an event loop once it is used.
+
+    :param int capacity: The maximum number of concurrent requests.
+    :param int reserved: The number of slots background requests cannot take.
+    """
+
+    def __init__(self, capacity=10, reserved=1):
+        assert 0 <= reserved < capacity
+        self.capacity = capacity
+        self.reserved = reserved
+        self.in_use = 0
+        self._waiters = dict((priority, deque()) for priority in PRIORITIES)
+        self._stats = dict((priority, _ClassStats()) for priority in PRIORITIES)
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} capacity={self.capacity} reserved={self.reserved} in_use={self.in_use}>'.format(self=self)
+
+    def _admissible(self, priority):
+        free = self.capacity - self.in_use
+        if priority == INTERACTIVE:
+            return free > 0
+        return free > self.reserved and not self._waiters[INTERACTIVE]
+
+    def _wake(self):
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+            while waiters and self._admissible(priority):
+                future, queued_at = waiters.popleft()
+                if future.done():  # cancelled
+                    continue
+                self.in_use += 1
+                self._stats[priority].record(monotonic() - queued_at)
+                future.set_result(None)
+
+    async def acquire(self, priority=INTERACTIVE):
+        """Wait for a slot of the priority class."""
+        if priority not in self._waiters:
+            raise ValueError(u'Unknown priority {0!r}'.format(priority))
+        waiters = self._waiters[priority]
+        if not waiters and self._admissible(priority):
+            self.in_use += 1
+            self._stats[priority].record(0.0)
+            return
+        waiter = (asyncio.get_event_loop().create_future(), monotonic())
+        waiters.append(waiter)
+        try:
+            await waiter[0]
+        except asyncio.CancelledError:
+            if waiter[0].cancelled():
+                try:
+                    waiters.remove(waiter)
+                except ValueError:  # already skipped by _wake
+                    pass
+                self._wake()
+            else:  # admitted at the same time of the cancellation
+                self.release()
+            raise
+
+    def release(self):
+        """Return a slot and admit the next waiters."""
+        self.in_use -= 1
+        self._wake()
+
+    def slot(self, priority=INTERACTIVE):
+        """Return an asynchronous context manager holding a slot."""
+        return _DispatcherSlot(self, priority)
+
+    def stats(self):
+        """Return the queue depth and the wait time of each priority class.
+
+        Waits are in seconds and only of the admitted requests.
+        """
+        stats = {'capacity': self.capacity, 'in_use': self.in_use}
+        for priority in PRIORITIES:
+            class_stats = self._stats[priority]
+            admitted = class_stats.admitted
+            stats[priority] = {
+                'queued': sum(
+                    1 for future, _ in self._waiters[priority]
+                    if not future.done()),
+                'admitted': admitted,
+                'wait_total': class_stats.wait_total,
+                'wait_max': class_stats.wait_max,
+                'wait_mean': class_stats.wait_total / admitted if admitted else 0.0,
+            }
+        return stats
@@ -0,0 +1,161 @@
+""":mod:`itunesiap.endpoint`
+
+Verification endpoints of each server carried by the environment.
+
+By default, :class:`itunesiap.request.Request` sends requests to Apple
+directly. To send them through egress proxies, sidecars or a local stand-in,
+give the lists of equivalent endpoints of each server as `endpoints` of the
+environment.
+
+.. sourcecode:: python
+
+    >>> endpoints = itunesiap.endpoint.Endpoints(
+    ...     production=['http://egress-1/verifyReceipt', 'http://egress-2/verifyReceipt'],
+    ...     sandbox='http://egress-1/sandbox/verifyReceipt')
+    >>> env = itunesiap.env.review.clone(endpoints=endpoints)
+    >>> itunesiap.verify(receipt, env=env)
+
+Each request goes to the endpoint with the least outstanding requests. When
+an endpoint is not available, including an open circuit of
+:mod:`itunesiap.circuitbreaker`, the request fails over to the next one. The
+other errors like invalid receipts are not retried on the other endpoints.
+"""
+import itertools
+import threading
+
+import six
+
+from . import exceptions
+
+__all__ = ('EndpointPool', 'Endpoints')
+
+
+class _Track(object):
+
+    def __init__(self, pool, url):
+        self.pool = pool
+        self.url = url
+
+    def __enter__(self):
+        self.pool._start(self.url)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.pool._finish(self.url, exc_value)
+
+
+class EndpointPool(object):
+    """Equivalent endpoints of a server balanced by the least outstanding
+    requests.
+
+    :param urls: The list of verification URLs.
+    """
+
+    def __init__(self, urls):
+        if not urls:
+            raise ValueError(u'No endpoint')
+        self.urls = tuple(urls)
+        self._outstanding = dict((url, 0) for url in self.urls)
+        self._requests = dict((url, 0) for url in self.urls)
+        self._failures = dict((url, 0) for url in self.urls)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} {self.urls!r}>'.format(self=self)
+
+    def __contains__(self, url):
+        return url in self._outstanding
+
+    def candidates(self):
+        """Return the URLs in the order to try. Ties of the outstanding
+        requests are rotated for each call.
+        """
+        size = len(self.urls)
+        if size == 1:
+            return list(self.urls)
+        with self._lock:
+            start = next(self._counter) % size
+            order = sorted(
+                range(size),
+                key=lambda i: (self._outstanding[self.urls[i]], (i - start) % size))
+        return [self.urls[i] for i in order]
+
+    def track(self, url):
+        """Return a context manager counting an outstanding request to
+        `url`.
+        """
+        return _Track(self, url)
+
+    def _start(self, url):
+        with self._lock:
+            self._outstanding[url] += 1
+            self._requests[url] += 1
+
+    def _finish(self, url, error):
+        with self._lock:
+            self._outstanding[url] -= 1
+            if Endpoints.is_failover(error):
+                self._failures[url] += 1
+
+    def stats(self):
+        """Return a :class:`dict` of url to the usage."""
+        with self._lock:
+            return dict(
+                (url, {
+                    'outstanding': self._outstanding[url],
+                    'requests': self._requests[url],
+                    'failures': self._failures[url]})
+                for url in self.urls)
+
+
+class Endpoints(object):
+    """Endpoints of production and sandbox servers.
+
+    :param production: A URL or a list of URLs of production server. Apple
+        production server if not given.
+    :param sandbox: A URL or a list of URLs of sandbox server. Apple sandbox
+        server if not given.
+    """
+
+    def __init__(self, production=None, sandbox=None):
+        from .request import RequestBase
+        if production is None:
+            production = RequestBase.PRODUCTION_VALIDATION_URL
+        if sandbox is None:
+            sandbox = RequestBase.SANDBOX_VALIDATION_URL
+        self.pools = {
+            'production': EndpointPool(_urls(production)),
+            'sandbox': EndpointPool(_urls(sandbox)),
+        }
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} production={production!r} sandbox={sandbox!r}>'.format(
+            self=self, production=self.pools['production'].urls,
+            sandbox=self.pools['sandbox'].urls)
+
+    def __getitem__(self, tier):
+        return self.pools[tier]
+
+    def tier(self, url):
+        """Return the tier of `url` or `None` if it is unknown."""
+        for tier, pool in self.pools.items():
+            if url in pool:
+                return tier
+        return None
+
+    @staticmethod
+    def is_failover(error):
+        """Test the request can be tried on the other endpoints."""
+        return isinstance(error, exceptions.ItunesServerNotAvailable) \
+            and not isinstance(error, exceptions.DeadlineExceeded)
+
+    def stats(self):
+        """Return a :class:`dict` of tier to :meth:`EndpointPool.stats`."""
+        return dict((tier, pool.stats()) for tier, pool in self.pools.items())
+
+
+def _urls(urls):
+    if isinstance(urls, six.string_types):
+        return [urls]
+    return list(urls)
@@ -60,11 +60,52 @@ class Environment(object):
     By passing an environment object to :func:`itunesiap.verify` or
     :func:`itunesiap.request.Request.verify` function, it replaces verifying
     policies.
+
+    :param bool use_production: Verify in production server.
+    :param bool use_sandbox: Verify in sandbox server. When both are set,
+        sandbox server is used only for sandbox receipts.
+    :param float timeout: The connection timeout of each verifying request.
+    :param bool exclude_old_transactions: See :class:`itunesiap.request.Request`.
+    :param bool verify_ssl: SSL verification.
+    :param itunesiap.retry.RetryPolicy retry: Retry policy for transient
+        failures. `None` means no retry.
+    :param float deadline: The total time budget of a verification in seconds
+        including retries and the sandbox fallback. `None` means no limit.
+    :param itunesiap.circuitbreaker.CircuitBreakers circuit_breaker: Circuit
+        breakers for each verification URL. `None` means no breaker.
+    :param itunesiap.hedge.HedgePolicy hedge: Hedging policy to send a second
+        request for a slow one. `None` means no hedge.
+    :param itunesiap.ratelimit.RateLimiter rate_limiter: Client-side rate
+        limiter for each server. `None` means no limit.
+    :param itunesiap.bulkhead.Bulkhead bulkhead: Isolated connection pools and
+        concurrency limits for each server. `None` means a new connection for
+        each request.
+    :param itunesiap.dispatcher.PriorityDispatcher dispatcher: Priority aware
+        admission control of :func:`itunesiap.aioverify`. `None` means no
+        control. :func:`itunesiap.verify` ignores it.
+    :param str priority: The priority class for `dispatcher`, `interactive`
+        or `background`.
+    :param itunesiap.adaptive.AdaptiveTimeout adaptive_timeout: Timeout
+        policy by the observed latencies. It replaces `timeout` of each
+        attempt once enough latencies are observed. `None` means the fixed
+        `timeout`.
+    :param observers: The sequence of :class:`itunesiap.instrument.Observer`
+        receiving the timed events of each verification stage. Empty means
+        no instrumentation.
+    :param itunesiap.endpoint.Endpoints endpoints: The verification URLs of
+        each server. `None` means Apple servers.
+    :param itunesiap.precheck.Precheck precheck: Local pre-check of receipt
+        data before any request. `None` means no pre-check.
+    :param itunesiap.cache.ResponseCache cache: The cache of verified
+        responses. `None` means no cache.
     """
 
     ITEMS = (
         'use_production', 'use_sandbox', 'timeout', 'exclude_old_transactions',
-        'verify_ssl')
+        'verify_ssl', 'retry', 'deadline', 'circuit_breaker', 'hedge',
+        'rate_limiter', 'bulkhead', 'dispatcher', 'priority',
+        'adaptive_timeout', 'observers', 'endpoints', 'precheck',
+        'cache')
 
     def __init__(self, **kwargs):
         self.use_production = kwargs.get('use_production', True)
@@ -72,9 +113,24 @@ class Environment(object):
         self.timeout = kwargs.get('timeout', None)
         self.exclude_old_transactions = kwargs.get('exclude_old_transactions', False)
         self.verify_ssl = kwargs.get('verify_ssl', True)
+        self.retry = kwargs.get('retry', None)
+        self.deadline = kwargs.get('deadline', None)
+        self.circuit_breaker = kwargs.get('circuit_breaker', None)
+        self.hedge = kwargs.get('hedge', None)
+        self.rate_limiter = kwargs.get('rate_limiter', None)
+        self.bulkhead = kwargs.get('bulkhead', None)
+        self.dispatcher = kwargs.get('dispatcher', None)
+        self.priority = kwargs.get('priority', 'interactive')
+        self.adaptive_timeout = kwargs.get('adaptive_timeout', None)
+        self.observers = kwargs.get('observers', ())
+        self.endpoints = kwargs.get('endpoints', None)
+        self.precheck = kwargs.get('precheck', None)
+        self.cache = kwargs.get('cache', None)
 
     def __repr__(self):
-        return u'<{self.__class__.__name__} use_production={self.use_production} use_sandbox={self.use_sandbox} timeout={self.timeout} exclude_old_transactions={self.exclude_old_transactions} verify_ssl={self.verify_ssl}>'.format(self=self)
+        options = u' '.join(
+            u'{0}={1!r}'.format(item, getattr(self, item)) for item in self.ITEMS)
+        return u'<{0} {1}>'.format(self.__class__.__name__, options)
 
     def clone(self, **kwargs):
         """Clone the environment with additional parameter override"""
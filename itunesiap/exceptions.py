@@ -7,6 +7,14 @@ class RequestError(E):
     pass
 
 
+class RateLimited(RequestError):
+    '''No token of the client-side rate limiter is available.'''
+
+
+class BulkheadFull(RequestError):
+    '''No request slot of the server is available in the bulkhead.'''
+
+
 class ItunesServerNotAvailable(RequestError):
     '''iTunes server is not available. No response.'''
 
@@ -15,6 +23,26 @@ class ItunesServerNotReachable(ItunesServerNotAvailable):
     '''iTunes server is not reachable - including connection timeout.'''
 
 
+class DeadlineExceeded(ItunesServerNotReachable):
+    '''The total time budget of the verification is exhausted.'''
+
+
+class CircuitOpen(ItunesServerNotReachable):
+    '''The circuit breaker of the iTunes server is open. Not requested.'''
+
+
+class CacheError(E):
+    '''The cache backend failed. Verifications go on without the cache.'''
+
+
+class MalformedReceipt(E, ValueError):
+    '''The receipt data cannot be decoded locally.'''
+
+
+class InvalidSignature(MalformedReceipt):
+    '''The signature of the receipt is not trusted by the local verifier.'''
+
+
 class InvalidReceipt(RequestError, Response):
     '''A receipt was given by iTunes server but it has error.'''
     _descriptions = {
@@ -32,6 +60,28 @@ class InvalidReceipt(RequestError, Response):
         Response.__init__(self, response_data)
         RequestError.__init__(self, response_data)
 
+    def __reduce__(self):
+        # by the arguments of the exception instead of Response.__reduce__
+        return self.__class__, (self._,)
+
     @property
     def description(self):
         return self._descriptions.get(self.status, None)
+
+    @property
+    def is_retryable(self):
+        """`is-retryable` field of the response. `False` if it is missing."""
+        return bool(self._.get('is-retryable', False))
+
+
+class PrecheckFailed(InvalidReceipt):
+    '''The receipt data is rejected by the local pre-check without iTunes
+    server. It is an :class:`InvalidReceipt` of the status 21002.'''
+
+    def __init__(self, reason):
+        response_data = {'status': 21002}
+        Response.__init__(self, response_data)
+        RequestError.__init__(self, response_data, reason=reason)
+
+    def __reduce__(self):
+        return self.__class__, (self.reason,)
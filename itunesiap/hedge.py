@@ -0,0 +1,76 @@
+""":mod:`itunesiap.hedge`
+
+Hedged requests cut the tail latency of verifications. When a request is not
+answered after a while, the same request is sent once more and the first
+answer wins. The other one is cancelled in :func:`itunesiap.aioverify` and
+abandoned in :func:`itunesiap.verify`, whose requests run in threads.
+
+The hedging delay is either fixed or the observed percentile of the recent
+latencies of the same verification URL. The number of hedges is limited per
+second so the additional load on Apple stays bounded.
+
+.. sourcecode:: python
+
+    >>> hedge = itunesiap.hedge.HedgePolicy(percentile=0.95, max_per_second=2.0)
+    >>> env = itunesiap.env.production.clone(hedge=hedge)
+    >>> itunesiap.verify(receipt, env=env)
+"""
+from .ratelimit import TokenBucket
+from .stats import LatencyWindows
+
+__all__ = ('HedgePolicy',)
+
+
+class HedgePolicy(object):
+    """Hedging policy for verifying requests.
+
+    :param float delay: The fixed delay in seconds before sending a hedge.
+        `None` to use the observed `percentile` instead.
+    :param float percentile: The quantile of the recent latencies used as the
+        delay when `delay` is not given.
+    :param int min_samples: The minimum number of the observed latencies to
+        hedge by `percentile`. Requests are not hedged until then.
+    :param float max_per_second: The maximum rate of hedges.
+    :param int burst: The maximum number of hedges at once.
+    :param int window: The number of recent latencies to keep for each URL.
+    """
+
+    def __init__(
+            self, delay=None, percentile=0.95, min_samples=20,
+            max_per_second=1.0, burst=1, window=1000):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_per_second = max_per_second
+        self.burst = burst
+        self.latencies = LatencyWindows(window)
+        self._bucket = TokenBucket(max_per_second, burst)
+        self.hedged = 0
+        self.suppressed = 0
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} delay={self.delay} percentile={self.percentile} max_per_second={self.max_per_second}>'.format(self=self)
+
+    def delay_for(self, url):
+        """Return the hedging delay for `url` or `None` not to hedge."""
+        if self.delay is not None:
+            return self.delay
+        window = self.latencies[url]
+        if window.count < self.min_samples:
+            return None
+        return window.percentile(self.percentile)
+
+    def record(self, url, seconds):
+        """Record the latency of an answered request."""
+        self.latencies.add(url, seconds)
+
+    def acquire(self):
+        """Take a hedge from the rate budget. Return `False` if exhausted."""
+        if self._bucket.try_acquire():
+            self.hedged += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def stats(self):
+        return {'hedged': self.hedged, 'suppressed': self.suppressed}
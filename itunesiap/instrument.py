@@ -0,0 +1,188 @@
+""":mod:`itunesiap.instrument`
+
+Instrumentation of verifications. Observers receive timed :class:`Event` for
+each stage of a verification.
+
+.. sourcecode:: python
+
+    >>> class PrintObserver(itunesiap.instrument.Observer):
+    ...     def on_event(self, event):
+    ...         print(event.stage, event.url, event.duration, event.status)
+    >>> env = itunesiap.env.review.clone(observers=[PrintObserver()])
+    >>> itunesiap.verify(receipt, env=env)
+
+A plain function also can be an observer by :class:`Callback`.
+
+Stages
+------
+
+- `encode`: Encoding the request body.
+- `connect`: Opening a connection including TLS handshake. Only
+  :func:`itunesiap.aioverify` reports it for its own sessions. For
+  :func:`itunesiap.verify`, it is a part of `request`.
+- `request`: Sending the request until the response headers arrive. This is
+  mostly the processing time of Apple.
+- `download`: Reading the response body.
+- `decode`: Decoding the JSON response body.
+- `map`: Building the :class:`itunesiap.receipt.Response`.
+- `attempt`: An attempt to a server including the policies like the rate
+  limiter and the circuit breaker.
+- `verify`: The whole verification including retries and the sandbox
+  fallback.
+
+When no observer is registered, nothing is measured. Events of hedged
+requests of :func:`itunesiap.verify` are reported from their threads, so
+observers must be thread-safe.
+"""
+import hashlib
+
+from . import exceptions
+from .tools import monotonic, nullcontext, lazy_property
+
+__all__ = (
+    'ENCODE', 'CONNECT', 'REQUEST', 'DOWNLOAD', 'DECODE', 'MAP', 'ATTEMPT',
+    'VERIFY', 'STAGES', 'Event', 'Observer', 'Callback', 'Probe', 'stage')
+
+
+ENCODE = 'encode'
+CONNECT = 'connect'
+REQUEST = 'request'
+DOWNLOAD = 'download'
+DECODE = 'decode'
+MAP = 'map'
+ATTEMPT = 'attempt'
+VERIFY = 'verify'
+#: Stages in the order of a verification.
+STAGES = (ENCODE, CONNECT, REQUEST, DOWNLOAD, DECODE, MAP, ATTEMPT, VERIFY)
+
+
+class Event(object):
+    """A timed stage of a verification.
+
+    :param str stage: One of :data:`STAGES`.
+    :param float started_at: The start time by :func:`itunesiap.tools.monotonic`.
+    :param float duration: The duration in seconds.
+    :param Probe probe: The verification this event belongs to.
+    :param str url: The verification URL of the endpoint.
+    :param int status: The receipt status of the response if answered.
+    :param int http_status: The HTTP status code of the response.
+    :param Exception error: The exception raised in the stage.
+    :param int attempt: The attempt number to `url` from 1.
+
+    `tier`, `fallback`, `cache_hit` and `retries` are the states of the
+    verification when the event is emitted.
+    """
+
+    def __init__(
+            self, stage, started_at, duration, probe, url=None, status=None,
+            http_status=None, error=None, attempt=None):
+        if status is None and isinstance(error, exceptions.InvalidReceipt):
+            status = error.status
+        self.stage = stage
+        self.started_at = started_at
+        self.duration = duration
+        self.probe = probe
+        self.url = url
+        self.status = status
+        self.http_status = http_status
+        self.error = error
+        self.attempt = attempt
+        self.tier = probe.tier
+        self.fallback = probe.fallback
+        self.cache_hit = probe.cache_hit
+        self.retries = probe.retries
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} stage={self.stage} url={self.url} duration={self.duration:.6f} status={self.status}>'.format(self=self)
+
+
+class Observer(object):
+    """The base class of observers. Override :meth:`on_event`."""
+
+    def on_event(self, event):
+        """Receive an :class:`Event`."""
+
+
+class Callback(Observer):
+    """An observer calling `function` with each :class:`Event`."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def on_event(self, event):
+        self.function(event)
+
+
+class _Stage(object):
+
+    def __init__(self, probe, stage, fields):
+        self.probe = probe
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.started_at = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_value is not None:
+            self.fields['error'] = exc_value
+        self.fields.setdefault('url', self.probe.url)
+        self.probe.emit(self.stage, self.started_at, **self.fields)
+
+
+class Probe(object):
+    """The instrumentation state of a verification.
+
+    :param observers: The sequence of :class:`Observer`.
+    :param str receipt_data: The receipt to verify. Only its digest is
+        exposed.
+    """
+
+    def __init__(self, observers, receipt_data):
+        self.observers = tuple(observers)
+        self.receipt_data = receipt_data
+        self.url = None
+        self.tier = None
+        self.fallback = False
+        self.cache_hit = False
+        self.retries = 0
+
+    @classmethod
+    def start(cls, env, request):
+        """Return a probe for `request` or `None` if `env` has no observer."""
+        if not env.observers:
+            return None
+        return cls(env.observers, request.receipt_data)
+
+    @lazy_property
+    def receipt_digest(self):
+        """SHA-256 hex digest of the receipt."""
+        data = self.receipt_data
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
+
+    def emit(self, stage, started_at, duration=None, **fields):
+        """Send an :class:`Event` to the observers. `duration` is until now
+        when it is not given.
+        """
+        if duration is None:
+            duration = monotonic() - started_at
+        event = Event(stage, started_at, duration, self, **fields)
+        for observer in self.observers:
+            observer.on_event(event)
+        return event
+
+    def stage(self, stage, **fields):
+        """Return a context manager emitting the timed `stage`."""
+        return _Stage(self, stage, fields)
+
+
+def stage(probe, stage, **fields):
+    """Return :meth:`Probe.stage` or a context manager doing nothing for
+    `None` probe.
+    """
+    if probe is None:
+        return nullcontext
+    return probe.stage(stage, **fields)
@@ -0,0 +1,377 @@
+""":mod:`itunesiap.ledger`
+
+Detection of receipts replayed across accounts.
+
+.. sourcecode:: python
+
+    >>> ledger = itunesiap.ledger.Ledger('/var/lib/itunesiap/ledger.db')
+    >>> response = itunesiap.verify(raw_receipt_data)
+    >>> conflicts = ledger.claim(response, account=user_id)
+    >>> if conflicts:
+    ...     print(conflicts[0].account)  # the purchase belongs to the other account
+
+The ledger binds each `transaction_id` to the first account which claimed it.
+The bindings are kept in SQLite and a Bloom filter of the transaction ids is
+memory-mapped next to it, so the lookup of an unseen transaction id, which is
+the most of them, doesn't touch the database.
+
+The files can be shared by processes. The bits of a transaction id are set
+and flushed before its binding is committed, so a negative answer of the
+filter is exact.
+
+A new transaction id of a subscription whose `original_transaction_id` is
+bound to another account, e.g. a renewal restored by the other account, is
+a conflict too.
+"""
+import os
+import math
+import mmap
+import struct
+import hashlib
+
+import six
+
+from .receipt import Response, Receipt, ObjectMapper
+from .tools import SQLiteConnections
+
+__all__ = ('Ledger', 'Binding', 'BloomFilter')
+
+
+def _bytes(key):
+    if isinstance(key, six.text_type):
+        return key.encode('utf-8')
+    return key
+
+
+class BloomFilter(object):
+    """A Bloom filter in a memory-mapped file.
+
+    The filter of an existing `path` is opened and `capacity` and
+    `error_rate` are ignored. A new file is published atomically, so
+    processes opening the same path at once share a filter.
+
+    :param str path: The file of the filter or `None` for an anonymous
+        memory.
+    :param int capacity: The expected number of the keys.
+    :param float error_rate: The false positive rate at `capacity`.
+    """
+
+    MAGIC = b'IAPB'
+    VERSION = 1
+    #: magic, version, bits, hashes, count
+    HEADER = struct.Struct('<4sIQI4xQ')
+    _COUNT = struct.Struct('<Q')
+    _COUNT_OFFSET = 24
+
+    def __init__(self, path=None, capacity=1000000, error_rate=0.001):
+        self.path = path
+        #: Whether the filter is created by this instance.
+        self.created = False
+        if path is not None and os.path.exists(path):
+            self._open(path)
+            return
+        bits = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        bits = (bits + 7) // 8 * 8
+        hashes = max(1, int(round(bits / float(max(1, capacity)) * math.log(2))))
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, bits, hashes, 0)
+        size = self.HEADER.size + bits // 8
+        if path is None:
+            self._file = None
+            self._map = mmap.mmap(-1, size)
+            self._map[:len(header)] = header
+            self._init(bits, hashes)
+            self.created = True
+            return
+        temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temporary, 'wb') as f:
+            f.write(header)
+            f.truncate(size)
+        try:
+            os.link(temporary, path)
+            self.created = True
+        except OSError:
+            if not os.path.exists(path):
+                raise
+        finally:
+            os.remove(temporary)
+        self._open(path)
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} path={self.path!r} bits={self.bits} hashes={self.hashes} count={count}>'.format(
+            self=self, count=len(self))
+
+    def _open(self, path):
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic = version = bits = hashes = None
+        if len(self._map) >= self.HEADER.size:
+            magic, version, bits, hashes, _ = self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC or version != self.VERSION or len(self._map) != self.HEADER.size + bits // 8:
+            self.close()
+            raise ValueError('{0!r} is not a bloom filter'.format(path))
+        self._init(bits, hashes)
+
+    def _init(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self._offset = self.HEADER.size
+
+    def _positions(self, key):
+        # Kirsch-Mitzenmacher double hashing
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(_bytes(key)).digest())
+        bits = self.bits
+        offset = self._offset
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % bits
+            yield offset + (bit >> 3), 1 << (bit & 7)
+
+    def __contains__(self, key):
+        buf = self._map
+        for position, mask in self._positions(key):
+            if not six.indexbytes(buf, position) & mask:
+                return False
+        return True
+
+    def __len__(self):
+        """The approximate number of the added keys."""
+        return self._COUNT.unpack_from(self._map, self._COUNT_OFFSET)[0]
+
+    def add(self, key):
+        """Add `key`. Return `False` if it may have been added already."""
+        buf = self._map
+        added = False
+        for position, mask in self._positions(key):
+            byte = six.indexbytes(buf, position)
+            if not byte & mask:
+                buf[position:position + 1] = six.int2byte(byte | mask)
+                added = True
+        if added:
+            self._COUNT.pack_into(buf, self._COUNT_OFFSET, len(self) + 1)
+        return added
+
+    def update(self, keys):
+        """Add all of `keys`."""
+        for key in keys:
+            self.add(key)
+
+    @property
+    def error_rate(self):
+        """The estimated false positive rate at the current count."""
+        return (1.0 - math.exp(-self.hashes * len(self) / float(self.bits))) ** self.hashes
+
+    def flush(self):
+        """Write the changes to the file."""
+        if self._file is not None:
+            self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Binding(object):
+    """The binding of a purchase to the account which claimed it first."""
+
+    def __init__(self, transaction_id, original_transaction_id, account):
+        self.transaction_id = transaction_id
+        self.original_transaction_id = original_transaction_id
+        self.account = account
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} transaction_id={self.transaction_id} account={self.account!r}>'.format(self=self)
+
+    def __eq__(self, other):
+        return isinstance(other, Binding) and (
+            self.transaction_id, self.original_transaction_id, self.account) == (
+            other.transaction_id, other.original_transaction_id, other.account)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _purchases(purchases):
+    """Return the pairs of `transaction_id` and `original_transaction_id`."""
+    if isinstance(purchases, Response):
+        purchases = purchases.receipt
+    if isinstance(purchases, Receipt):
+        purchases = purchases.in_app
+    pairs = []
+    for purchase in purchases:
+        data = purchase._ if isinstance(purchase, ObjectMapper) else purchase
+        transaction_id = six.text_type(data['transaction_id'])
+        original_transaction_id = data.get('original_transaction_id')
+        if original_transaction_id is not None:
+            original_transaction_id = six.text_type(original_transaction_id)
+        pairs.append((transaction_id, original_transaction_id))
+    return pairs
+
+
+class Ledger(object):
+    """The bindings of transaction ids to accounts.
+
+    :param str path: The database file. The Bloom filter is kept in
+        `path + '.bloom'`.
+    :param int capacity: The expected number of the transaction ids. The
+        filter is sized for it when it is created.
+    :param float error_rate: The false positive rate of the filter at
+        `capacity`, which is the rate of the lookups of unseen transaction
+        ids going to the database.
+    :param float timeout: Seconds to wait for the lock of the database.
+    """
+
+    #: The maximum number of variables of a statement in old SQLite.
+    MAX_VARIABLES = 999
+
+    def __init__(self, path, capacity=10000000, error_rate=0.001, timeout=5.0):
+        self.path = path
+        self._connections = SQLiteConnections(path, timeout)
+        # writers are blocked while a new filter is filled
+        with self._connections.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS bindings ('
+                'transaction_id TEXT PRIMARY KEY, original_transaction_id TEXT, '
+                'account TEXT NOT NULL) WITHOUT ROWID')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS bindings_original_transaction_id '
+                'ON bindings (original_transaction_id)')
+            self.bloom = BloomFilter(path + '.bloom', capacity, error_rate)
+            if self.bloom.created:
+                for transaction_id, in connection.execute('SELECT transaction_id FROM bindings'):
+                    self.bloom.add(transaction_id)
+                self.bloom.flush()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} path={self.path!r}>'.format(self=self)
+
+    def close(self):
+        """Close the filter and the connection of the current thread."""
+        self.bloom.close()
+        self._connections.close()
+
+    def _select(self, connection, transaction_ids):
+        bindings = {}
+        for offset in range(0, len(transaction_ids), self.MAX_VARIABLES):
+            chunk = transaction_ids[offset:offset + self.MAX_VARIABLES]
+            rows = connection.execute(
+                'SELECT transaction_id, original_transaction_id, account FROM bindings '
+                'WHERE transaction_id IN ({0})'.format(','.join('?' * len(chunk))),
+                chunk)
+            for row in rows:
+                bindings[row[0]] = Binding(*row)
+        return bindings
+
+    def _select_originals(self, connection, original_transaction_ids, account):
+        """Return the first bindings of `original_transaction_ids` to the
+        other accounts than `account`.
+        """
+        bindings = {}
+        limit = self.MAX_VARIABLES - 1
+        for offset in range(0, len(original_transaction_ids), limit):
+            chunk = original_transaction_ids[offset:offset + limit]
+            rows = connection.execute(
+                'SELECT MIN(transaction_id), original_transaction_id, account FROM bindings '
+                'WHERE original_transaction_id IN ({0}) AND account != ? '
+                'GROUP BY original_transaction_id, account'.format(','.join('?' * len(chunk))),
+                chunk + [account])
+            for row in rows:
+                bindings[row[0]] = Binding(*row)
+        return bindings
+
+    def lookup(self, transaction_id):
+        """Return the :class:`Binding` of `transaction_id` or `None` if it
+        hasn't been seen.
+        """
+        transaction_id = six.text_type(transaction_id)
+        if transaction_id not in self.bloom:
+            return None
+        return self._select(self._connections(), [transaction_id]).get(transaction_id)
+
+    def lookup_many(self, transaction_ids):
+        """Return a :class:`dict` of the :class:`Binding` of the seen ones of
+        `transaction_ids`.
+        """
+        bloom = self.bloom
+        candidates = [key for key in map(six.text_type, transaction_ids) if key in bloom]
+        if not candidates:
+            return {}
+        return self._select(self._connections(), candidates)
+
+    def claim(self, purchases, account):
+        """Bind the unseen purchases to `account` and return the bindings of
+        the seen ones to the other accounts. An empty list means the
+        purchases are not replayed.
+
+        The unseen purchases of an `original_transaction_id` bound to another
+        account are not bound, and the first binding of the
+        `original_transaction_id` is returned.
+
+        :param purchases: A :class:`itunesiap.receipt.Response`, a
+            :class:`itunesiap.receipt.Receipt` or an iterable of purchases.
+        :param str account: The account claiming the purchases.
+        :rtype: list of :class:`Binding`
+        """
+        account = six.text_type(account)
+        pairs = _purchases(purchases)
+        if not pairs:
+            return []
+        bloom = self.bloom
+        with self._connections.transaction() as connection:
+            # no binding is committed by the others in the transaction
+            candidates = [transaction_id for transaction_id, _ in pairs if transaction_id in bloom]
+            bound = self._select(connection, candidates) if candidates else {}
+            conflicts = [binding for binding in bound.values() if binding.account != account]
+            new = [(transaction_id, original_transaction_id, account)
+                   for transaction_id, original_transaction_id in pairs if transaction_id not in bound]
+            originals = sorted(set(
+                original_transaction_id for _, original_transaction_id, _ in new
+                if original_transaction_id is not None))
+            if originals:
+                taken = self._select_originals(connection, originals, account)
+                if taken:
+                    known = set(binding.transaction_id for binding in conflicts)
+                    conflicts.extend(binding for binding in taken.values() if binding.transaction_id not in known)
+                    taken = set(binding.original_transaction_id for binding in taken.values())
+                    new = [binding for binding in new if binding[1] not in taken]
+            if new:
+                for transaction_id, _, _ in new:
+                    bloom.add(transaction_id)
+                # the bits are on the disk before the bindings
+                bloom.flush()
+                connection.executemany('INSERT OR IGNORE INTO bindings VALUES (?, ?, ?)', new)
+        return conflicts
+
+    def load(self, bindings, chunk_size=10000):
+        """Bulk load `bindings`. The transaction ids already bound are
+        skipped.
+
+        :param bindings: An iterable of :class:`Binding` or tuples of
+            `(transaction_id, original_transaction_id, account)`.
+        :return: The number of the loaded bindings.
+        """
+        loaded = 0
+        chunk = []
+        iterator = iter(bindings)
+        while True:
+            del chunk[:]
+            for binding in iterator:
+                if isinstance(binding, Binding):
+                    binding = (binding.transaction_id, binding.original_transaction_id, binding.account)
+                chunk.append(tuple(None if value is None else six.text_type(value) for value in binding))
+                if len(chunk) >= chunk_size:
+                    break
+            if not chunk:
+                break
+            with self._connections.transaction() as connection:
+                self.bloom.update(binding[0] for binding in chunk)
+                self.bloom.flush()
+                before = connection.total_changes
+                connection.executemany('INSERT OR IGNORE INTO bindings VALUES (?, ?, ?)', chunk)
+                loaded += connection.total_changes - before
+        return loaded
+
+    def __len__(self):
+        return self._connections().execute('SELECT COUNT(*) FROM bindings').fetchone()[0]
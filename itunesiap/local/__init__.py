@@ -0,0 +1,26 @@
+""":mod:`itunesiap.local`
+
+Local decoders of receipts. They read the fields of a receipt before iTunes
+server sees it, to reject malformed receipts early, to route sandbox receipts
+or to build cache keys without a network round trip.
+
+.. sourcecode:: python
+
+    >>> receipt = itunesiap.local.decode_legacy(raw_receipt)
+    >>> receipt.environment, receipt.transaction_id
+    ('Sandbox', '1000000056161764')
+    >>> receipt = itunesiap.local.decode_unified(app_receipt)
+    >>> receipt.bundle_id, len(receipt.in_app)
+
+Nothing is verified locally unless a verifier of the signature is given to
+:func:`decode_unified`. Only the response of iTunes server is a proof of the
+purchase.
+"""
+from .legacy import LegacyReceipt, decode_legacy, parse_plist
+from .pkcs7 import SignedData, parse_signed_data, CertificateVerifier
+from .unified import decode_unified, decode_payload
+
+__all__ = (
+    'LegacyReceipt', 'decode_legacy', 'parse_plist',
+    'SignedData', 'parse_signed_data', 'CertificateVerifier',
+    'decode_unified', 'decode_payload')
@@ -0,0 +1,225 @@
+""":mod:`itunesiap.local.asn1`
+
+A minimal streaming reader of ASN.1 BER/DER encodings.
+
+Elements are read in place from the buffer without copying their contents.
+Apple receipts mix DER with BER indefinite lengths and constructed octet
+strings, so both are accepted.
+"""
+import six
+
+from ..exceptions import MalformedReceipt
+
+__all__ = ('Element', 'read', 'iter_elements', 'definite_length', 'to_integer')
+
+
+UNIVERSAL = 0
+APPLICATION = 1
+CONTEXT = 2
+PRIVATE = 3
+
+INTEGER = 2
+OCTET_STRING = 4
+NULL = 5
+OBJECT_IDENTIFIER = 6
+UTF8_STRING = 12
+SEQUENCE = 16
+SET = 17
+IA5_STRING = 22
+
+#: The maximum nesting of indefinite lengths and constructed strings.
+MAX_DEPTH = 32
+
+
+def _buffer(data):
+    """Return an indexable buffer of `data` giving integers."""
+    if six.PY2:  # pragma: no cover
+        return bytearray(data)
+    return memoryview(data)
+
+
+def definite_length(data, pos, limit):
+    """Read the definite length at `pos` and return the offset and the end of
+    the contents.
+    """
+    length = data[pos]
+    pos += 1
+    if length & 0x80:
+        size = length & 0x7f
+        if not size or size > 4 or pos + size > limit:
+            raise MalformedReceipt(u'Invalid length at {0}'.format(pos - 1))
+        length = 0
+        for _ in range(size):
+            length = (length << 8) | data[pos]
+            pos += 1
+    end = pos + length
+    if end > limit:
+        raise MalformedReceipt(u'Truncated contents at {0}'.format(pos))
+    return pos, end
+
+
+def to_integer(contents):
+    """Decode the contents of an `INTEGER`."""
+    if not len(contents):
+        raise MalformedReceipt(u'Empty integer')
+    value = 0
+    for byte in contents:
+        value = (value << 8) | byte
+    if contents[0] & 0x80:
+        value -= 1 << (8 * len(contents))
+    return value
+
+
+class Element(object):
+    """An element of the encoding.
+
+    :param data: The whole buffer.
+    :param int tag_class: :data:`UNIVERSAL`, :data:`APPLICATION`,
+        :data:`CONTEXT` or :data:`PRIVATE`.
+    :param bool constructed: The element has child elements.
+    :param int tag: The tag number.
+    :param int start: The offset of the identifier.
+    :param int offset: The offset of the contents.
+    :param int content_end: The end offset of the contents.
+    :param int end: The end offset of the element.
+    """
+    __slots__ = (
+        'data', 'tag_class', 'constructed', 'tag', 'start', 'offset',
+        'content_end', 'end')
+
+    def __init__(self, data, tag_class, constructed, tag, start, offset, content_end, end):
+        self.data = data
+        self.tag_class = tag_class
+        self.constructed = constructed
+        self.tag = tag
+        self.start = start
+        self.offset = offset
+        self.content_end = content_end
+        self.end = end
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} class={self.tag_class} tag={self.tag} length={length}>'.format(
+            self=self, length=self.content_end - self.offset)
+
+    def is_(self, tag, tag_class=UNIVERSAL):
+        return self.tag == tag and self.tag_class == tag_class
+
+    def expect(self, tag, tag_class=UNIVERSAL):
+        if not self.is_(tag, tag_class):
+            raise MalformedReceipt(u'Expected tag {0} of class {1} but {2} of class {3} at {4}'.format(
+                tag, tag_class, self.tag, self.tag_class, self.start))
+        return self
+
+    def children(self):
+        """Iterate the child elements."""
+        if not self.constructed:
+            raise MalformedReceipt(u'Primitive element at {0}'.format(self.start))
+        return iter_elements(self.data, self.offset, self.content_end)
+
+    def first(self):
+        """Return the first child element."""
+        for child in self.children():
+            return child
+        raise MalformedReceipt(u'Empty element at {0}'.format(self.start))
+
+    @property
+    def raw(self):
+        """The whole encoding of the element in :class:`bytes`."""
+        return bytes(self.data[self.start:self.end])
+
+    def octets(self, depth=0):
+        """Return the contents in :class:`bytes`. The segments of a
+        constructed string are joined.
+        """
+        if not self.constructed:
+            return bytes(self.data[self.offset:self.content_end])
+        if depth >= MAX_DEPTH:
+            raise MalformedReceipt(u'Too deep string at {0}'.format(self.start))
+        return b''.join(child.octets(depth + 1) for child in self.children())
+
+    def integer(self):
+        return to_integer(self.data[self.offset:self.content_end])
+
+    def oid(self):
+        """Return the object identifier in the dotted form."""
+        contents = self.data[self.offset:self.content_end]
+        if not len(contents):
+            raise MalformedReceipt(u'Empty object identifier at {0}'.format(self.start))
+        arcs = []
+        value = 0
+        for byte in contents:
+            value = (value << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                arcs.append(value)
+                value = 0
+        if contents[-1] & 0x80:
+            raise MalformedReceipt(u'Truncated object identifier at {0}'.format(self.start))
+        first = min(arcs[0] // 40, 2)
+        return '.'.join(str(arc) for arc in [first, arcs[0] - first * 40] + arcs[1:])
+
+    def text(self):
+        try:
+            return self.octets().decode('utf-8')
+        except UnicodeDecodeError:
+            raise MalformedReceipt(u'Invalid string at {0}'.format(self.start))
+
+
+def read(data, pos=0, limit=None, depth=0):
+    """Read an :class:`Element` at `pos` of `data`.
+
+    :param data: A buffer from :func:`_buffer` or :class:`bytes`.
+    :param int limit: The offset the element must end in.
+    :param int depth: The nesting of indefinite lengths of the element.
+    """
+    if not isinstance(data, (memoryview, bytearray)):
+        data = _buffer(data)
+    if limit is None:
+        limit = len(data)
+    start = pos
+    if pos + 2 > limit:
+        raise MalformedReceipt(u'Truncated element at {0}'.format(pos))
+    identifier = data[pos]
+    pos += 1
+    tag_class = identifier >> 6
+    constructed = bool(identifier & 0x20)
+    tag = identifier & 0x1f
+    if tag == 0x1f:
+        tag = 0
+        while True:
+            if pos >= limit:
+                raise MalformedReceipt(u'Truncated tag at {0}'.format(start))
+            byte = data[pos]
+            pos += 1
+            tag = (tag << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                break
+    if pos >= limit:
+        raise MalformedReceipt(u'Truncated length at {0}'.format(start))
+    if data[pos] == 0x80:
+        pos += 1
+        if not constructed:
+            raise MalformedReceipt(u'Indefinite primitive element at {0}'.format(start))
+        if depth >= MAX_DEPTH:
+            raise MalformedReceipt(u'Too deep indefinite length at {0}'.format(start))
+        offset = content_end = pos
+        while True:
+            if content_end + 2 > limit:
+                raise MalformedReceipt(u'Missing end of contents of {0}'.format(start))
+            if data[content_end] == 0 and data[content_end + 1] == 0:
+                break
+            content_end = read(data, content_end, limit, depth + 1).end
+        return Element(data, tag_class, constructed, tag, start, offset, content_end, content_end + 2)
+    offset, end = definite_length(data, pos, limit)
+    return Element(data, tag_class, constructed, tag, start, offset, end, end)
+
+
+def iter_elements(data, pos=0, end=None):
+    """Iterate the elements in `data` from `pos` to `end`."""
+    if not isinstance(data, (memoryview, bytearray)):
+        data = _buffer(data)
+    if end is None:
+        end = len(data)
+    while pos < end:
+        element = read(data, pos, end)
+        yield element
+        pos = element.end
@@ -0,0 +1,262 @@
+""":mod:`itunesiap.local.legacy`
+
+Decoder of legacy (iOS6 style) transaction receipts.
+
+A legacy receipt is base64 of a NeXTSTEP style property list. Its
+`purchase-info` is base64 of another property list with the purchase:
+
+.. sourcecode:: text
+
+    {
+        "signature" = "...";
+        "purchase-info" = "ewoJIm9yaWdpbmFsLXB1cmNoYXNlLWRhdGUtcHN0Ij...";
+        "environment" = "Sandbox";
+        "pod" = "100";
+        "signing-status" = "0";
+    }
+"""
+import re
+import base64
+import binascii
+
+import six
+
+from ..exceptions import MalformedReceipt
+from ..receipt import ObjectMapper, Purchase
+from ..tools import lazy_property
+
+__all__ = ('LegacyReceipt', 'decode_legacy', 'parse_plist')
+
+
+_SPACES = re.compile(r'(?:\s+|//[^\n]*|/\*.*?\*/)*', re.S)
+_QUOTED = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"', re.S)
+# the common `"key" = "value";` entry of a dictionary at once
+_ENTRY = re.compile(r'\s*"([^"\\]*)"\s*=\s*"([^"\\]*)"\s*;')
+_UNQUOTED = re.compile(r'[A-Za-z0-9_$+/:.\-]+')
+_DATA = re.compile(r'<([0-9A-Fa-f\s]*)>')
+_BASE64 = re.compile(br'[A-Za-z0-9+/]*={0,2}\Z')
+_ESCAPE = re.compile(r'\\(U[0-9A-Fa-f]{4}|[0-7]{1,3}|.)', re.S)
+_ESCAPES = {
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+    'v': '\v',
+}
+
+
+def _unescape_match(match):
+    escape = match.group(1)
+    if escape[0] == 'U' and len(escape) == 5:
+        return six.unichr(int(escape[1:], 16))
+    if escape[0] in '01234567':
+        return six.unichr(int(escape, 8))
+    return _ESCAPES.get(escape, escape)
+
+
+#: The maximum nesting of dictionaries and arrays in a property list.
+MAX_DEPTH = 32
+
+
+class _Parser(object):
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.depth = 0
+
+    def enter(self):
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise self.error(u'Too deep')
+
+    def error(self, message):
+        return MalformedReceipt(u'{0} at {1}'.format(message, self.pos))
+
+    def skip(self):
+        self.pos = _SPACES.match(self.text, self.pos).end()
+
+    def expect(self, char):
+        self.skip()
+        if self.text.startswith(char, self.pos):
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        self.skip()
+        text = self.text
+        pos = self.pos
+        if pos >= len(text):
+            raise self.error(u'Unexpected end')
+        char = text[pos]
+        if char == '"':
+            match = _QUOTED.match(text, pos)
+            if match is None:
+                raise self.error(u'Unterminated string')
+            self.pos = match.end()
+            value = match.group(1)
+            if '\\' in value:
+                value = _ESCAPE.sub(_unescape_match, value)
+            return value
+        if char == '{':
+            self.pos += 1
+            self.enter()
+            value = self.dictionary()
+            self.depth -= 1
+            return value
+        if char == '(':
+            self.pos += 1
+            self.enter()
+            value = self.array()
+            self.depth -= 1
+            return value
+        if char == '<':
+            match = _DATA.match(text, pos)
+            if match is None:
+                raise self.error(u'Invalid data')
+            self.pos = match.end()
+            digits = ''.join(match.group(1).split())
+            try:
+                return binascii.unhexlify(digits)
+            except (TypeError, binascii.Error):
+                raise self.error(u'Invalid data')
+        match = _UNQUOTED.match(text, pos)
+        if match is None:
+            raise self.error(u'Unexpected {0!r}'.format(char))
+        self.pos = match.end()
+        return match.group(0)
+
+    def dictionary(self):
+        result = {}
+        entry = _ENTRY.match
+        while True:
+            match = entry(self.text, self.pos)
+            if match is not None:
+                result[match.group(1)] = match.group(2)
+                self.pos = match.end()
+                continue
+            if self.expect('}'):
+                break
+            key = self.value()
+            if not isinstance(key, six.string_types):
+                raise self.error(u'Invalid key')
+            if not self.expect('='):
+                raise self.error(u'Expected "="')
+            result[key] = self.value()
+            if not self.expect(';'):
+                raise self.error(u'Expected ";"')
+        return result
+
+    def array(self):
+        result = []
+        if self.expect(')'):
+            return result
+        while True:
+            result.append(self.value())
+            if self.expect(')'):
+                return result
+            if not self.expect(','):
+                raise self.error(u'Expected ","')
+            if self.expect(')'):  # trailing comma
+                return result
+
+
+def parse_plist(data):
+    """Parse a NeXTSTEP style property list.
+
+    :param data: The property list in :class:`bytes` or text.
+    :return: :class:`dict`, :class:`list`, text or :class:`bytes` of `<data>`.
+    :raises itunesiap.exceptions.MalformedReceipt: When it is not a property
+        list.
+    """
+    if isinstance(data, six.binary_type):
+        try:
+            data = data.decode('utf-8')
+        except UnicodeDecodeError:
+            raise MalformedReceipt(u'Not a text property list')
+    parser = _Parser(data)
+    value = parser.value()
+    parser.skip()
+    if parser.pos != len(data):
+        raise parser.error(u'Trailing data')
+    return value
+
+
+def _b64decode(data):
+    if isinstance(data, six.text_type):
+        try:
+            data = data.encode('ascii')
+        except UnicodeEncodeError:
+            raise MalformedReceipt(u'Not base64')
+    # strictly as `validate=True` of python 3, which python 2 doesn't have
+    if _BASE64.match(data) is None:
+        raise MalformedReceipt(u'Not base64')
+    try:
+        return base64.b64decode(data)
+    except (TypeError, binascii.Error):
+        raise MalformedReceipt(u'Not base64')
+
+
+def _fields(plist):
+    if not isinstance(plist, dict):
+        raise MalformedReceipt(u'Not a dictionary')
+    return dict((key.replace('-', '_'), value) for key, value in plist.items())
+
+
+class LegacyReceipt(ObjectMapper):
+    """The decoded legacy receipt. Keys are in the names of the responses:
+    `signing-status` is `signing_status`.
+
+    Nothing is verified locally. Trust only the response of iTunes server.
+    """
+    __OPAQUE_FIELDS__ = frozenset([
+        'signature',
+        'environment',
+        'pod',
+        'signing_status',
+    ])
+    __FIELD_ADAPTERS__ = {}
+    __DOCUMENTED_FIELDS__ = frozenset([
+        'signature',
+        'purchase_info',
+        'environment',
+        'pod',
+        'signing_status',
+    ])
+    __UNDOCUMENTED_FIELDS__ = frozenset([])
+
+    @property
+    def is_sandbox(self):
+        """`True` if the receipt is issued by sandbox."""
+        return self._.get('environment') == 'Sandbox'
+
+    @lazy_property
+    def purchase_info(self):
+        """The :class:`itunesiap.receipt.Purchase` decoded from
+        `purchase-info` on the first access.
+        """
+        try:
+            data = self._['purchase_info']
+        except KeyError:
+            raise MalformedReceipt(u'No purchase-info')
+        return Purchase(_fields(parse_plist(_b64decode(data))))
+
+    @property
+    def transaction_id(self):
+        return self.purchase_info.transaction_id
+
+    @property
+    def product_id(self):
+        return self.purchase_info.product_id
+
+
+def decode_legacy(receipt_data):
+    """Decode a legacy receipt without iTunes server.
+
+    :param receipt_data: An iOS6 style receipt in base64.
+    :return: :class:`LegacyReceipt`
+    :raises itunesiap.exceptions.MalformedReceipt: When the receipt is not
+        decodable.
+    """
+    fields = _fields(parse_plist(_b64decode(receipt_data)))
+    if 'purchase_info' not in fields:
+        raise MalformedReceipt(u'No purchase-info')
+    return LegacyReceipt(fields)
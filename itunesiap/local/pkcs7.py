@@ -0,0 +1,284 @@
+""":mod:`itunesiap.local.pkcs7`
+
+The PKCS#7 (CMS) `SignedData` container of app receipts and pluggable
+verification of its signature.
+
+A verifier is any callable taking :class:`SignedData` and raising
+:class:`itunesiap.exceptions.InvalidSignature` when it is not trusted.
+:class:`CertificateVerifier` is the built-in one with the `cryptography`
+package, which is imported only when it is used.
+"""
+import hashlib
+
+from ..exceptions import MalformedReceipt, InvalidSignature
+from . import asn1
+
+__all__ = ('SignedData', 'SignerInfo', 'parse_signed_data', 'CertificateVerifier')
+
+
+SIGNED_DATA = '1.2.840.113549.1.7.2'
+MESSAGE_DIGEST = '1.2.840.113549.1.9.4'
+#: The extension of the certificates of Apple signing receipts.
+RECEIPT_SIGNING = '1.2.840.113635.100.6.11.1'
+
+#: Digest algorithms by the object identifier.
+DIGESTS = {
+    '1.3.14.3.2.26': 'sha1',
+    '2.16.840.1.101.3.4.2.1': 'sha256',
+    '2.16.840.1.101.3.4.2.2': 'sha384',
+    '2.16.840.1.101.3.4.2.3': 'sha512',
+}
+
+
+def _encode_length(length):
+    if length < 0x80:
+        return bytearray([length])
+    encoded = bytearray()
+    while length:
+        encoded.insert(0, length & 0xff)
+        length >>= 8
+    return bytearray([0x80 | len(encoded)]) + encoded
+
+
+class SignerInfo(object):
+    """A signer of :class:`SignedData`.
+
+    :param bytes issuer: The DER encoded issuer name of the certificate.
+    :param int serial_number: The serial number of the certificate.
+    :param str digest_algorithm: The object identifier of the digest.
+    :param bytes signed_attributes: The DER encoded signed attributes as a
+        `SET`, which is signed instead of the content. `None` if missing.
+    :param bytes message_digest: The digest of the content in the signed
+        attributes. `None` if missing.
+    :param str signature_algorithm: The object identifier of the signature.
+    :param bytes signature: The signature.
+    """
+
+    def __init__(
+            self, issuer, serial_number, digest_algorithm, signed_attributes,
+            message_digest, signature_algorithm, signature):
+        self.issuer = issuer
+        self.serial_number = serial_number
+        self.digest_algorithm = digest_algorithm
+        self.signed_attributes = signed_attributes
+        self.message_digest = message_digest
+        self.signature_algorithm = signature_algorithm
+        self.signature = signature
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} serial_number={self.serial_number}>'.format(self=self)
+
+    @property
+    def digest_name(self):
+        """The :mod:`hashlib` name of the digest algorithm."""
+        try:
+            return DIGESTS[self.digest_algorithm]
+        except KeyError:
+            raise InvalidSignature(u'Unsupported digest {0}'.format(self.digest_algorithm))
+
+
+class SignedData(object):
+    """The parsed `SignedData`.
+
+    :param str content_type: The object identifier of the content type.
+    :param bytes content: The encapsulated content. It is the receipt
+        payload for app receipts.
+    :param list certificates: The DER encoded certificates.
+    :param list signers: :class:`SignerInfo` objects.
+    """
+
+    def __init__(self, content_type, content, certificates, signers):
+        self.content_type = content_type
+        self.content = content
+        self.certificates = certificates
+        self.signers = signers
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} content={length} bytes signers={signers!r}>'.format(
+            self=self, length=len(self.content), signers=self.signers)
+
+
+def _signer_info(element):
+    children = element.children()
+    next(children)  # version
+    sid = next(children)
+    if not sid.is_(asn1.SEQUENCE):
+        raise MalformedReceipt(u'Unsupported signer identifier')
+    issuer, serial_number = list(sid.children())[:2]
+    digest_algorithm = next(children).expect(asn1.SEQUENCE).first().oid()
+    signed_attributes = None
+    message_digest = None
+    item = next(children)
+    if item.is_(0, asn1.CONTEXT):
+        # signed as a SET instead of the implicit tag
+        contents = bytes(item.data[item.offset:item.content_end])
+        signed_attributes = bytes(bytearray([0x31]) + _encode_length(len(contents))) + contents
+        for attribute in item.children():
+            oid_element, values = list(attribute.children())[:2]
+            if oid_element.oid() == MESSAGE_DIGEST:
+                message_digest = values.first().octets()
+        item = next(children)
+    signature_algorithm = item.expect(asn1.SEQUENCE).first().oid()
+    signature = next(children).expect(asn1.OCTET_STRING).octets()
+    return SignerInfo(
+        issuer.raw, serial_number.integer(), digest_algorithm,
+        signed_attributes, message_digest, signature_algorithm, signature)
+
+
+def parse_signed_data(data):
+    """Parse the BER or DER encoded `ContentInfo` of `SignedData`.
+
+    :param bytes data: The binary receipt.
+    :rtype: :class:`SignedData`
+    :raises itunesiap.exceptions.MalformedReceipt: When it is not a
+        `SignedData`.
+    """
+    content_info = asn1.read(data).expect(asn1.SEQUENCE)
+    children = content_info.children()
+    try:
+        if next(children).expect(asn1.OBJECT_IDENTIFIER).oid() != SIGNED_DATA:
+            raise MalformedReceipt(u'Not a SignedData')
+        signed_data = next(children).expect(0, asn1.CONTEXT).first().expect(asn1.SEQUENCE)
+        children = signed_data.children()
+        next(children).expect(asn1.INTEGER)  # version
+        next(children).expect(asn1.SET)  # digest algorithms
+        encapsulated = next(children).expect(asn1.SEQUENCE)
+        encapsulated_children = encapsulated.children()
+        content_type = next(encapsulated_children).oid()
+        content = b''
+        for explicit in encapsulated_children:
+            content = explicit.expect(0, asn1.CONTEXT).first().expect(asn1.OCTET_STRING).octets()
+        certificates = []
+        signers = []
+        for item in children:
+            if item.is_(0, asn1.CONTEXT):
+                certificates = [certificate.raw for certificate in item.children()]
+            elif item.is_(asn1.SET):
+                signers = [_signer_info(signer) for signer in item.children()]
+    except StopIteration:
+        raise MalformedReceipt(u'Truncated SignedData')
+    except ValueError as e:
+        if isinstance(e, MalformedReceipt):
+            raise
+        raise MalformedReceipt(u'Invalid SignedData')
+    return SignedData(content_type, content, certificates, signers)
+
+
+class CertificateVerifier(object):
+    """Verify the signature and the certificate chain up to the trusted
+    certificates with the `cryptography` package.
+
+    The validity periods of the certificates are not checked because receipts
+    stay valid after the signing certificates expire. Every issuer in the
+    chain must be a CA allowed to sign certificates, and the signing
+    certificate must have the `leaf_extension`.
+
+    .. sourcecode:: python
+
+        >>> with open('AppleIncRootCertificate.cer', 'rb') as f:
+        ...     verifier = itunesiap.local.CertificateVerifier([f.read()])
+        >>> itunesiap.local.decode_unified(receipt_data, verifier=verifier)
+
+    :param trusted: DER or PEM encoded root certificates.
+    :param int max_depth: The maximum length of the certificate chain.
+    :param str leaf_extension: The object identifier of the extension
+        required on the signing certificate. :data:`RECEIPT_SIGNING` of Apple
+        by default. `None` not to check.
+    """
+
+    def __init__(self, trusted, max_depth=5, leaf_extension=RECEIPT_SIGNING):
+        from cryptography import x509
+        self._x509 = x509
+        self.trusted = [self._load(certificate) for certificate in trusted]
+        if not self.trusted:
+            raise ValueError(u'No trusted certificate')
+        self.max_depth = max_depth
+        self.leaf_extension = leaf_extension
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} trusted={count}>'.format(self=self, count=len(self.trusted))
+
+    def _load(self, data):
+        if data.lstrip().startswith(b'-----BEGIN'):
+            return self._x509.load_pem_x509_certificate(data)
+        return self._x509.load_der_x509_certificate(data)
+
+    def __call__(self, signed_data):
+        if not signed_data.signers:
+            raise InvalidSignature(u'Not signed')
+        try:
+            certificates = [self._x509.load_der_x509_certificate(data) for data in signed_data.certificates]
+        except ValueError:
+            raise InvalidSignature(u'Invalid certificate')
+        for signer in signed_data.signers:
+            certificate = self._signer_certificate(signer, certificates)
+            self._verify_signature(signer, certificate, signed_data.content)
+            self._verify_chain(certificate, certificates)
+
+    def _signer_certificate(self, signer, certificates):
+        for certificate in certificates + self.trusted:
+            if certificate.serial_number == signer.serial_number and \
+                    certificate.issuer.public_bytes() == signer.issuer:
+                return certificate
+        raise InvalidSignature(u'No certificate of the signer')
+
+    def _verify_signature(self, signer, certificate, content):
+        from cryptography.exceptions import InvalidSignature as _InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+
+        digest_name = signer.digest_name
+        if signer.signed_attributes is None:
+            signed = content
+        else:
+            if signer.message_digest != hashlib.new(digest_name, content).digest():
+                raise InvalidSignature(u'Digest mismatch')
+            signed = signer.signed_attributes
+        algorithm = getattr(hashes, digest_name.upper())()
+        key = certificate.public_key()
+        try:
+            if isinstance(key, rsa.RSAPublicKey):
+                key.verify(signer.signature, signed, padding.PKCS1v15(), algorithm)
+            elif isinstance(key, ec.EllipticCurvePublicKey):
+                key.verify(signer.signature, signed, ec.ECDSA(algorithm))
+            else:
+                raise InvalidSignature(u'Unsupported key')
+        except _InvalidSignature:
+            raise InvalidSignature(u'Signature mismatch')
+
+    def _verify_chain(self, certificate, certificates):
+        if self.leaf_extension is not None:
+            x509 = self._x509
+            try:
+                certificate.extensions.get_extension_for_oid(x509.ObjectIdentifier(self.leaf_extension))
+            except (x509.ExtensionNotFound, ValueError):
+                raise InvalidSignature(u'Not a receipt signing certificate')
+        for _ in range(self.max_depth):
+            for root in self.trusted:
+                if certificate == root:
+                    return
+                if certificate.issuer == root.subject and self._issued_by(certificate, root):
+                    return
+            for issuer in certificates:
+                if issuer != certificate and certificate.issuer == issuer.subject and \
+                        self._issued_by(certificate, issuer):
+                    certificate = issuer
+                    break
+            else:
+                break
+        raise InvalidSignature(u'Untrusted certificate')
+
+    def _issued_by(self, certificate, issuer):
+        x509 = self._x509
+        try:
+            constraints = issuer.extensions.get_extension_for_class(x509.BasicConstraints).value
+            usage = issuer.extensions.get_extension_for_class(x509.KeyUsage).value
+        except (x509.ExtensionNotFound, ValueError):
+            return False
+        if not constraints.ca or not usage.key_cert_sign:
+            return False
+        try:
+            certificate.verify_directly_issued_by(issuer)
+        except Exception:
+            return False
+        return True
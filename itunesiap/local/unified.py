@@ -0,0 +1,200 @@
+""":mod:`itunesiap.local.unified`
+
+Decoder of unified app receipts (iOS7 style).
+
+An app receipt is a PKCS#7 `SignedData` whose content is an ASN.1 `SET` of
+receipt attributes:
+
+.. sourcecode:: text
+
+    ReceiptAttribute ::= SEQUENCE {
+        type    INTEGER,
+        version INTEGER,
+        value   OCTET STRING  -- DER of UTF8String, IA5String, INTEGER or SET
+    }
+
+The in-app purchase attributes are the `SET` of the same attributes in the
+value of the type 17. They are decoded into the fields of the responses of
+iTunes server, so :class:`itunesiap.receipt.Receipt` and
+:class:`itunesiap.receipt.InApp` work as they do for the responses.
+"""
+import base64
+import binascii
+import calendar
+import datetime
+
+import six
+
+from ..exceptions import MalformedReceipt
+from ..receipt import Receipt
+from . import asn1
+from .pkcs7 import parse_signed_data
+
+__all__ = ('decode_unified', 'decode_payload', 'RECEIPT_FIELDS', 'IN_APP_FIELDS')
+
+
+STRING = 'string'
+INTEGER = 'integer'
+DATE = 'date'
+BOOLEAN = 'boolean'
+
+IN_APP = 17
+
+#: Receipt attributes by the type: the field name and the value type.
+RECEIPT_FIELDS = {
+    0: ('receipt_type', STRING),
+    1: ('app_item_id', INTEGER),
+    2: ('bundle_id', STRING),
+    3: ('application_version', STRING),
+    12: ('receipt_creation_date', DATE),
+    16: ('version_external_identifier', INTEGER),
+    18: ('original_purchase_date', DATE),
+    19: ('original_application_version', STRING),
+    21: ('expiration_date', DATE),
+}
+
+#: In-app purchase attributes by the type: the field name and the value type.
+IN_APP_FIELDS = {
+    1701: ('quantity', INTEGER),
+    1702: ('product_id', STRING),
+    1703: ('transaction_id', STRING),
+    1704: ('purchase_date', DATE),
+    1705: ('original_transaction_id', STRING),
+    1706: ('original_purchase_date', DATE),
+    1708: ('expires_date', DATE),
+    1711: ('web_order_line_item_id', INTEGER),
+    1712: ('cancellation_date', DATE),
+    1713: ('is_trial_period', BOOLEAN),
+    1719: ('is_in_intro_offer_period', BOOLEAN),
+}
+
+#: The identifiers of the DER values of the value types.
+_IDENTIFIERS = {
+    STRING: (asn1.UTF8_STRING, asn1.IA5_STRING),
+    INTEGER: (asn1.INTEGER,),
+    BOOLEAN: (asn1.INTEGER,),
+    DATE: (asn1.IA5_STRING,),
+}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _ms(value):
+    """Return the milliseconds of an RFC 3339 UTC date like
+    `2013-01-01T00:00:00Z`.
+    """
+    try:
+        if len(value) == 20 and value[10] == 'T' and value[19] == 'Z':
+            return calendar.timegm((
+                int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                int(value[11:13]), int(value[14:16]), int(value[17:19]))) * 1000
+        text = value.rstrip('Z')
+        if '.' in text:
+            date = datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f')
+        else:
+            date = datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        raise MalformedReceipt(u'Invalid date {0!r}'.format(value))
+    delta = date - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def _expect(data, pos, identifier):
+    if data[pos] != identifier:
+        raise MalformedReceipt(u'Expected identifier {0:#x} but {1:#x} at {2}'.format(
+            identifier, data[pos], pos))
+
+
+def _decode_fields(data, pos, end, fields, result):
+    """Decode the DER receipt attributes in `data[pos:end]` into `result`.
+
+    The attributes are scanned in place without intermediate elements because
+    a receipt has thousands of them.
+    """
+    definite_length = asn1.definite_length
+    while pos < end:
+        _expect(data, pos, 0x30)
+        offset, pos = definite_length(data, pos + 1, end)
+        _expect(data, offset, 0x02)
+        kind_offset, offset = definite_length(data, offset + 1, pos)
+        kind = asn1.to_integer(data[kind_offset:offset])
+        _expect(data, offset, 0x02)  # version
+        offset = definite_length(data, offset + 1, pos)[1]
+        _expect(data, offset, 0x04)
+        value_offset, value_end = definite_length(data, offset + 1, pos)
+        if kind == IN_APP and fields is RECEIPT_FIELDS:
+            _expect(data, value_offset, 0x31)
+            offset, value_end = definite_length(data, value_offset + 1, value_end)
+            result['in_app'].append(_decode_fields(data, offset, value_end, IN_APP_FIELDS, {}))
+            continue
+        try:
+            name, value_type = fields[kind]
+        except KeyError:
+            continue
+        if data[value_offset] not in _IDENTIFIERS[value_type]:
+            raise MalformedReceipt(u'Unexpected identifier {0:#x} of {1} at {2}'.format(
+                data[value_offset], name, value_offset))
+        offset, value_end = definite_length(data, value_offset + 1, value_end)
+        contents = data[offset:value_end]
+        if value_type == INTEGER:
+            result[name] = str(asn1.to_integer(contents))
+        elif value_type == BOOLEAN:
+            result[name] = 'true' if asn1.to_integer(contents) else 'false'
+        else:
+            try:
+                text = bytes(contents).decode('utf-8')
+            except UnicodeDecodeError:
+                raise MalformedReceipt(u'Invalid string at {0}'.format(offset))
+            if value_type == STRING:
+                result[name] = text
+            elif text:  # empty for the purchases without the date
+                result[name] = text
+                result[name + '_ms'] = str(_ms(text))
+    return result
+
+
+def decode_payload(content):
+    """Decode the receipt attributes into a :class:`dict` in the form of
+    `receipt` of the responses.
+
+    :param bytes content: The DER encoded `SET` of receipt attributes.
+    """
+    payload = asn1.read(content).expect(asn1.SET)
+    try:
+        return _decode_fields(
+            payload.data, payload.offset, payload.content_end, RECEIPT_FIELDS,
+            {'in_app': []})
+    except IndexError:
+        raise MalformedReceipt(u'Truncated receipt attributes')
+
+
+def _binary(receipt_data):
+    if isinstance(receipt_data, six.binary_type) and receipt_data[:1] == b'\x30':
+        return receipt_data
+    if isinstance(receipt_data, six.text_type):
+        try:
+            receipt_data = receipt_data.encode('ascii')
+        except UnicodeEncodeError:
+            raise MalformedReceipt(u'Not base64')
+    try:
+        return base64.b64decode(receipt_data)
+    except (TypeError, binascii.Error):
+        raise MalformedReceipt(u'Not base64')
+
+
+def decode_unified(receipt_data, verifier=None):
+    """Decode an app receipt without iTunes server.
+
+    :param receipt_data: An app receipt in base64 or the binary.
+    :param verifier: A callable taking :class:`itunesiap.local.pkcs7.SignedData`
+        and raising :class:`itunesiap.exceptions.InvalidSignature` if it is not
+        trusted, like :class:`itunesiap.local.pkcs7.CertificateVerifier`. The
+        signature is not checked if it is not given.
+    :rtype: :class:`itunesiap.receipt.Receipt`
+    :raises itunesiap.exceptions.MalformedReceipt: When the receipt is not
+        decodable.
+    """
+    signed_data = parse_signed_data(_binary(receipt_data))
+    if verifier is not None:
+        verifier(signed_data)
+    return Receipt(decode_payload(signed_data.content))
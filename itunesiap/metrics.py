@@ -0,0 +1,264 @@
+""":mod:`itunesiap.metrics`
+
+Built-in metrics of verifications. :class:`MetricsRegistry` is an
+:class:`itunesiap.instrument.Observer` keeping counters and log-bucketed
+latency histograms from the events of each verification.
+
+.. sourcecode:: python
+
+    >>> metrics = itunesiap.metrics.MetricsRegistry()
+    >>> env = itunesiap.env.review.clone(observers=[metrics])
+    >>> itunesiap.verify(receipt, env=env)
+    >>> metrics.snapshot()['stages']['request']['p99']
+    >>> print(metrics.to_prometheus())
+
+Histograms
+----------
+
+:class:`Histogram` counts values in buckets growing by a constant ratio, like
+HDR histograms. Recording is a constant time operation and the memory is
+fixed regardless of the number of values. A percentile is reported as the
+upper bound of its bucket, so its relative error is at most `growth - 1`.
+"""
+import math
+import threading
+
+from . import instrument
+
+__all__ = ('Counter', 'Histogram', 'MetricsRegistry')
+
+
+class Counter(object):
+    """Counters by label values."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} {values!r}>'.format(self=self, values=self._values)
+
+    def inc(self, key=(), amount=1):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, key=()):
+        return self._values.get(key, 0)
+
+    def total(self):
+        return sum(self._values.values())
+
+    def items(self):
+        """Return a list of pairs of the label values and the count."""
+        with self._lock:
+            return list(self._values.items())
+
+
+class Histogram(object):
+    """Log-bucketed histogram of non-negative values.
+
+    :param float lowest: The upper bound of the first bucket. Smaller values
+        are counted in it.
+    :param float highest: Values larger than it are counted in the last
+        bucket.
+    :param float growth: The ratio of the bounds of adjacent buckets.
+    """
+
+    def __init__(self, lowest=1e-5, highest=100.0, growth=2 ** 0.125):
+        assert 0.0 < lowest < highest and growth > 1.0
+        self.lowest = lowest
+        self.highest = highest
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        size = int(math.ceil(math.log(highest / lowest) / self._log_growth)) + 2
+        self._counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} count={self.count}>'.format(self=self)
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        if value > self.highest:
+            return len(self._counts) - 1
+        return int(math.ceil(math.log(value / self.lowest) / self._log_growth))
+
+    def record(self, value):
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        """Return the `q` quantile (0 < q <= 1) or `None` if empty."""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, int(math.ceil(q * self.count)))
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank:
+                    break
+            upper = self.lowest * self.growth ** index
+            return min(max(upper, self.min), self.max)
+
+    def snapshot(self):
+        """Return the summary as a :class:`dict`."""
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    if not labels:
+        return u''
+    return u'{' + u','.join(
+        u'{0}="{1}"'.format(name, _escape(value))
+        for name, value in sorted(labels.items())) + u'}'
+
+
+class MetricsRegistry(instrument.Observer):
+    """Counters and stage latency histograms of verifications.
+
+    Register it to `observers` of :class:`itunesiap.environment.Environment`.
+    It is thread-safe and one registry can observe many environments.
+
+    :param histogram_options: Options for :class:`Histogram` of each stage.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, **histogram_options):
+        self.histogram_options = histogram_options
+        #: Attempts by the endpoint.
+        self.calls = Counter()
+        #: Answered attempts by the endpoint and the receipt status.
+        self.statuses = Counter()
+        #: Failed attempts without an answer by the endpoint and the error.
+        self.errors = Counter()
+        #: Retried attempts by the endpoint.
+        self.retries = Counter()
+        #: Verifications by the fallback to sandbox server.
+        self.verifications = Counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} verifications={total}>'.format(self=self, total=self.verifications.total())
+
+    def histogram(self, stage):
+        """Return the latency :class:`Histogram` of `stage`."""
+        try:
+            return self._stages[stage]
+        except KeyError:
+            with self._lock:
+                if stage not in self._stages:
+                    self._stages[stage] = Histogram(**self.histogram_options)
+                return self._stages[stage]
+
+    def on_event(self, event):
+        self.histogram(event.stage).record(event.duration)
+        if event.stage == instrument.ATTEMPT:
+            self.calls.inc((event.url,))
+            if event.attempt > 1:
+                self.retries.inc((event.url,))
+            if event.status is not None:
+                self.statuses.inc((event.url, event.status))
+            else:
+                self.errors.inc((event.url, event.error.__class__.__name__))
+        elif event.stage == instrument.VERIFY:
+            self.verifications.inc((event.fallback,))
+
+    def snapshot(self):
+        """Return the metrics as plain :class:`dict` values."""
+        verifications = self.verifications.total()
+        fallbacks = self.verifications.get((True,))
+        calls = self.calls.total()
+        retries = self.retries.total()
+        statuses = {}
+        for (url, status), count in self.statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+        errors = {}
+        for (url, error), count in self.errors.items():
+            errors[error] = errors.get(error, 0) + count
+        return {
+            'verifications': verifications,
+            'fallbacks': fallbacks,
+            'fallback_rate': float(fallbacks) / verifications if verifications else 0.0,
+            'calls': dict((url, count) for (url,), count in self.calls.items()),
+            'retries': retries,
+            'retry_rate': float(retries) / calls if calls else 0.0,
+            'statuses': statuses,
+            'errors': errors,
+            'stages': dict(
+                (stage, histogram.snapshot())
+                for stage, histogram in list(self._stages.items())),
+        }
+
+    def to_prometheus(self, prefix='itunesiap'):
+        """Return the metrics in Prometheus text exposition format.
+
+        Stage latencies are exported as summaries of :attr:`QUANTILES`.
+        """
+        lines = []
+
+        def counter(name, description, values, label_names):
+            name = u'{0}_{1}'.format(prefix, name)
+            lines.append(u'# HELP {0} {1}'.format(name, description))
+            lines.append(u'# TYPE {0} counter'.format(name))
+            for key, count in sorted(values, key=lambda item: repr(item[0])):
+                labels = _labels(**dict(zip(label_names, key)))
+                lines.append(u'{0}{1} {2}'.format(name, labels, count))
+
+        counter(
+            'calls_total', 'Verifying requests by endpoint.',
+            self.calls.items(), ('endpoint',))
+        counter(
+            'status_total', 'Answered requests by endpoint and receipt status.',
+            self.statuses.items(), ('endpoint', 'status'))
+        counter(
+            'errors_total', 'Unanswered requests by endpoint and error.',
+            self.errors.items(), ('endpoint', 'error'))
+        counter(
+            'retries_total', 'Retried requests by endpoint.',
+            self.retries.items(), ('endpoint',))
+        counter(
+            'verifications_total', 'Verifications by sandbox fallback.',
+            [((str(fallback).lower(),), count)
+             for (fallback,), count in self.verifications.items()],
+            ('fallback',))
+
+        name = u'{0}_stage_seconds'.format(prefix)
+        lines.append(u'# HELP {0} Latency of verification stages.'.format(name))
+        lines.append(u'# TYPE {0} summary'.format(name))
+        for stage in instrument.STAGES:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                continue
+            for q in self.QUANTILES:
+                lines.append(u'{0}{1} {2!r}'.format(
+                    name, _labels(stage=stage, quantile=q), histogram.percentile(q)))
+            lines.append(u'{0}_sum{1} {2!r}'.format(name, _labels(stage=stage), histogram.sum))
+            lines.append(u'{0}_count{1} {2}'.format(name, _labels(stage=stage), histogram.count))
+        return u'\n'.join(lines) + u'\n'
@@ -0,0 +1,156 @@
+""":mod:`itunesiap.precheck`
+
+Local pre-check of receipt data before sending it to iTunes server.
+
+Obviously malformed receipt data is answered by iTunes server with the status
+21002 after a round trip, and one more round trip to sandbox server in review
+mode. With a pre-check in the environment, it is rejected immediately by
+:class:`itunesiap.exceptions.PrecheckFailed`, which is an
+:class:`itunesiap.exceptions.InvalidReceipt` of the status 21002.
+
+.. sourcecode:: python
+
+    >>> env = itunesiap.env.review.clone(precheck=itunesiap.precheck.Precheck())
+    >>> itunesiap.verify('wrong receipt', env=env)
+    Traceback (most recent call last):
+    ...
+    PrecheckFailed: ...
+
+The checks are:
+
+- The base64 alphabet and the padding.
+- The size bounds of the base64 text.
+- The container sniffed from the first bytes: a legacy receipt is a
+  NeXTSTEP property list and an app receipt is a PKCS#7 `SignedData`.
+- Optionally the receipt decoded by :mod:`itunesiap.local`, except the
+  `purchase-info` of legacy receipts.
+
+To bypass it for a call, give `precheck=None`:
+
+.. sourcecode:: python
+
+    >>> itunesiap.verify(receipt, env=env, precheck=None)
+"""
+import re
+import base64
+import binascii
+
+import six
+
+from . import exceptions
+
+__all__ = ('Precheck', 'LEGACY', 'PKCS7')
+
+
+LEGACY = 'legacy'
+PKCS7 = 'pkcs7'
+
+_BASE64 = re.compile(r'[A-Za-z0-9+/]*={0,2}\Z')
+_SPACES = re.compile(r'\s+')
+# ContentInfo SEQUENCE starts with the OID of SignedData
+_SIGNED_DATA_OID = b'\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x07\x02'
+_PLIST_SPACES = bytearray(b' \t\r\n')
+# the failures of the decoders beside MalformedReceipt, e.g. RecursionError
+_DECODE_ERRORS = (ValueError, LookupError, TypeError, RuntimeError)
+
+
+def sniff(head):
+    """Return the container type of the decoded first bytes of a receipt or
+    `None` if unknown.
+    """
+    head = bytearray(head)
+    if not head:
+        return None
+    if head[0] == 0x30 and len(head) > 2:
+        length = head[1]
+        offset = 2
+        if length & 0x80 and length != 0x80:
+            offset += length & 0x7f
+        if bytes(head[offset:offset + len(_SIGNED_DATA_OID)]) == _SIGNED_DATA_OID:
+            return PKCS7
+        return None
+    for byte in head:
+        if byte in _PLIST_SPACES:
+            continue
+        if byte == ord('{'):
+            return LEGACY
+        break
+    return None
+
+
+class Precheck(object):
+    """Pre-check policy of receipt data.
+
+    :param int min_size: The minimum length of the base64 text.
+    :param int max_size: The maximum length of the base64 text.
+    :param bool sniff: Check the container from the first bytes.
+    :param bool decode: Decode the receipt by :mod:`itunesiap.local` at the
+        cost of the decoding. It catches truncated and corrupted app receipts
+        and outer property lists of legacy receipts, but the `purchase-info`
+        of legacy receipts is not decoded.
+    """
+
+    def __init__(self, min_size=64, max_size=8 * 1024 * 1024, sniff=True, decode=False):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.sniff = sniff
+        self.decode = decode
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} min_size={self.min_size} max_size={self.max_size} sniff={self.sniff} decode={self.decode}>'.format(self=self)
+
+    def check(self, receipt_data):
+        """Check `receipt_data` and return the container type, `None` when it
+        is not sniffed.
+
+        :raises itunesiap.exceptions.PrecheckFailed: When it is malformed.
+        """
+        if isinstance(receipt_data, six.binary_type):
+            try:
+                receipt_data = receipt_data.decode('ascii')
+            except UnicodeDecodeError:
+                raise exceptions.PrecheckFailed(u'Not base64')
+        elif not isinstance(receipt_data, six.text_type):
+            raise exceptions.PrecheckFailed(u'Not a string')
+        size = len(receipt_data)
+        if size > self.max_size:
+            raise exceptions.PrecheckFailed(u'Too large: {0}'.format(size))
+        if _SPACES.search(receipt_data):
+            receipt_data = _SPACES.sub(u'', receipt_data)
+            size = len(receipt_data)
+        if size < self.min_size:
+            raise exceptions.PrecheckFailed(u'Too small: {0}'.format(size))
+        if size % 4 or not _BASE64.match(receipt_data):
+            raise exceptions.PrecheckFailed(u'Not base64')
+
+        container = None
+        if self.sniff:
+            try:
+                head = base64.b64decode(receipt_data[:24])
+            except (TypeError, binascii.Error):  # pragma: no cover
+                raise exceptions.PrecheckFailed(u'Not base64')
+            container = sniff(head)
+            if container is None:
+                raise exceptions.PrecheckFailed(u'Unknown container')
+        if self.decode:
+            container = self._decode(receipt_data, container)
+        return container
+
+    @staticmethod
+    def _decode(receipt_data, container):
+        from . import local
+        try:
+            if container == LEGACY:
+                local.decode_legacy(receipt_data)
+            elif container == PKCS7:
+                local.decode_unified(receipt_data)
+            else:
+                try:
+                    local.decode_unified(receipt_data)
+                    return PKCS7
+                except _DECODE_ERRORS:
+                    local.decode_legacy(receipt_data)
+                    return LEGACY
+        except _DECODE_ERRORS as e:
+            raise exceptions.PrecheckFailed(u'Not decodable: {0}'.format(e))
+        return container
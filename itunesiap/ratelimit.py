@@ -0,0 +1,182 @@
+""":mod:`itunesiap.ratelimit`
+
+Client-side rate limiting of verifying requests by token buckets.
+
+Bulk jobs like re-verification of every subscriber can flood Apple and get
+throttled. :class:`RateLimiter` keeps separate buckets for production and
+sandbox servers and it is shared by every caller of the environment.
+
+.. sourcecode:: python
+
+    >>> limiter = itunesiap.ratelimit.RateLimiter(
+    >>>     production=itunesiap.ratelimit.TokenBucket(rate=50.0, capacity=100),
+    >>>     sandbox=itunesiap.ratelimit.TokenBucket(rate=5.0))
+    >>> env = itunesiap.env.review.clone(rate_limiter=limiter)
+    >>> itunesiap.verify(receipt, env=env)
+
+To share one budget by every worker process on a host, use
+:class:`FileTokenBucket` with the same path.
+"""
+import os
+import time
+import struct
+import threading
+
+from . import exceptions
+from .tools import monotonic
+
+__all__ = ('TokenBucket', 'FileTokenBucket', 'RateLimiter')
+
+
+class TokenBucket(object):
+    """Token bucket in a process.
+
+    :param float rate: The number of tokens filled per second.
+    :param float capacity: The maximum number of tokens. The default value is
+        the larger one of `rate` and 1. The bucket starts full.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if capacity is None:
+            capacity = max(1.0, float(rate))
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} rate={self.rate} capacity={self.capacity}>'.format(self=self)
+
+    def _fill(self, tokens, updated_at, now):
+        return min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+
+    def take(self, tokens=1):
+        """Take `tokens` if available and return 0. Otherwise take nothing and
+        return the seconds until they will be available.
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = self._fill(self._tokens, self._updated_at, now)
+            self._updated_at = now
+            return self._take(tokens)
+
+    def _take(self, tokens):
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        if tokens > self.capacity or self.rate <= 0.0:
+            return float('inf')
+        return (tokens - self._tokens) / self.rate
+
+    def try_acquire(self, tokens=1):
+        """Take `tokens` without blocking. Return `True` if taken."""
+        return self.take(tokens) == 0.0
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until `tokens` are taken. Return `False` when it would take
+        longer than `timeout` seconds.
+        """
+        if timeout is not None:
+            expires_at = monotonic() + timeout
+        while True:
+            wait = self.take(tokens)
+            if wait == 0.0:
+                return True
+            if timeout is not None and monotonic() + wait > expires_at:
+                return False
+            time.sleep(wait)
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket shared by processes through a file.
+
+    The bucket state is stored in the file at `path` and updated under an
+    exclusive :func:`fcntl.flock`. Every process using the same path shares
+    one budget. Only available on POSIX systems.
+
+    :param str path: The path of the state file. Created if missing.
+    """
+
+    _state = struct.Struct('<dd')
+
+    def __init__(self, path, rate, capacity=None):
+        TokenBucket.__init__(self, rate, capacity)
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} path={self.path!r} rate={self.rate} capacity={self.capacity}>'.format(self=self)
+
+    def _open(self):
+        # flock is bound to the open file; each process opens its own one.
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def take(self, tokens=1):
+        import fcntl
+
+        with self._lock:
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                data = os.read(fd, self._state.size)
+                now = time.time()
+                if len(data) == self._state.size:
+                    stored, updated_at = self._state.unpack(data)
+                    self._tokens = self._fill(stored, updated_at, now)
+                else:
+                    self._tokens = self.capacity
+                wait = self._take(tokens)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, self._state.pack(self._tokens, now))
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            return wait
+
+
+class RateLimiter(object):
+    """Rate limiter with a bucket for each server.
+
+    :param TokenBucket production: The bucket for production server. `None`
+        for no limit.
+    :param TokenBucket sandbox: The bucket for sandbox server. `None` for no
+        limit.
+    :param bool blocking: Wait for a token when `True`. Otherwise
+        :class:`itunesiap.exceptions.RateLimited` is raised immediately.
+    :param float timeout: The maximum seconds to wait for a token. `None`
+        means no limit except the deadline of the verification.
+    """
+
+    def __init__(self, production=None, sandbox=None, blocking=True, timeout=None):
+        self.buckets = {'production': production, 'sandbox': sandbox}
+        self.blocking = blocking
+        self.timeout = timeout
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} buckets={self.buckets!r} blocking={self.blocking}>'.format(self=self)
+
+    def bucket(self, tier):
+        """Return the bucket of `tier`, `production` or `sandbox`."""
+        return self.buckets.get(tier)
+
+    def acquire(self, tier, deadline=None):
+        """Take a token of `tier` or raise
+        :class:`itunesiap.exceptions.RateLimited`.
+        """
+        bucket = self.buckets.get(tier)
+        if bucket is None:
+            return
+        if not self.blocking:
+            acquired = bucket.try_acquire()
+        else:
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = deadline.timeout(timeout)
+            acquired = bucket.acquire(timeout=timeout)
+        if not acquired:
+            raise exceptions.RateLimited(tier=tier)
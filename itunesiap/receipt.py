@@ -11,6 +11,7 @@ import json
 from collections import defaultdict
 from prettyexc import PrettyException
 
+from . import compact
 from .tools import lazy_property
 
 __all__ = ('WARN_UNDOCUMENTED_FIELDS', 'Response', 'Receipt', 'InApp')
@@ -437,15 +438,52 @@ class Response(ObjectMapper):
     __UNDOCUMENTED_FIELDS__ = frozenset([
     ])
 
+    def __reduce__(self):
+        return _response_from_bytes, (self.__class__, self.to_bytes())
+
+    def to_bytes(self, fields=None):
+        """Serialize the response into the compact format of
+        :mod:`itunesiap.compact`.
+
+        :param fields: The projection of the fields. See
+            :func:`itunesiap.compact.dumps`.
+        :rtype: :class:`bytes`
+        """
+        return compact.dumps(self._, fields)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a response from :meth:`to_bytes`. The data is
+        decoded lazily by each accessed level.
+
+        :raises ValueError: When `data` is not in the format.
+        """
+        return cls(compact.loads(data))
+
+    def diff(self, previous=None):
+        """Return the new purchases and the changed statuses since the
+        previous verification. See :mod:`itunesiap.delta`.
+
+        :param previous: A :class:`itunesiap.delta.State`, the previous
+            response or `None`.
+        :rtype: :class:`itunesiap.delta.Delta`
+        """
+        from .delta import diff
+        return diff(self, previous)
+
     @lazy_property
     def latest_receipt_info(self):
         if 'latest_receipt_info' not in self:
             # not an auto-renew purchase
             raise MissingFieldError('latest_receipt_info')
         info = self['latest_receipt_info']
-        if isinstance(info, dict):  # iOS6 style
+        if isinstance(info, compact.Mapping):  # iOS6 style
             return Purchase(info)
-        elif isinstance(info, list):  # iOS7 style
+        elif isinstance(info, compact.Sequence):  # iOS7 style
             return InApp.from_list(info)
         else:  # pragma: no cover
             assert False
+
+
+def _response_from_bytes(cls, data):
+    return cls.from_bytes(data)
@@ -1,5 +1,7 @@
 """:mod:`itunesiap.request`"""
 
+from itunesiap.environment import Environment
+from itunesiap.deadline import Deadline
 from itunesiap.verify_requests import RequestsVerify
 
 try:
@@ -40,6 +42,53 @@ class RequestBase(object):
             request_content['password'] = self.password
         return request_content
 
+    def _tier(self, url, env=None):
+        """Return `sandbox` for the sandbox URLs. Otherwise `production`."""
+        endpoints = env.endpoints if env is not None else None
+        if endpoints is not None:
+            tier = endpoints.tier(url)
+            if tier is not None:
+                return tier
+        if url == self.SANDBOX_VALIDATION_URL:
+            return 'sandbox'
+        return 'production'
+
+    @staticmethod
+    def _resolve_environment(options, env):
+        """Return the environment of a verifying call.
+
+        `env` in `options` replaces the given default `env` and the other
+        environment items in `options` override it.
+        """
+        env = options.get('env') or env
+        overrides = dict(
+            (item, options[item]) for item in Environment.ITEMS
+            if item in options)
+        if overrides:
+            env = env.clone(**overrides)
+        return env
+
+    @staticmethod
+    def _start_deadline(env):
+        """Start the total time budget of a verifying call if configured."""
+        deadline = env.deadline
+        if deadline is None or isinstance(deadline, Deadline):
+            return deadline
+        return Deadline(deadline)
+
+    def _precheck(self, env):
+        """Check the receipt data locally if the pre-check is configured.
+
+        :raises itunesiap.exceptions.PrecheckFailed: When it is malformed.
+        """
+        if env.precheck is not None:
+            env.precheck.check(self.receipt_data)
+
+    @staticmethod
+    def _cache_hit(probe):
+        if probe is not None:
+            probe.cache_hit = True
+
 
 class Request(RequestBase, RequestsVerify, AiohttpVerify):
     """Validation request with raw receipt.
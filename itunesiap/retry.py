@@ -0,0 +1,106 @@
+""":mod:`itunesiap.retry`
+
+:class:`RetryPolicy` decides whether a failed verification request is worth
+another try and how long to wait before it.
+
+Apple asks to retry the request later for status 21005 and the
+"internal data access error" range 21100-21199. The response also may include
+`is-retryable` field for those transient failures.
+Transport failures like timeouts and HTTP errors are retryable by default too.
+
+To use a retry policy, set it to the environment as `retry`.
+
+.. sourcecode:: python
+
+    >>> policy = itunesiap.retry.RetryPolicy(max_attempts=3, deadline=10.0)
+    >>> env = itunesiap.env.production.clone(retry=policy)
+    >>> itunesiap.verify(receipt, env=env)
+"""
+import random
+
+from . import exceptions
+from .tools import monotonic
+
+__all__ = ('RETRYABLE_STATUSES', 'RetryPolicy')
+
+
+#: 21005 and the internal data access error range 21100-21199.
+RETRYABLE_STATUSES = frozenset([21005] + list(range(21100, 21200)))
+
+
+class RetryPolicy(object):
+    """Retry policy for each verifying server.
+
+    The n-th retry waits `backoff * multiplier ** (n - 1)` seconds but not
+    longer than `max_backoff`. The wait is shortened by a random ratio up to
+    `jitter` to spread retries of concurrent callers.
+
+    :param int max_attempts: The maximum number of attempts including the
+        first one.
+    :param float backoff: The wait before the first retry in seconds.
+    :param float multiplier: The growth rate of the wait.
+    :param float max_backoff: The upper bound of a wait in seconds.
+    :param float jitter: The ratio between 0 and 1 of the random reduction of
+        a wait. 0 means no jitter.
+    :param float deadline: The total time budget for attempts to a server in
+        seconds. A retry which cannot start before the deadline is not tried.
+        `None` means no limit.
+    :param retryable_statuses: The receipt status codes to retry.
+    :param tuple retryable_exceptions: The exception types to retry.
+    """
+
+    def __init__(
+            self, max_attempts=3, backoff=0.1, multiplier=2.0,
+            max_backoff=5.0, jitter=0.5, deadline=None,
+            retryable_statuses=RETRYABLE_STATUSES,
+            retryable_exceptions=(exceptions.ItunesServerNotAvailable,)):
+        assert max_attempts >= 1
+        assert 0.0 <= jitter <= 1.0
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retryable_statuses = frozenset(retryable_statuses)
+        self.retryable_exceptions = tuple(retryable_exceptions)
+        self._random = random.random
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} max_attempts={self.max_attempts} backoff={self.backoff} deadline={self.deadline}>'.format(self=self)
+
+    def is_retryable(self, error):
+        """Test the given exception is a transient failure."""
+        if isinstance(error, exceptions.CircuitOpen):
+            return False
+        if isinstance(error, exceptions.InvalidReceipt):
+            return error.status in self.retryable_statuses or error.is_retryable
+        return isinstance(error, self.retryable_exceptions)
+
+    def delay(self, attempt):
+        """Return the wait in seconds after the `attempt`-th attempt."""
+        delay = min(
+            self.max_backoff, self.backoff * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            delay *= 1.0 - self.jitter * self._random()
+        return delay
+
+    def next_delay(self, error, attempt, started_at, deadline=None):
+        """Return the wait before the next attempt or `None` to give up.
+
+        :param error: The exception raised by the `attempt`-th attempt.
+        :param int attempt: The number of attempts done.
+        :param float started_at: The :func:`itunesiap.tools.monotonic` time
+            when the first attempt started.
+        :param itunesiap.deadline.Deadline deadline: The total time budget of
+            the verification if exists.
+        """
+        if attempt >= self.max_attempts or not self.is_retryable(error):
+            return None
+        delay = self.delay(attempt)
+        if self.deadline is not None:
+            if monotonic() + delay - started_at >= self.deadline:
+                return None
+        if deadline is not None and delay >= deadline.remaining():
+            return None
+        return delay
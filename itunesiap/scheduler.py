@@ -0,0 +1,385 @@
+""":mod:`itunesiap.scheduler`
+
+Re-verification of subscriptions around their expiration. Only available in
+python3.5+.
+
+Polling every subscriber in a fixed interval spends the most of the requests
+on the subscriptions which didn't change. :class:`RefreshScheduler` keeps a
+timer queue of the next refresh of each receipt and verifies it again only
+when a renewal, an expiration or a billing retry is expected.
+
+.. sourcecode:: python
+
+    >>> scheduler = itunesiap.scheduler.RefreshScheduler(
+    ...     path='/var/lib/itunesiap/refresh.db', env=env, concurrency=10,
+    ...     budget=itunesiap.ratelimit.TokenBucket(rate=20.0),
+    ...     on_response=store_response)
+    >>> scheduler.ingest(user_id, await itunesiap.aioverify(receipt, env=env), receipt)
+    >>> await scheduler.run()  # until scheduler.stop()
+
+The queue is persisted in SQLite, so the scheduled refreshes survive
+restarts. A refresh is removed from the file only when it is done, so the
+ones in flight at a crash are run again.
+"""
+import time
+import heapq
+import asyncio
+import functools
+
+import six
+
+from . import exceptions
+from .request import Request
+from .dispatcher import BACKGROUND
+from .tools import SQLiteConnections
+
+__all__ = ('RefreshScheduler', 'next_refresh')
+
+
+def _is_true(value):
+    return six.text_type(value) in ('1', 'true')
+
+
+def next_refresh(response, now=None, margin=60.0, retry_interval=3600.0):
+    """Return the time of the next refresh of `response` or `None` if
+    nothing is expected to change.
+
+    - An active subscription is refreshed `margin` seconds after its
+      `expires_date`, when its renewal is in the receipt.
+    - A subscription in the billing retry is refreshed every
+      `retry_interval` seconds, and at the end of its grace period.
+    - An expired subscription which is still auto-renewing is refreshed every
+      `retry_interval` seconds.
+
+    The earliest one of the subscriptions in `response` is returned.
+
+    :param response: A :class:`itunesiap.receipt.Response` or its data.
+    :param float now: The current time in seconds since the epoch.
+    :rtype: float
+    """
+    if now is None:
+        now = time.time()
+    data = getattr(response, '_', response)
+    records = data.get('latest_receipt_info')
+    if not records:
+        records = (data.get('receipt') or {}).get('in_app') or ()
+    elif 'product_id' in records:  # iOS6 style
+        records = [records]
+    expires = {}
+    for record in records:
+        expires_ms = record.get('expires_date_ms')
+        if expires_ms is None:
+            continue
+        original_transaction_id = record.get('original_transaction_id')
+        expires[original_transaction_id] = max(int(expires_ms), expires.get(original_transaction_id, 0))
+    renewal_info = dict(
+        (info.get('original_transaction_id'), info)
+        for info in data.get('pending_renewal_info') or ())
+
+    candidates = []
+    for original_transaction_id, expires_ms in expires.items():
+        expires_at = expires_ms / 1000.0 + margin
+        info = renewal_info.get(original_transaction_id, {})
+        if _is_true(info.get('is_in_billing_retry_period')):
+            at = now + retry_interval
+            grace_ms = info.get('grace_period_expires_date_ms')
+            if grace_ms:
+                grace_at = int(grace_ms) / 1000.0 + margin
+                if now < grace_at < at:
+                    at = grace_at
+            candidates.append(at)
+        elif expires_at > now:
+            candidates.append(expires_at)
+        elif _is_true(info.get('auto_renew_status', '1')):
+            # the renewal is not in the receipt yet
+            candidates.append(now + retry_interval)
+    return min(candidates) if candidates else None
+
+
+class _Entry(object):
+
+    def __init__(self, receipt_data, password, due_at):
+        self.receipt_data = receipt_data
+        self.password = password
+        #: `None` while it is in flight
+        self.due_at = due_at
+
+
+class RefreshScheduler(object):
+    """The timer queue of the refreshes of receipts.
+
+    Each receipt is scheduled by a key like the account of the user. The
+    scheduler belongs to an event loop once it runs.
+
+    :param str path: The SQLite file persisting the queue. `None` to keep it
+        only in memory. The queue is written synchronously in the event loop
+        on every refresh, so keep the file on a local disk.
+    :param itunesiap.environment.Environment env: The environment of the
+        verifications. `None` for the default of
+        :meth:`itunesiap.request.Request.aioverify`.
+    :param int concurrency: The maximum number of the refreshes in flight.
+    :param itunesiap.ratelimit.TokenBucket budget: The rate budget of the
+        refreshes. Each one takes a token.
+    :param on_response: A function or a coroutine function taking the key and
+        the refreshed :class:`itunesiap.receipt.Response`.
+    :param on_error: A function or a coroutine function taking the key and
+        the exception of a failed refresh, which is any exception of the
+        verification.
+    :param float margin: Seconds after the expiration to refresh.
+    :param float retry_interval: Seconds between the refreshes of a
+        subscription waiting for the billing or the renewal.
+    :param float error_delay: Seconds to wait to refresh again after a
+        transient failure. A receipt rejected by
+        :class:`itunesiap.exceptions.InvalidReceipt` is unscheduled unless
+        the status is retryable or 21006.
+    :param str priority: The priority class of the verifications for the
+        dispatcher of `env`.
+    :param float timeout: Seconds to wait for the lock of the database.
+    """
+
+    def __init__(
+            self, path=None, env=None, concurrency=10, budget=None,
+            on_response=None, on_error=None, margin=60.0,
+            retry_interval=3600.0, error_delay=300.0, priority=BACKGROUND,
+            timeout=5.0):
+        self.path = path
+        self.env = env
+        self.concurrency = concurrency
+        self.budget = budget
+        self.on_response = on_response
+        self.on_error = on_error
+        self.margin = margin
+        self.retry_interval = retry_interval
+        self.error_delay = error_delay
+        self.priority = priority
+        #: The number of the successful refreshes.
+        self.refreshed = 0
+        #: The number of the failed refreshes.
+        self.failed = 0
+        self._entries = {}
+        self._heap = []
+        self._counter = 0
+        self._wakeup = None
+        self._stopping = False
+        self._error = None
+        if path is None:
+            self._connections = None
+            return
+        self._connections = SQLiteConnections(path, timeout)
+        with self._connections.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS refreshes ('
+                'key TEXT PRIMARY KEY, receipt_data TEXT NOT NULL, '
+                'password TEXT, due_at REAL NOT NULL)')
+            rows = connection.execute('SELECT key, receipt_data, password, due_at FROM refreshes').fetchall()
+        for key, receipt_data, password, due_at in rows:
+            self._push(key, _Entry(receipt_data, password, due_at))
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} path={self.path!r} scheduled={count}>'.format(
+            self=self, count=len(self))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return six.text_type(key) in self._entries
+
+    def due_at(self, key):
+        """Return the time of the next refresh of `key` or `None` if it is
+        not scheduled or in flight.
+        """
+        entry = self._entries.get(six.text_type(key))
+        return entry.due_at if entry is not None else None
+
+    def _push(self, key, entry):
+        self._entries[key] = entry
+        self._counter += 1
+        heapq.heappush(self._heap, (entry.due_at, self._counter, key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def schedule(self, key, receipt_data, due_at, password=None):
+        """Schedule the refresh of `receipt_data` of `key` at `due_at`,
+        replacing the previous one of `key`.
+        """
+        key = six.text_type(key)
+        if self._connections is not None:
+            with self._connections.transaction() as connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?, ?)',
+                    (key, receipt_data, password, due_at))
+        self._push(key, _Entry(receipt_data, password, due_at))
+
+    def unschedule(self, key):
+        """Remove the refresh of `key`."""
+        key = six.text_type(key)
+        if self._connections is not None:
+            with self._connections.transaction() as connection:
+                connection.execute('DELETE FROM refreshes WHERE key = ?', (key,))
+        # the entries in the heap are skipped
+        self._entries.pop(key, None)
+
+    def ingest(self, key, response, receipt_data=None, password=None, now=None):
+        """Schedule the next refresh of `key` by `response`. Nothing is
+        scheduled if nothing is expected to change.
+
+        :param receipt_data: The receipt to verify again. The default is
+            `latest_receipt` of `response` or the previous one of `key`.
+        :param password: The shared secret. The default is the previous one
+            of `key`.
+        :return: The time of the next refresh or `None`.
+        """
+        key = six.text_type(key)
+        previous = self._entries.get(key)
+        if receipt_data is None:
+            data = getattr(response, '_', response)
+            receipt_data = data.get('latest_receipt')
+            if receipt_data is None and previous is not None:
+                receipt_data = previous.receipt_data
+            if receipt_data is None:
+                raise ValueError(u'No receipt data to refresh {0!r}'.format(key))
+        if password is None and previous is not None:
+            password = previous.password
+        due_at = next_refresh(response, now, self.margin, self.retry_interval)
+        if due_at is None:
+            self.unschedule(key)
+        else:
+            self.schedule(key, receipt_data, due_at, password)
+        return due_at
+
+    def _peek(self):
+        heap = self._heap
+        while heap:
+            due_at, _, key = heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry.due_at == due_at:
+                return due_at, key
+            heapq.heappop(heap)  # replaced, removed or in flight
+        return None
+
+    async def _sleep(self, timeout):
+        self._wakeup.clear()
+        if timeout is not None and timeout <= 0.0:
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _next(self):
+        """Wait for the next due refresh and return the pair of its key and
+        entry, or `None` when the scheduler is stopping.
+        """
+        while not self._stopping and self._error is None:
+            now = time.time()
+            due = self._peek()
+            if due is None or due[0] > now:
+                await self._sleep(None if due is None else due[0] - now)
+                continue
+            if self.budget is not None:
+                wait = self.budget.take()
+                if wait:
+                    await self._sleep(None if wait == float('inf') else wait)
+                    continue
+            _, key = due
+            heapq.heappop(self._heap)
+            entry = self._entries[key]
+            entry.due_at = None
+            return key, entry
+        return None
+
+    async def _call(self, callback, *args):
+        if callback is not None:
+            result = callback(*args)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def _refresh(self, key, entry):
+        # the entry may be unscheduled before the task starts
+        request = Request(entry.receipt_data, entry.password)
+        options = {'priority': self.priority}
+        if self.env is not None:
+            options['env'] = self.env
+
+        def current():
+            # not replaced while in flight
+            return self._entries.get(key) is entry and entry.due_at is None
+
+        try:
+            response = await request.aioverify(**options)
+        except exceptions.InvalidReceipt as e:
+            self.failed += 1
+            if current():
+                if e.is_retryable or e.status == 21005:
+                    self.schedule(key, entry.receipt_data, time.time() + self.error_delay, entry.password)
+                elif e.status == 21006:  # expired but decoded
+                    self.ingest(key, e, entry.receipt_data, entry.password)
+                else:
+                    self.unschedule(key)
+            await self._call(self.on_error, key, e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # any other failure of the verification is transient, like a
+            # disconnection; only the callbacks stop the scheduler
+            self.failed += 1
+            if current():
+                self.schedule(key, entry.receipt_data, time.time() + self.error_delay, entry.password)
+            await self._call(self.on_error, key, e)
+        else:
+            self.refreshed += 1
+            if current():
+                self.ingest(key, response, password=entry.password)
+            await self._call(self.on_response, key, response)
+
+    def _done(self, semaphore, tasks, task):
+        semaphore.release()
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None and self._error is None:
+            self._error = task.exception()
+            self._wakeup.set()
+
+    async def run(self):
+        """Run the due refreshes until :meth:`stop` is called. The refreshes
+        in flight are waited for.
+
+        :raises: The exception of `on_response` or `on_error`, which stops
+            the scheduler.
+        """
+        self._stopping = False
+        self._error = None
+        self._wakeup = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        try:
+            while True:
+                await semaphore.acquire()
+                due = await self._next()
+                if due is None:
+                    semaphore.release()
+                    break
+                task = asyncio.ensure_future(self._refresh(*due))
+                tasks.add(task)
+                task.add_done_callback(functools.partial(self._done, semaphore, tasks))
+            if tasks:
+                await asyncio.wait(tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            self._wakeup = None
+        if self._error is not None:
+            raise self._error
+
+    def stop(self):
+        """Stop :meth:`run` after the refreshes in flight."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def close(self):
+        """Close the connection of the current thread to the database."""
+        if self._connections is not None:
+            self._connections.close()
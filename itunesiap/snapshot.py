@@ -0,0 +1,390 @@
+""":mod:`itunesiap.snapshot`
+
+Snapshots of entitlements in memory-mapped files.
+
+.. sourcecode:: python
+
+    >>> builder = itunesiap.snapshot.SnapshotBuilder()
+    >>> for user, response in responses:
+    ...     builder.add_response(user, response)
+    >>> builder.write('/var/lib/itunesiap/entitlements.snapshot')
+
+    >>> reader = itunesiap.snapshot.SnapshotReader('/var/lib/itunesiap/entitlements.snapshot')
+    >>> reader.entitled(user, 'com.example.premium')
+    True
+
+A snapshot is a file of fixed size records sorted by the user and the
+product. A lookup is a binary search in the mapped file without a copy of the
+records, so processes reading the same snapshot share its pages.
+
+:meth:`SnapshotBuilder.write` replaces the file atomically and
+:class:`SnapshotReader` swaps in the new one by checking the file in an
+interval. The lookups in progress keep using the old one.
+"""
+import os
+import mmap
+import time
+import struct
+import hashlib
+
+import six
+
+from .receipt import Response
+from .tools import monotonic
+
+__all__ = (
+    'SnapshotBuilder', 'Snapshot', 'SnapshotReader', 'Entitlement',
+    'ACTIVE', 'GRACE', 'BILLING_RETRY', 'REVOKED', 'NEVER')
+
+
+#: The subscription is paid or the purchase doesn't expire.
+ACTIVE = 1
+#: The billing is failed but the customer has the grace period.
+GRACE = 2
+#: The billing is failed and Apple is retrying it.
+BILLING_RETRY = 3
+#: The purchase is cancelled by Apple support.
+REVOKED = 4
+
+#: `expires_ms` of the purchases without expiration.
+NEVER = 2 ** 63 - 1
+
+#: The states which entitle the user until `expires_ms`.
+ENTITLED_STATES = frozenset([ACTIVE, GRACE])
+
+_STATE_NAMES = {ACTIVE: 'active', GRACE: 'grace', BILLING_RETRY: 'billing_retry', REVOKED: 'revoked'}
+
+
+def user_key(user):
+    """Return the fixed size key of `user` in the records."""
+    if isinstance(user, six.text_type):
+        user = user.encode('utf-8')
+    elif not isinstance(user, bytes):
+        user = six.text_type(user).encode('utf-8')
+    return hashlib.md5(user).digest()
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _ms(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+class Entitlement(object):
+    """An entitlement of a user to a product."""
+
+    def __init__(self, product_id, expires_ms, state):
+        self.product_id = product_id
+        self.expires_ms = expires_ms
+        self.state = state
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} product_id={self.product_id} expires_ms={self.expires_ms} state={state}>'.format(
+            self=self, state=_STATE_NAMES.get(self.state, self.state))
+
+    def __eq__(self, other):
+        return isinstance(other, Entitlement) and (
+            self.product_id, self.expires_ms, self.state) == (
+            other.product_id, other.expires_ms, other.state)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def is_active(self, now_ms=None):
+        """Whether the user is entitled at `now_ms`, the current time by
+        default.
+        """
+        if self.state not in ENTITLED_STATES:
+            return False
+        return (_now_ms() if now_ms is None else now_ms) < self.expires_ms
+
+
+class _Format(object):
+
+    MAGIC = b'IAPS'
+    VERSION = 1
+    #: magic, version, built_at_ms, products, records, products_offset, records_offset
+    HEADER = struct.Struct('<4sIqIxxxxQQQ')
+    #: user key, product code in big endian to sort records as bytes,
+    #: expires_ms, state
+    RECORD = struct.Struct('<16s4sqB3x')
+    CODE = struct.Struct('>I')
+    KEY_SIZE = 20
+    LENGTH = struct.Struct('<H')
+
+
+class SnapshotBuilder(_Format):
+    """Compile entitlements into a snapshot.
+
+    An entitlement added again for the same user and product replaces the
+    previous one.
+    """
+
+    def __init__(self):
+        self._codes = {}
+        self._products = []
+        self._records = []
+
+    def __len__(self):
+        return len(self._records)
+
+    def _code(self, product_id):
+        product_id = six.text_type(product_id)
+        try:
+            return self._codes[product_id]
+        except KeyError:
+            code = self._codes[product_id] = self.CODE.pack(len(self._products))
+            self._products.append(product_id)
+            return code
+
+    def add(self, user, product_id, expires_ms=NEVER, state=ACTIVE):
+        """Add an entitlement of `user` to `product_id`."""
+        if expires_ms is None:
+            expires_ms = NEVER
+        self._records.append(self.RECORD.pack(user_key(user), self._code(product_id), expires_ms, state))
+
+    def add_response(self, user, response):
+        """Add the entitlements of `user` in `response`.
+
+        The purchase of each product lasting longest decides its entitlement,
+        which is :data:`REVOKED` if the purchase is cancelled. A subscription
+        in the billing retry is in :data:`GRACE` until
+        `grace_period_expires_date` if it has the grace period.
+
+        :param response: A :class:`itunesiap.receipt.Response` or its data.
+        :return: The number of the added entitlements.
+        """
+        data = response._ if isinstance(response, Response) else response
+        receipt = data.get('receipt') or {}
+        records = list(receipt.get('in_app') or ())
+        if not records and 'product_id' in receipt:  # legacy receipts
+            records.append(receipt)
+        latest = data.get('latest_receipt_info')
+        if latest:
+            records.extend([latest] if 'product_id' in latest else latest)
+
+        best = {}
+        for record in records:
+            expires_ms = _ms(record.get('expires_date_ms'))
+            if expires_ms is None:
+                expires = record.get('expires_date')  # milliseconds in legacy receipts
+                expires_ms = int(expires) if isinstance(expires, six.string_types) and expires.isdigit() else NEVER
+            state = REVOKED if record.get('cancellation_date_ms') or record.get('cancellation_date') else ACTIVE
+            rank = (expires_ms, state != REVOKED)
+            product_id = record['product_id']
+            if product_id not in best or rank > best[product_id][0]:
+                best[product_id] = rank, record.get('original_transaction_id'), expires_ms, state
+
+        retrying = {}
+        for info in data.get('pending_renewal_info') or ():
+            if six.text_type(info.get('is_in_billing_retry_period')) in ('1', 'true'):
+                retrying[info.get('original_transaction_id')] = _ms(info.get('grace_period_expires_date_ms'))
+
+        for product_id, (_, original_transaction_id, expires_ms, state) in best.items():
+            if state == ACTIVE and original_transaction_id in retrying:
+                grace_ms = retrying[original_transaction_id]
+                if grace_ms is not None and grace_ms > expires_ms:
+                    expires_ms, state = grace_ms, GRACE
+                else:
+                    state = BILLING_RETRY
+            self.add(user, product_id, expires_ms, state)
+        return len(best)
+
+    def _chunks(self, built_at_ms):
+        key_size = self.KEY_SIZE
+        # the sort is stable so the last one of the same key is kept
+        records = sorted(self._records, key=lambda record: record[:key_size])
+        unique = []
+        for record in records:
+            if unique and unique[-1][:key_size] == record[:key_size]:
+                unique[-1] = record
+            else:
+                unique.append(record)
+        products = []
+        for product_id in self._products:
+            encoded = product_id.encode('utf-8')
+            products.append(self.LENGTH.pack(len(encoded)) + encoded)
+        products = b''.join(products)
+        products_offset = self.HEADER.size
+        # records are aligned for the page cache
+        records_offset = (products_offset + len(products) + 7) // 8 * 8
+        yield self.HEADER.pack(
+            self.MAGIC, self.VERSION, built_at_ms, len(self._products), len(unique),
+            products_offset, records_offset)
+        yield products
+        yield b'\x00' * (records_offset - products_offset - len(products))
+        for offset in range(0, len(unique), 65536):
+            yield b''.join(unique[offset:offset + 65536])
+
+    def write(self, path):
+        """Write the snapshot to `path`, replacing the old one atomically."""
+        temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            with open(temporary, 'wb') as f:
+                for chunk in self._chunks(_now_ms()):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            getattr(os, 'replace', os.rename)(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+
+class Snapshot(_Format):
+    """A snapshot file mapped in memory.
+
+    :param str path: The file written by :meth:`SnapshotBuilder.write`.
+    :raises ValueError: When the file is not a snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._stat = os.fstat(f.fileno())
+            if self._stat.st_size < self.HEADER.size:
+                raise ValueError('{0!r} is not a snapshot'.format(path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.built_at_ms, products, records,
+         products_offset, records_offset) = self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC or version != self.VERSION or \
+                len(self._map) != records_offset + records * self.RECORD.size:
+            self._map.close()
+            raise ValueError('{0!r} is not a snapshot'.format(path))
+        self._records = records
+        self._offset = records_offset
+        self._products = []
+        offset = products_offset
+        for _ in range(products):
+            length, = self.LENGTH.unpack_from(self._map, offset)
+            offset += self.LENGTH.size
+            self._products.append(self._map[offset:offset + length].decode('utf-8'))
+            offset += length
+        self._codes = dict((product_id, self.CODE.pack(code)) for code, product_id in enumerate(self._products))
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} path={self.path!r} records={self._records}>'.format(self=self)
+
+    def __len__(self):
+        return self._records
+
+    @property
+    def products(self):
+        """The product ids in the snapshot."""
+        return list(self._products)
+
+    def _search(self, prefix):
+        """Return the index of the first record not less than `prefix`."""
+        buf = self._map
+        size = self.RECORD.size
+        offset = self._offset
+        length = len(prefix)
+        low, high = 0, self._records
+        while low < high:
+            middle = (low + high) // 2
+            position = offset + middle * size
+            if buf[position:position + length] < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _entitlement(self, index):
+        _, code, expires_ms, state = self.RECORD.unpack_from(self._map, self._offset + index * self.RECORD.size)
+        return Entitlement(self._products[self.CODE.unpack(code)[0]], expires_ms, state)
+
+    def lookup(self, user, product_id):
+        """Return the :class:`Entitlement` of `user` to `product_id` or
+        `None`.
+        """
+        code = self._codes.get(product_id)
+        if code is None:
+            return None
+        prefix = user_key(user) + code
+        index = self._search(prefix)
+        position = self._offset + index * self.RECORD.size
+        if index < self._records and self._map[position:position + self.KEY_SIZE] == prefix:
+            return self._entitlement(index)
+        return None
+
+    def entitlements(self, user):
+        """Return the list of :class:`Entitlement` of `user`."""
+        key = user_key(user)
+        index = self._search(key)
+        size = self.RECORD.size
+        entitlements = []
+        while index < self._records:
+            position = self._offset + index * size
+            if self._map[position:position + len(key)] != key:
+                break
+            entitlements.append(self._entitlement(index))
+            index += 1
+        return entitlements
+
+    def entitled(self, user, product_id, now_ms=None):
+        """Whether `user` is entitled to `product_id` at `now_ms`."""
+        entitlement = self.lookup(user, product_id)
+        return entitlement is not None and entitlement.is_active(now_ms)
+
+    def close(self):
+        self._map.close()
+
+
+class SnapshotReader(object):
+    """The latest snapshot of `path`.
+
+    The file is checked in `check_interval` and a replaced one is swapped
+    in. The old snapshot is unmapped when the lookups using it are done.
+
+    :param str path: The file written by :meth:`SnapshotBuilder.write`.
+    :param float check_interval: Seconds between the checks of the file.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.snapshot = Snapshot(path)
+        self._checked_at = monotonic()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} path={self.path!r}>'.format(self=self)
+
+    def reload(self):
+        """Swap in the snapshot if the file is replaced. Return whether it
+        is swapped.
+        """
+        self._checked_at = monotonic()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False  # being replaced
+        current = self.snapshot._stat
+        if (stat.st_ino, stat.st_dev, stat.st_mtime, stat.st_size) == (
+                current.st_ino, current.st_dev, current.st_mtime, current.st_size):
+            return False
+        # the old one may still be read by the other threads, so it isn't
+        # closed but its map is unmapped when it is garbage collected
+        self.snapshot = Snapshot(self.path)
+        return True
+
+    def _current(self):
+        if monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        return self.snapshot
+
+    def lookup(self, user, product_id):
+        """See :meth:`Snapshot.lookup`."""
+        return self._current().lookup(user, product_id)
+
+    def entitlements(self, user):
+        """See :meth:`Snapshot.entitlements`."""
+        return self._current().entitlements(user)
+
+    def entitled(self, user, product_id, now_ms=None):
+        """See :meth:`Snapshot.entitled`."""
+        return self._current().entitled(user, product_id, now_ms)
@@ -0,0 +1,77 @@
+""":mod:`itunesiap.stats`
+
+Light-weight statistics of observed verifying requests.
+"""
+import bisect
+import threading
+from collections import deque
+
+__all__ = ('LatencyWindow', 'LatencyWindows')
+
+
+class LatencyWindow(object):
+    """Rolling window of the recent latencies.
+
+    The samples are also kept sorted, so a percentile is looked up without
+    sorting on every request.
+
+    :param int size: The number of recent samples to keep.
+    """
+
+    def __init__(self, size=1000):
+        self._samples = deque(maxlen=size)
+        self._sorted = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} count={count}>'.format(self=self, count=self.count)
+
+    def __len__(self):
+        return len(self._samples)
+
+    @property
+    def count(self):
+        return len(self._samples)
+
+    def add(self, seconds):
+        samples = self._samples
+        with self._lock:
+            if len(samples) == samples.maxlen:
+                del self._sorted[bisect.bisect_left(self._sorted, samples[0])]
+            samples.append(seconds)
+            bisect.insort(self._sorted, seconds)
+
+    def percentile(self, q):
+        """Return the `q` (between 0 and 1) quantile of the samples by the
+        nearest-rank method. `None` for an empty window.
+        """
+        with self._lock:
+            samples = self._sorted
+            if not samples:
+                return None
+            index = min(len(samples) - 1, max(0, int(q * len(samples) + 0.5) - 1))
+            return samples[index]
+
+
+class LatencyWindows(object):
+    """:class:`LatencyWindow` for each key like verification URL."""
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        try:
+            return self._windows[key]
+        except KeyError:
+            with self._lock:
+                if key not in self._windows:
+                    self._windows[key] = LatencyWindow(self.size)
+                return self._windows[key]
+
+    def add(self, key, seconds):
+        self[key].add(seconds)
+
+    def percentile(self, key, q):
+        return self[key].percentile(q)
@@ -0,0 +1,348 @@
+""":mod:`itunesiap.storage`
+
+Persistence of the purchases of responses into SQLite.
+
+.. sourcecode:: python
+
+    >>> store = itunesiap.storage.PurchaseStore('/var/lib/itunesiap/purchases.db')
+    >>> stats = store.write(itunesiap.verify(receipt) for receipt in receipts)
+    >>> stats.purchases_per_second
+    >>> store.latest(original_transaction_id).expires_date
+
+The purchases of `receipt.in_app` and `latest_receipt_info` are upserted by
+`transaction_id` and `pending_renewal_info` by `original_transaction_id` in
+batches, each in a transaction. Writing the same responses again doesn't
+change the store, and known fields are not erased by responses without them.
+
+The purchases are read back as :class:`itunesiap.receipt.InApp` in the form
+of the responses without `*_pst` dates.
+"""
+import time
+import sqlite3
+
+import six
+
+from .receipt import Response, InApp, PendingRenewalInfo
+from .tools import monotonic, SQLiteConnections
+
+__all__ = ('PurchaseStore', 'WriteStats', 'PURCHASE_COLUMNS', 'RENEWAL_COLUMNS')
+
+
+TEXT = 'TEXT'
+INTEGER = 'INTEGER'
+BOOLEAN = 'BOOLEAN'
+DATE = 'DATE'
+
+#: The columns of `purchases` table and their types. `DATE` is stored in
+#: milliseconds as the `*_ms` fields.
+PURCHASE_COLUMNS = (
+    ('transaction_id', TEXT),
+    ('original_transaction_id', TEXT),
+    ('product_id', TEXT),
+    ('quantity', INTEGER),
+    ('purchase_date', DATE),
+    ('original_purchase_date', DATE),
+    ('expires_date', DATE),
+    ('cancellation_date', DATE),
+    ('cancellation_reason', INTEGER),
+    ('web_order_line_item_id', TEXT),
+    ('is_trial_period', BOOLEAN),
+    ('is_in_intro_offer_period', BOOLEAN),
+    ('bundle_id', TEXT),
+    ('environment', TEXT),
+)
+
+#: The columns of `renewals` table from `pending_renewal_info`.
+RENEWAL_COLUMNS = (
+    ('original_transaction_id', TEXT),
+    ('product_id', TEXT),
+    ('auto_renew_product_id', TEXT),
+    ('auto_renew_status', INTEGER),
+    ('expiration_intent', INTEGER),
+    ('is_in_billing_retry_period', BOOLEAN),
+    ('grace_period_expires_date', DATE),
+    ('price_consent_status', INTEGER),
+)
+
+_SQL_TYPES = {TEXT: 'TEXT', INTEGER: 'INTEGER', BOOLEAN: 'INTEGER', DATE: 'INTEGER'}
+_DATE_FORMAT = '%Y-%m-%d %H:%M:%S Etc/GMT'
+
+
+def _column_name(name, kind):
+    return name + '_ms' if kind == DATE else name
+
+
+def _integer(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def _boolean(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, six.string_types):
+        return 1 if value in ('true', '1') else 0
+    return 1 if value else 0
+
+
+def _date_ms(data, name):
+    value = data.get(name + '_ms')
+    if value is None:
+        # legacy receipts have `expires_date` in milliseconds
+        value = data.get(name)
+        if not isinstance(value, six.string_types) or not value.isdigit():
+            return None
+    return _integer(value)
+
+
+def _row(columns, data, extra):
+    row = []
+    for name, kind in columns:
+        if kind == DATE:
+            row.append(_date_ms(data, name))
+            continue
+        value = data.get(name)
+        if value is None:
+            value = extra.get(name)
+        if kind == INTEGER:
+            value = _integer(value)
+        elif kind == BOOLEAN:
+            value = _boolean(value)
+        elif value is not None:
+            value = six.text_type(value)
+        row.append(value)
+    return tuple(row)
+
+
+def _data(columns, row):
+    """Return the row in the form of the responses."""
+    data = {}
+    for (name, kind), value in zip(columns, row):
+        if value is None:
+            continue
+        if kind == DATE:
+            data[name + '_ms'] = str(value)
+            data[name] = time.strftime(_DATE_FORMAT, time.gmtime(value // 1000))
+        elif kind == BOOLEAN:
+            data[name] = 'true' if value else 'false'
+        elif kind == INTEGER:
+            data[name] = str(value)
+        else:
+            data[name] = value
+    return data
+
+
+class WriteStats(object):
+    """The result of :meth:`PurchaseStore.write`.
+
+    :param int responses: The number of the written responses.
+    :param int purchases: The number of the upserted purchases.
+    :param int renewals: The number of the upserted renewal infos.
+    :param int transactions: The number of the committed transactions.
+    :param float elapsed: The seconds of the writing.
+    """
+
+    def __init__(self, responses=0, purchases=0, renewals=0, transactions=0, elapsed=0.0):
+        self.responses = responses
+        self.purchases = purchases
+        self.renewals = renewals
+        self.transactions = transactions
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} responses={self.responses} purchases={self.purchases} elapsed={self.elapsed:.3f}>'.format(self=self)
+
+    @property
+    def purchases_per_second(self):
+        """The throughput of the purchases. `None` if nothing elapsed."""
+        if not self.elapsed:
+            return None
+        return self.purchases / self.elapsed
+
+    @property
+    def responses_per_second(self):
+        """The throughput of the responses. `None` if nothing elapsed."""
+        if not self.elapsed:
+            return None
+        return self.responses / self.elapsed
+
+
+class PurchaseStore(object):
+    """The purchases of responses in a SQLite database.
+
+    :param str path: The database file. It can be shared by processes.
+    :param int chunk_size: The number of purchases and renewal infos in a
+        transaction.
+    :param float timeout: Seconds to wait for the lock of the database.
+    """
+
+    #: The maximum number of variables of a statement in old SQLite.
+    MAX_VARIABLES = 999
+
+    def __init__(self, path, chunk_size=1000, timeout=5.0):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._connections = SQLiteConnections(path, timeout)
+        self._purchase_columns = ', '.join(
+            _column_name(name, kind) for name, kind in PURCHASE_COLUMNS)
+        self._renewal_columns = ', '.join(
+            _column_name(name, kind) for name, kind in RENEWAL_COLUMNS)
+        self._upsert_purchase = self._upsert_statements('purchases', PURCHASE_COLUMNS)
+        self._upsert_renewal = self._upsert_statements('renewals', RENEWAL_COLUMNS)
+        self._create()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} path={self.path!r}>'.format(self=self)
+
+    @staticmethod
+    def _upsert_statements(table, columns):
+        """Return the pairs of a statement to upsert rows and whether it
+        takes the key at the end of the row.
+        """
+        names = [_column_name(name, kind) for name, kind in columns]
+        sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            table, ', '.join(names), ', '.join('?' * len(names)))
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            # no UPSERT, and INSERT OR REPLACE would erase the known fields
+            update = 'UPDATE {0} SET {1} WHERE {2} = ?'.format(
+                table, ', '.join('{0} = COALESCE(?, {0})'.format(name) for name in names[1:]),
+                names[0])
+            return [(update, True), (sql.replace('INSERT', 'INSERT OR IGNORE', 1), False)]
+        # the fields missing in the response are kept
+        return [(sql + ' ON CONFLICT({0}) DO UPDATE SET {1}'.format(
+            names[0], ', '.join(
+                '{0} = COALESCE(excluded.{0}, {1}.{0})'.format(name, table)
+                for name in names[1:])), False)]
+
+    def _create(self):
+        with self._connections.transaction() as connection:
+            for table, columns in (('purchases', PURCHASE_COLUMNS), ('renewals', RENEWAL_COLUMNS)):
+                definitions = ['{0} {1}'.format(_column_name(name, kind), _SQL_TYPES[kind]) for name, kind in columns]
+                definitions[0] += ' PRIMARY KEY'
+                connection.execute('CREATE TABLE IF NOT EXISTS {0} ({1})'.format(table, ', '.join(definitions)))
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS purchases_original_transaction_id '
+                'ON purchases (original_transaction_id, purchase_date_ms)')
+
+    def close(self):
+        """Close the connection of the current thread."""
+        self._connections.close()
+
+    @staticmethod
+    def _collect(response, purchases, renewals):
+        data = response._
+        receipt = data.get('receipt') or {}
+        extra = {
+            'bundle_id': receipt.get('bundle_id') or receipt.get('bid'),
+            'environment': data.get('environment'),
+        }
+        records = list(receipt.get('in_app') or ())
+        if not records and 'transaction_id' in receipt:  # legacy receipts
+            records.append(receipt)
+        latest = data.get('latest_receipt_info')
+        if latest:
+            records.extend([latest] if 'transaction_id' in latest else latest)
+        for record in records:
+            row = _row(PURCHASE_COLUMNS, record, extra)
+            if row[0] is not None:
+                purchases[row[0]] = row
+        for info in data.get('pending_renewal_info') or ():
+            row = _row(RENEWAL_COLUMNS, info, {})
+            if row[0] is not None:
+                renewals[row[0]] = row
+
+    def _flush(self, purchases, renewals, stats):
+        if not purchases and not renewals:
+            return
+        with self._connections.transaction() as connection:
+            for statements, rows in ((self._upsert_purchase, purchases), (self._upsert_renewal, renewals)):
+                for sql, key_last in statements:
+                    if key_last:
+                        connection.executemany(sql, (row[1:] + row[:1] for row in rows.values()))
+                    else:
+                        connection.executemany(sql, rows.values())
+        stats.purchases += len(purchases)
+        stats.renewals += len(renewals)
+        stats.transactions += 1
+        purchases.clear()
+        renewals.clear()
+
+    def write(self, responses):
+        """Upsert the purchases and the renewal infos of `responses`.
+
+        :param responses: A :class:`itunesiap.receipt.Response` or an
+            iterable of them, which is consumed in chunks.
+        :rtype: :class:`WriteStats`
+        """
+        if isinstance(responses, Response):
+            responses = [responses]
+        stats = WriteStats()
+        started_at = monotonic()
+        purchases = {}
+        renewals = {}
+        for response in responses:
+            self._collect(response, purchases, renewals)
+            stats.responses += 1
+            if len(purchases) + len(renewals) >= self.chunk_size:
+                self._flush(purchases, renewals, stats)
+        self._flush(purchases, renewals, stats)
+        stats.elapsed = monotonic() - started_at
+        return stats
+
+    def _select(self, sql, arguments):
+        return self._connections().execute(sql, arguments).fetchall()
+
+    def _chunks(self, keys):
+        keys = list(keys)
+        for offset in range(0, len(keys), self.MAX_VARIABLES):
+            yield keys[offset:offset + self.MAX_VARIABLES]
+
+    def get(self, transaction_id):
+        """Return the purchase of `transaction_id` or `None`."""
+        rows = self._select(
+            'SELECT {0} FROM purchases WHERE transaction_id = ?'.format(self._purchase_columns),
+            (transaction_id,))
+        return InApp(_data(PURCHASE_COLUMNS, rows[0])) if rows else None
+
+    def history(self, original_transaction_id):
+        """Return the purchases of `original_transaction_id` in the order of
+        `purchase_date`.
+        """
+        rows = self._select(
+            'SELECT {0} FROM purchases WHERE original_transaction_id = ? '
+            'ORDER BY purchase_date_ms'.format(self._purchase_columns),
+            (original_transaction_id,))
+        return [InApp(_data(PURCHASE_COLUMNS, row)) for row in rows]
+
+    def latest(self, original_transaction_id):
+        """Return the last purchase of `original_transaction_id` by
+        `purchase_date` or `None`.
+        """
+        return self.latest_many([original_transaction_id]).get(original_transaction_id)
+
+    def latest_many(self, original_transaction_ids):
+        """Return a :class:`dict` of the last purchases of
+        `original_transaction_ids` found in the store.
+        """
+        latest = {}
+        for chunk in self._chunks(original_transaction_ids):
+            # the bare columns of MAX() are from the row of the maximum
+            rows = self._select(
+                'SELECT {0}, MAX(purchase_date_ms) FROM purchases '
+                'WHERE original_transaction_id IN ({1}) '
+                'GROUP BY original_transaction_id'.format(
+                    self._purchase_columns, ','.join('?' * len(chunk))),
+                chunk)
+            for row in rows:
+                latest[row[1]] = InApp(_data(PURCHASE_COLUMNS, row[:-1]))
+        return latest
+
+    def renewal_info(self, original_transaction_id):
+        """Return the :class:`itunesiap.receipt.PendingRenewalInfo` of
+        `original_transaction_id` or `None`.
+        """
+        rows = self._select(
+            'SELECT {0} FROM renewals WHERE original_transaction_id = ?'.format(self._renewal_columns),
+            (original_transaction_id,))
+        return PendingRenewalInfo(_data(RENEWAL_COLUMNS, rows[0])) if rows else None
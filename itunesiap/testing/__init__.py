@@ -0,0 +1,13 @@
+""":mod:`itunesiap.testing`
+
+Tools to test and load verifications without Apple servers.
+"""
+from .server import (
+    FakeItunesServer, Endpoint, Reply, Timeout, Disconnect,
+    constant, uniform, lognormal)
+from .synth import Synth
+from .memcached import FakeMemcached
+
+__all__ = (
+    'FakeItunesServer', 'Endpoint', 'Reply', 'Timeout', 'Disconnect',
+    'constant', 'uniform', 'lognormal', 'Synth', 'FakeMemcached')
@@ -0,0 +1,141 @@
+""":mod:`itunesiap.testing.appreceipt`
+
+Build app receipts in PKCS#7 to test :mod:`itunesiap.local` without Apple.
+
+.. sourcecode:: python
+
+    >>> synth = itunesiap.testing.Synth(seed=0)
+    >>> receipt_data = build_receipt(synth.receipt(synth.iter_in_app(10)))
+    >>> itunesiap.local.decode_unified(receipt_data).in_app
+
+Unsigned receipts are encoded with BER indefinite lengths like Apple does.
+To sign them with locally generated certificates, pass the key and the
+certificate of `cryptography` package.
+"""
+import time
+import base64
+
+from ..local import unified
+from ..local.pkcs7 import SIGNED_DATA, _encode_length
+
+__all__ = ('encode_payload', 'build_receipt')
+
+
+DATA = '1.2.840.113549.1.7.1'
+
+
+def _tlv(identifier, contents):
+    return bytes(bytearray([identifier]) + _encode_length(len(contents))) + contents
+
+
+def _indefinite(identifier, *contents):
+    return bytes(bytearray([identifier, 0x80])) + b''.join(contents) + b'\x00\x00'
+
+
+def _integer(value):
+    size = max(1, (value.bit_length() + 8) // 8)
+    contents = bytearray()
+    for _ in range(size):
+        contents.insert(0, value & 0xff)
+        value >>= 8
+    return _tlv(0x02, bytes(contents))
+
+
+def _oid(dotted):
+    arcs = [int(arc) for arc in dotted.split('.')]
+    contents = bytearray([arcs[0] * 40 + arcs[1]])
+    for arc in arcs[2:]:
+        encoded = bytearray([arc & 0x7f])
+        arc >>= 7
+        while arc:
+            encoded.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        contents += encoded
+    return _tlv(0x06, bytes(contents))
+
+
+def _rfc3339(ms):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(ms) // 1000))
+
+
+def _attribute(kind, value):
+    return _tlv(0x30, _integer(kind) + _integer(1) + _tlv(0x04, value))
+
+
+def _set(items):
+    # DER orders the elements of a SET
+    return _tlv(0x31, b''.join(sorted(items)))
+
+
+def _encode_fields(data, fields):
+    attributes = []
+    for kind, (name, value_type) in sorted(fields.items()):
+        if name not in data:
+            continue
+        value = data[name]
+        if value_type == unified.STRING:
+            encoded = _tlv(0x0c, value.encode('utf-8'))
+        elif value_type == unified.INTEGER:
+            encoded = _integer(int(value))
+        elif value_type == unified.BOOLEAN:
+            encoded = _integer(1 if value in ('true', True, '1', 1) else 0)
+        else:
+            ms = data.get(name + '_ms')
+            text = _rfc3339(ms) if ms is not None else value
+            encoded = _tlv(0x16, text.encode('ascii'))
+        attributes.append(_attribute(kind, encoded))
+    return attributes
+
+
+def encode_payload(receipt):
+    """Encode `receipt` in the form of the responses into DER receipt
+    attributes.
+    """
+    attributes = _encode_fields(receipt, unified.RECEIPT_FIELDS)
+    for in_app in receipt.get('in_app', ()):
+        attributes.append(_attribute(unified.IN_APP, _set(_encode_fields(in_app, unified.IN_APP_FIELDS))))
+    return _set(attributes)
+
+
+def _unsigned(content):
+    signed_data = _indefinite(
+        0x30,
+        _integer(1),
+        _tlv(0x31, b''),
+        _indefinite(0x30, _oid(DATA), _indefinite(0xa0, _indefinite(0x24, _tlv(0x04, content)))),
+        _tlv(0x31, b''))
+    return _indefinite(0x30, _oid(SIGNED_DATA), _indefinite(0xa0, signed_data))
+
+
+def _signed(content, key, certificate, certificates, digest, attributes):
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.serialization import pkcs7
+    options = [pkcs7.PKCS7Options.Binary]
+    if not attributes:
+        options.append(pkcs7.PKCS7Options.NoAttributes)
+    builder = pkcs7.PKCS7SignatureBuilder().set_data(content).add_signer(
+        certificate, key, getattr(hashes, digest.upper())())
+    for extra in certificates:
+        builder = builder.add_certificate(extra)
+    return builder.sign(serialization.Encoding.DER, options)
+
+
+def build_receipt(receipt, key=None, certificate=None, certificates=(), digest='sha256', attributes=True):
+    """Build an app receipt in base64.
+
+    :param dict receipt: The receipt in the form of the responses like
+        :meth:`itunesiap.testing.synth.Synth.receipt`.
+    :param key: The private key of `cryptography` to sign. Unsigned if not
+        given.
+    :param certificate: The `cryptography` certificate of `key`.
+    :param certificates: The other certificates to include.
+    :param str digest: The digest algorithm.
+    :param bool attributes: Sign the signed attributes instead of the content
+        directly.
+    """
+    content = encode_payload(receipt)
+    if key is None:
+        data = _unsigned(content)
+    else:
+        data = _signed(content, key, certificate, certificates, digest, attributes)
+    return base64.b64encode(data).decode('ascii')
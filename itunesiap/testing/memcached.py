@@ -0,0 +1,178 @@
+""":mod:`itunesiap.testing.memcached`
+
+An in-process stand-in of a memcached server speaking the text protocol to
+test :class:`itunesiap.cache.MemcachedCache` without memcached.
+
+.. sourcecode:: python
+
+    >>> with FakeMemcached() as server:
+    ...     backend = itunesiap.cache.MemcachedCache([server.address])
+
+Only `get`, `gets`, `set`, `delete` and `flush_all` are served.
+"""
+import time
+import socket
+import threading
+
+from six.moves import socketserver
+
+__all__ = ('FakeMemcached',)
+
+
+#: Expiration times longer than this are absolute UNIX times.
+MAX_RELATIVE_EXPTIME = 60 * 60 * 24 * 30
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        fake = self.server.fake
+        with fake._lock:
+            fake._connections.add(self.connection)
+        try:
+            self._serve(fake)
+        except socket.error:
+            pass
+        finally:
+            with fake._lock:
+                fake._connections.discard(self.connection)
+
+    def _serve(self, fake):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            if not parts:
+                self._reply(b'ERROR')
+                continue
+            command = parts[0]
+            with fake._lock:
+                fake.commands.append(command.decode('ascii', 'replace'))
+            if command in (b'get', b'gets'):
+                self._get(fake, parts[1:])
+            elif command == b'set' and len(parts) >= 5:
+                value = self.rfile.read(int(parts[4]) + 2)[:-2]
+                fake._set(parts[1], int(parts[2]), int(parts[3]), value)
+                if parts[-1] != b'noreply':
+                    self._reply(b'STORED')
+            elif command == b'delete' and len(parts) >= 2:
+                self._reply(b'DELETED' if fake._delete(parts[1]) else b'NOT_FOUND')
+            elif command == b'flush_all':
+                fake.flush()
+                self._reply(b'OK')
+            else:
+                self._reply(b'ERROR')
+
+    def _get(self, fake, keys):
+        chunks = []
+        for key in keys:
+            entry = fake._get(key)
+            if entry is None:
+                continue
+            flags, value = entry
+            chunks.append(b'VALUE ' + key + ' {0} {1}\r\n'.format(flags, len(value)).encode('ascii'))
+            chunks.append(value + b'\r\n')
+        chunks.append(b'END\r\n')
+        self.wfile.write(b''.join(chunks))
+
+    def _reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+
+class FakeMemcached(object):
+    """Fake memcached server in a background thread.
+
+    :param str host: The host to listen.
+    :param int port: The port to listen. `0` for a free port.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        #: The command names received in order.
+        self.commands = []
+        self._data = {}
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._server = None
+        self._thread = None
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} {self.host}:{self.port}>'.format(self=self)
+
+    @property
+    def address(self):
+        """The address in `host:port`."""
+        return '{0}:{1}'.format(self.host, self.port)
+
+    def start(self):
+        """Start serving in a background thread."""
+        assert self._server is None
+        self._server = _TCPServer((self.host, self.port), _Handler)
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the connections."""
+        if self._server is None:
+            return
+        with self._lock:
+            for connection in self._connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except socket.error:  # pragma: no cover
+                    pass
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def __len__(self):
+        return len(self._data)
+
+    def flush(self):
+        with self._lock:
+            self._data.clear()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            flags, value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            return flags, value
+
+    def _set(self, key, flags, exptime, value):
+        if not exptime:
+            expires_at = None
+        elif exptime > MAX_RELATIVE_EXPTIME:
+            expires_at = float(exptime)
+        else:
+            expires_at = time.time() + exptime
+        with self._lock:
+            self._data[key] = (flags, value, expires_at)
+
+    def _delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
@@ -0,0 +1,396 @@
+""":mod:`itunesiap.testing.server`
+
+An in-process fake of the verifyReceipt endpoints of Apple. It runs a
+threaded HTTP server of the standard library and serves production and
+sandbox endpoints on the same port.
+
+.. sourcecode:: python
+
+    >>> from itunesiap.testing import FakeItunesServer, Reply, Timeout, uniform
+    >>> with FakeItunesServer(latency=uniform(0.01, 0.05)) as server:
+    ...     server.production.script(21005, Timeout(), Reply(status=0))
+    ...     request = server.bind(itunesiap.Request(receipt))
+    ...     request.verify(env=env)
+
+Each endpoint answers the scripted outcomes in order. Once the script is
+empty, it answers status 0, or 21007 and 21008 for the receipts registered as
+`sandbox_receipts` and `production_receipts` of the server, with the
+injected faults by `error_rate` and `timeout_rate`.
+"""
+import json
+import math
+import random
+import socket
+import threading
+import contextlib
+import collections
+
+from six.moves import BaseHTTPServer, socketserver
+
+__all__ = (
+    'FakeItunesServer', 'Endpoint', 'Reply', 'Timeout', 'Disconnect',
+    'constant', 'uniform', 'lognormal', 'default_response')
+
+
+def constant(seconds):
+    """Latency distribution of fixed `seconds`."""
+    return lambda rng: seconds
+
+
+def uniform(low, high):
+    """Latency distribution uniform between `low` and `high` seconds."""
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median, sigma):
+    """Latency distribution of log-normal with `median` seconds, which has a
+    long tail like real servers.
+    """
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class Reply(object):
+    """An answer of the endpoint.
+
+    :param int status: The receipt status.
+    :param int http_status: The HTTP status code. The body is not JSON when
+        it is not 200.
+    :param float delay: Seconds before answering. The latency distribution
+        of the endpoint is used if not given.
+    :param int body_size: The minimum size of the response body in bytes.
+    :param bool is_retryable: `is-retryable` field of the response.
+    """
+
+    def __init__(
+            self, status=0, http_status=200, delay=None, body_size=None,
+            is_retryable=None):
+        self.status = status
+        self.http_status = http_status
+        self.delay = delay
+        self.body_size = body_size
+        self.is_retryable = is_retryable
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} status={self.status} http_status={self.http_status}>'.format(self=self)
+
+
+class Timeout(object):
+    """Hold the request `seconds` and close the connection without an answer.
+
+    The default is long enough for any reasonable client timeout. Stopping
+    the server releases it.
+    """
+
+    def __init__(self, seconds=3600.0):
+        self.seconds = seconds
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} seconds={self.seconds}>'.format(self=self)
+
+
+class Disconnect(object):
+    """Close the connection without an answer."""
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__}>'.format(self=self)
+
+
+def _in_app(index):
+    transaction_id = str(1000000000000000 + index)
+    return {
+        'quantity': '1',
+        'product_id': 'org.youknowone.itunesiap.product',
+        'transaction_id': transaction_id,
+        'original_transaction_id': transaction_id,
+        'purchase_date': '2013-01-01 00:00:00 Etc/GMT',
+        'purchase_date_ms': '1356998400000',
+        'original_purchase_date': '2013-01-01 00:00:00 Etc/GMT',
+        'original_purchase_date_ms': '1356998400000',
+        'is_trial_period': 'false',
+    }
+
+
+def default_response(tier, request_content, reply):
+    """Build the response data of `reply` for `request_content`."""
+    data = {
+        'status': reply.status,
+        'environment': 'Sandbox' if tier == 'sandbox' else 'Production',
+    }
+    if reply.is_retryable is not None:
+        data['is-retryable'] = reply.is_retryable
+    if reply.status in (0, 21006):
+        data['receipt'] = {
+            'receipt_type': 'ProductionSandbox' if tier == 'sandbox' else 'Production',
+            'bundle_id': 'org.youknowone.itunesiap',
+            'application_version': '1',
+            'in_app': [_in_app(0)],
+        }
+    return data
+
+
+class Endpoint(object):
+    """The behavior of production or sandbox endpoint.
+
+    :param str tier: `production` or `sandbox`.
+    :param latency: Seconds or a callable taking :class:`random.Random` and
+        returning seconds. `None` means no delay.
+    :param int body_size: The minimum size of response bodies in bytes.
+    :param float error_rate: The probability of HTTP 503 answers.
+    :param float timeout_rate: The probability of :class:`Timeout`.
+    :param int seed: The seed of the random faults and latencies.
+    """
+
+    def __init__(
+            self, tier, latency=None, body_size=None, error_rate=0.0,
+            timeout_rate=0.0, seed=None):
+        self.tier = tier
+        self.latency = latency
+        self.body_size = body_size
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.calls = 0
+        self._script = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} {self.tier} calls={self.calls}>'.format(self=self)
+
+    def script(self, *outcomes):
+        """Append outcomes to answer in order. An :class:`int` is a status of
+        :class:`Reply`.
+        """
+        with self._lock:
+            for outcome in outcomes:
+                if isinstance(outcome, int):
+                    outcome = Reply(status=outcome)
+                self._script.append(outcome)
+
+    def clear(self):
+        """Remove the scripted outcomes."""
+        with self._lock:
+            del self._script[:]
+
+    def _next(self, status):
+        with self._lock:
+            self.calls += 1
+            if self._script:
+                return self._script.pop(0)
+            draw = self._random.random()
+        if draw < self.timeout_rate:
+            return Timeout()
+        if draw < self.timeout_rate + self.error_rate:
+            return Reply(http_status=503)
+        return Reply(status=status)
+
+    def _delay(self, outcome):
+        delay = getattr(outcome, 'delay', None)
+        if delay is not None:
+            return delay
+        if self.latency is None:
+            return 0.0
+        if callable(self.latency):
+            with self._lock:
+                return self.latency(self._random)
+        return self.latency
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        tier = fake._tiers.get(self.path)
+        if tier is None:
+            self._send(404, b'')
+            return
+        try:
+            request_content = json.loads(body.decode('utf-8'))
+            receipt_data = request_content['receipt-data']
+        except (ValueError, KeyError, TypeError):
+            request_content = None
+            status = 21000
+        else:
+            status = fake._status(tier, receipt_data)
+        fake._record(tier, request_content)
+
+        endpoint = fake.endpoints[tier]
+        outcome = endpoint._next(status)
+        delay = endpoint._delay(outcome)
+        if delay and fake._stopping.wait(delay):
+            outcome = Disconnect()
+        if isinstance(outcome, Timeout):
+            fake._stopping.wait(outcome.seconds)
+            outcome = Disconnect()
+        if isinstance(outcome, Disconnect):
+            self.close_connection = True
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:  # pragma: no cover
+                pass
+            return
+
+        if outcome.http_status != 200:
+            self._send(outcome.http_status, b'Service Unavailable')
+            return
+        data = fake.responder(tier, request_content, outcome)
+        response_body = json.dumps(data).encode('utf-8')
+        body_size = outcome.body_size or endpoint.body_size
+        if body_size and len(response_body) < body_size and 'receipt' in data:
+            in_app = data['receipt'].setdefault('in_app', [])
+            entry_size = len(json.dumps(_in_app(0))) + 2
+            for _ in range((body_size - len(response_body)) // entry_size + 1):
+                in_app.append(_in_app(len(in_app)))
+            response_body = json.dumps(data).encode('utf-8')
+        self._send(200, response_body, 'application/json')
+
+    def _send(self, status, body, content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeItunesServer(object):
+    """Fake verifyReceipt server emulating production and sandbox endpoints.
+
+    :param str host: The host to listen.
+    :param int port: The port to listen. `0` for a free port.
+    :param latency: The latency distribution of both endpoints. See
+        :class:`Endpoint`.
+    :param int body_size: The minimum size of response bodies in bytes.
+    :param sandbox_receipts: Receipts answered 21007 by production endpoint.
+    :param production_receipts: Receipts answered 21008 by sandbox endpoint.
+    :param responder: A callable taking the tier, the request content and
+        the :class:`Reply` and returning the response data. The default is
+        :func:`default_response`.
+    :param int seed: The seed of the random faults and latencies.
+    :param int max_requests: The number of the recent requests kept in
+        :attr:`requests`. `0` not to record and `None` for all of them.
+    """
+
+    PATHS = {
+        'production': '/production/verifyReceipt',
+        'sandbox': '/sandbox/verifyReceipt',
+    }
+
+    def __init__(
+            self, host='127.0.0.1', port=0, latency=None, body_size=None,
+            sandbox_receipts=(), production_receipts=(), responder=None,
+            seed=None, max_requests=1000):
+        self.host = host
+        self.port = port
+        self.sandbox_receipts = set(sandbox_receipts)
+        self.production_receipts = set(production_receipts)
+        self.responder = responder or default_response
+        self.production = Endpoint(
+            'production', latency=latency, body_size=body_size, seed=seed)
+        self.sandbox = Endpoint(
+            'sandbox', latency=latency, body_size=body_size,
+            seed=None if seed is None else seed + 1)
+        self.endpoints = {'production': self.production, 'sandbox': self.sandbox}
+        #: The :class:`collections.deque` of the pairs of the tier and the
+        #: request content.
+        self.requests = collections.deque(maxlen=max_requests)
+        self._tiers = dict((path, tier) for tier, path in self.PATHS.items())
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} {self.host}:{self.port}>'.format(self=self)
+
+    def start(self):
+        """Start serving in a background thread."""
+        assert self._httpd is None
+        self._stopping.clear()
+        self._httpd = _HTTPServer((self.host, self.port), _Handler)
+        self._httpd.fake = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving. Held requests are released."""
+        if self._httpd is None:
+            return
+        self._stopping.set()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        self._httpd = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def url(self, tier):
+        return 'http://{0}:{1}{2}'.format(self.host, self.port, self.PATHS[tier])
+
+    @property
+    def production_url(self):
+        return self.url('production')
+
+    @property
+    def sandbox_url(self):
+        return self.url('sandbox')
+
+    def bind(self, request):
+        """Point the verification URLs of `request` to the server and return
+        it.
+        """
+        request.PRODUCTION_VALIDATION_URL = self.production_url
+        request.SANDBOX_VALIDATION_URL = self.sandbox_url
+        return request
+
+    def as_endpoints(self):
+        """Return :class:`itunesiap.endpoint.Endpoints` of the server for
+        `endpoints` of the environment.
+        """
+        from ..endpoint import Endpoints
+        return Endpoints(production=self.production_url, sandbox=self.sandbox_url)
+
+    @contextlib.contextmanager
+    def patch(self):
+        """Point every :class:`itunesiap.request.Request` to the server in the
+        context, including :func:`itunesiap.verify`.
+        """
+        from ..request import RequestBase
+        urls = RequestBase.PRODUCTION_VALIDATION_URL, RequestBase.SANDBOX_VALIDATION_URL
+        RequestBase.PRODUCTION_VALIDATION_URL = self.production_url
+        RequestBase.SANDBOX_VALIDATION_URL = self.sandbox_url
+        try:
+            yield self
+        finally:
+            RequestBase.PRODUCTION_VALIDATION_URL, RequestBase.SANDBOX_VALIDATION_URL = urls
+
+    def _status(self, tier, receipt_data):
+        if tier == 'production' and receipt_data in self.sandbox_receipts:
+            return 21007
+        if tier == 'sandbox' and receipt_data in self.production_receipts:
+            return 21008
+        return 0
+
+    def _record(self, tier, request_content):
+        with self._lock:
+            self.requests.append((tier, request_content))
@@ -0,0 +1,318 @@
+""":mod:`itunesiap.testing.synth`
+
+Deterministic synthetic verifyReceipt responses for benchmarks and load
+tests.
+
+.. sourcecode:: python
+
+    >>> synth = itunesiap.testing.synth.Synth(seed=42)
+    >>> data = synth.response(in_app=1000, subscriptions=20)  # iOS7 style
+    >>> legacy = synth.legacy_response(subscription=True)  # iOS6 style
+    >>> for record in synth.iter_in_app(10 ** 6):  # streaming records
+    ...     pass
+
+The same seed generates the same data. Times are in whole seconds so that the
+formatted dates and the `_ms` fields agree. Subscriptions are renewal chains
+sharing `original_transaction_id`, some of them cancelled or in the billing
+retry period with matching `pending_renewal_info`.
+
+:meth:`Synth.responder` feeds :class:`itunesiap.testing.FakeItunesServer`:
+
+.. sourcecode:: python
+
+    >>> server = FakeItunesServer(responder=synth.responder(in_app=100))
+"""
+import time
+import base64
+import random
+import hashlib
+
+__all__ = ('Synth',)
+
+
+#: 2017-01-01 00:00:00 UTC
+START_MS = 1483228800000
+DAY_MS = 86400000
+PST_OFFSET_MS = 8 * 3600 * 1000
+
+
+_day_prefixes = {}
+
+
+def _date(ms, zone='Etc/GMT', offset_ms=0):
+    day, seconds = divmod((ms - offset_ms) // 1000, 86400)
+    prefix = _day_prefixes.get(day)
+    if prefix is None:
+        prefix = _day_prefixes[day] = time.strftime('%Y-%m-%d', time.gmtime(day * 86400))
+    return '%s %02d:%02d:%02d %s' % (
+        prefix, seconds // 3600, seconds // 60 % 60, seconds % 60, zone)
+
+
+def _date_values(ms):
+    """Return the GMT, milliseconds and PST representations of `ms`."""
+    return _date(ms), str(ms), _date(ms, 'America/Los_Angeles', PST_OFFSET_MS)
+
+
+def _dates(record, name, ms, values=None):
+    if values is None:
+        values = _date_values(ms)
+    record[name], record[name + '_ms'], record[name + '_pst'] = values
+
+
+class Synth(object):
+    """Seeded generator of receipts and verifyReceipt responses.
+
+    :param int seed: The random seed.
+    :param str bundle_id: The bundle identifier of the app.
+    :param products: Product identifiers of non-renewing purchases.
+    :param subscription_products: Product identifiers of auto-renewable
+        subscriptions.
+    :param int period_ms: The subscription period in milliseconds.
+    :param int start_ms: The time of the earliest purchase.
+    """
+
+    def __init__(
+            self, seed=0, bundle_id='org.youknowone.itunesiap',
+            products=('org.youknowone.itunesiap.coin100', 'org.youknowone.itunesiap.coin500'),
+            subscription_products=('org.youknowone.itunesiap.monthly', 'org.youknowone.itunesiap.yearly'),
+            period_ms=30 * DAY_MS, start_ms=START_MS):
+        self.seed = seed
+        self.bundle_id = bundle_id
+        self.products = tuple(products)
+        self.subscription_products = tuple(subscription_products)
+        self.period_ms = period_ms
+        self.start_ms = start_ms
+        self.random = random.Random(seed)
+        self._transaction_id = 1000000000000000 + (seed % 1000000) * 1000000000
+        self._web_order_line_item_id = 1000000000000000 + (seed % 1000000) * 1000000000
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} seed={self.seed}>'.format(self=self)
+
+    def _next_transaction_id(self):
+        self._transaction_id += 1
+        return str(self._transaction_id)
+
+    def _next_web_order_line_item_id(self):
+        self._web_order_line_item_id += 1
+        return str(self._web_order_line_item_id)
+
+    def purchase(self, purchase_ms=None, product_id=None):
+        """Return an `in_app` record of a non-renewing purchase."""
+        if purchase_ms is None:
+            purchase_ms = self.start_ms + self.random.randrange(365 * 86400) * 1000
+        transaction_id = self._next_transaction_id()
+        record = {
+            'quantity': '1',
+            'product_id': product_id or self.random.choice(self.products),
+            'transaction_id': transaction_id,
+            'original_transaction_id': transaction_id,
+            'is_trial_period': 'false',
+        }
+        values = _date_values(purchase_ms)
+        _dates(record, 'purchase_date', purchase_ms, values)
+        _dates(record, 'original_purchase_date', purchase_ms, values)
+        return record
+
+    def subscription(
+            self, renewals, product_id=None, start_ms=None, trial=False,
+            cancelled=False, billing_retry=False, auto_renew=True):
+        """Return a renewal chain of a subscription.
+
+        :param int renewals: The number of transactions in the chain.
+        :param bool trial: The first period is a free trial.
+        :param bool cancelled: The last transaction is refunded by Apple
+            support.
+        :param bool billing_retry: The last period is expired and Apple is
+            retrying the billing.
+        :param bool auto_renew: The auto renewal status.
+        :return: A pair of the list of `in_app` records in the purchase order
+            and the `pending_renewal_info` record.
+        """
+        product_id = product_id or self.random.choice(self.subscription_products)
+        if start_ms is None:
+            start_ms = self.start_ms + self.random.randrange(30 * 86400) * 1000
+        original_transaction_id = self._next_transaction_id()
+        records = []
+        # the expiration of a period is the purchase of the next renewal
+        original = purchased = _date_values(start_ms)
+        for i in range(renewals):
+            purchase_ms = start_ms + i * self.period_ms
+            expires = _date_values(purchase_ms + self.period_ms)
+            transaction_id = original_transaction_id if i == 0 else self._next_transaction_id()
+            record = {
+                'quantity': '1',
+                'product_id': product_id,
+                'transaction_id': transaction_id,
+                'original_transaction_id': original_transaction_id,
+                'web_order_line_item_id': self._next_web_order_line_item_id(),
+                'is_trial_period': 'true' if trial and i == 0 else 'false',
+                'is_in_intro_offer_period': 'false',
+            }
+            _dates(record, 'purchase_date', purchase_ms, purchased)
+            _dates(record, 'original_purchase_date', start_ms, original)
+            _dates(record, 'expires_date', purchase_ms + self.period_ms, expires)
+            records.append(record)
+            purchased = expires
+        if cancelled and records:
+            last = records[-1]
+            cancel_ms = int(last['purchase_date_ms']) + self.random.randrange(self.period_ms // 1000) * 1000
+            _dates(last, 'cancellation_date', cancel_ms)
+            last['cancellation_reason'] = self.random.choice(('0', '1'))
+        pending = {
+            'auto_renew_product_id': product_id,
+            'original_transaction_id': original_transaction_id,
+            'product_id': product_id,
+            'auto_renew_status': '1' if auto_renew and not cancelled else '0',
+        }
+        if billing_retry:
+            pending['is_in_billing_retry_period'] = '1'
+            pending['expiration_intent'] = '2'
+            if records:  # no grace period without a period
+                pending['grace_period_expires_date_ms'] = str(
+                    int(records[-1]['expires_date_ms']) + 16 * DAY_MS)
+        elif cancelled or not auto_renew:
+            pending['expiration_intent'] = '1'
+            pending['is_in_billing_retry_period'] = '0'
+        return records, pending
+
+    def iter_in_app(self, count, subscription_ratio=0.8, max_renewals=24):
+        """Generate `count` `in_app` records. Subscription chains are mixed by
+        `subscription_ratio` of the records.
+        """
+        generated = 0
+        while generated < count:
+            if self.random.random() < subscription_ratio:
+                renewals = min(count - generated, self.random.randint(1, max_renewals))
+                records, _ = self.subscription(
+                    renewals, trial=self.random.random() < 0.3,
+                    cancelled=self.random.random() < 0.05)
+                for record in records:
+                    yield record
+                generated += renewals
+            else:
+                yield self.purchase()
+                generated += 1
+
+    def receipt(self, in_app=(), receipt_type='Production'):
+        """Return an iOS7 style app receipt with the `in_app` records."""
+        now_ms = self.start_ms + 400 * DAY_MS
+        receipt = {
+            'receipt_type': receipt_type,
+            'adam_id': 0,
+            'app_item_id': 0,
+            'bundle_id': self.bundle_id,
+            'application_version': '1',
+            'download_id': 0,
+            'version_external_identifier': 0,
+            'original_application_version': '1.0',
+            'in_app': list(in_app),
+        }
+        _dates(receipt, 'receipt_creation_date', now_ms)
+        _dates(receipt, 'request_date', now_ms)
+        _dates(receipt, 'original_purchase_date', self.start_ms)
+        return receipt
+
+    def latest_receipt(self, size=64):
+        """Return a base64 blob standing for `latest_receipt`."""
+        data = bytes(bytearray(self.random.getrandbits(8) for _ in range(size)))
+        return base64.b64encode(data).decode('ascii')
+
+    def response(
+            self, in_app=10, subscriptions=1, renewals=12, status=0,
+            environment='Production', billing_retry_ratio=0.1,
+            cancel_ratio=0.05):
+        """Return an iOS7 style response.
+
+        :param int in_app: The number of non-renewing purchases.
+        :param int subscriptions: The number of subscription chains. Their
+            transactions are in `latest_receipt_info` and `in_app`.
+        :param int renewals: The maximum length of each chain.
+        """
+        records = [self.purchase() for _ in range(in_app)]
+        latest = []
+        pending = []
+        for _ in range(subscriptions):
+            chain, renewal_info = self.subscription(
+                self.random.randint(1, renewals),
+                billing_retry=self.random.random() < billing_retry_ratio,
+                cancelled=self.random.random() < cancel_ratio)
+            latest.extend(chain)
+            pending.append(renewal_info)
+        records.extend(latest)
+        records.sort(key=lambda record: int(record['purchase_date_ms']))
+        data = {
+            'status': status,
+            'environment': environment,
+            'receipt': self.receipt(
+                records, 'ProductionSandbox' if environment == 'Sandbox' else 'Production'),
+        }
+        if subscriptions:
+            latest.sort(key=lambda record: int(record['purchase_date_ms']))
+            data['latest_receipt_info'] = latest
+            data['latest_receipt'] = self.latest_receipt()
+            data['pending_renewal_info'] = pending
+        return data
+
+    def legacy_receipt(self, subscription=False):
+        """Return an iOS6 style receipt of a purchase."""
+        if subscription:
+            records, _ = self.subscription(1)
+            record = records[0]
+        else:
+            record = self.purchase()
+        receipt = {
+            'bid': self.bundle_id,
+            'bvrs': '1.0',
+            'item_id': str(self.random.randrange(100000000, 999999999)),
+            'unique_identifier': hashlib.sha1(
+                record['transaction_id'].encode('ascii')).hexdigest(),
+        }
+        for key in (
+                'quantity', 'product_id', 'transaction_id',
+                'original_transaction_id', 'purchase_date',
+                'purchase_date_ms', 'purchase_date_pst',
+                'original_purchase_date', 'original_purchase_date_ms',
+                'original_purchase_date_pst', 'web_order_line_item_id'):
+            if key in record:
+                receipt[key] = record[key]
+        if subscription:
+            expires_ms = record['expires_date_ms']
+            receipt['expires_date'] = expires_ms
+            receipt['expires_date_formatted'] = record['expires_date']
+            receipt['expires_date_formatted_pst'] = record['expires_date_pst']
+        return receipt
+
+    def legacy_response(self, subscription=False, status=0):
+        """Return an iOS6 style response. `latest_receipt_info` is a single
+        :class:`dict` for a subscription.
+        """
+        receipt = self.legacy_receipt(subscription)
+        data = {'status': status, 'receipt': receipt}
+        if subscription:
+            data['latest_receipt_info'] = dict(receipt)
+            data['latest_receipt'] = self.latest_receipt()
+        return data
+
+    def responder(self, **options):
+        """Return a responder of :class:`itunesiap.testing.FakeItunesServer`.
+
+        A receipt gets the same response every time. `options` are passed to
+        :meth:`response`.
+        """
+        def respond(tier, request_content, reply):
+            environment = 'Sandbox' if tier == 'sandbox' else 'Production'
+            data = {'status': reply.status, 'environment': environment}
+            if reply.is_retryable is not None:
+                data['is-retryable'] = reply.is_retryable
+            if reply.status not in (0, 21006) or not request_content:
+                return data
+            receipt_data = request_content.get('receipt-data') or ''
+            digest = hashlib.sha256(receipt_data.encode('utf-8')).hexdigest()
+            synth = self.__class__(
+                seed=int(digest[:8], 16) ^ self.seed, bundle_id=self.bundle_id,
+                products=self.products,
+                subscription_products=self.subscription_products,
+                period_ms=self.period_ms, start_ms=self.start_ms)
+            return synth.response(status=reply.status, environment=environment, **options)
+        return respond
@@ -1,6 +1,72 @@
 
+import os
+import time
+import sqlite3
 import warnings
+import threading
 import functools
+import contextlib
+
+
+#: A clock for measuring intervals. :func:`time.time` on python2.
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class _NullContext(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+#: A context manager which does nothing.
+nullcontext = _NullContext()
+
+
+class SQLiteConnections(object):
+    """SQLite connections to `path` for each thread in WAL mode. Forked
+    processes open their own connections.
+
+    :param str path: The database file.
+    :param float timeout: Seconds to wait for the lock of the database.
+    """
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self):
+        """Return the connection of the current thread."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the block in a write transaction of the current thread."""
+        connection = self()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def close(self):
+        """Close the connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.__dict__.clear()
 
 
 class lazy_property(object):
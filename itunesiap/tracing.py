@@ -0,0 +1,228 @@
+""":mod:`itunesiap.tracing`
+
+Tracing spans of verifications. :class:`Tracer` is an
+:class:`itunesiap.instrument.Observer` building a span tree for each
+verification and passing it to an exporter:
+
+- `itunesiap.verify`: The whole verification.
+- `itunesiap.attempt`: Each attempt to production or sandbox server,
+  including retries. `itunesiap.tier` and `itunesiap.attempt` attributes tell
+  which one it is.
+- `itunesiap.<stage>`: The other stages like `itunesiap.request` and
+  `itunesiap.decode`, as children of their attempt.
+
+Attributes have the status and the SHA-256 digest of the receipt. The receipt
+itself is never recorded.
+
+.. sourcecode:: python
+
+    >>> exporter = itunesiap.tracing.InMemoryExporter()
+    >>> env = itunesiap.env.review.clone(observers=[itunesiap.tracing.Tracer(exporter)])
+    >>> itunesiap.verify(receipt, env=env)
+    >>> [span.name for span in exporter.spans]
+
+To send spans to OpenTelemetry, use :class:`OpenTelemetryExporter`. The
+`opentelemetry-api` package is imported only when it is used.
+
+.. sourcecode:: python
+
+    >>> tracer = itunesiap.tracing.Tracer(itunesiap.tracing.OpenTelemetryExporter())
+"""
+import time
+import random
+import threading
+import weakref
+
+from . import instrument
+from .tools import monotonic
+
+__all__ = ('Span', 'Tracer', 'InMemoryExporter', 'OpenTelemetryExporter')
+
+
+class Span(object):
+    """A finished span.
+
+    :param str name: The span name.
+    :param int start_time: The start time in nanoseconds since the epoch.
+    :param int end_time: The end time in nanoseconds since the epoch.
+    :param dict attributes: The span attributes.
+    :param Span parent: The parent span. `None` for the root.
+    :param Exception error: The exception raised in the span if any.
+    """
+
+    def __init__(self, name, start_time, end_time, attributes, parent=None, error=None):
+        self.name = name
+        self.start_time = start_time
+        self.end_time = end_time
+        self.attributes = attributes
+        self.parent = parent
+        self.error = error
+        self.children = []
+        self.span_id = random.getrandbits(64)
+        if parent is None:
+            self.trace_id = random.getrandbits(128)
+        else:
+            self.trace_id = parent.trace_id
+            parent.children.append(self)
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} {self.name} {self.attributes!r}>'.format(self=self)
+
+    @property
+    def parent_id(self):
+        return self.parent.span_id if self.parent is not None else None
+
+    @property
+    def duration(self):
+        """The duration in seconds."""
+        return (self.end_time - self.start_time) / 1e9
+
+    def walk(self):
+        """Iterate the span and its descendants in the start order."""
+        yield self
+        for child in sorted(self.children, key=lambda span: span.start_time):
+            for span in child.walk():
+                yield span
+
+
+def _attributes(event):
+    attributes = {}
+    if event.url is not None:
+        attributes['url.full'] = event.url
+    if event.tier is not None:
+        attributes['itunesiap.tier'] = event.tier
+    if event.status is not None:
+        attributes['itunesiap.status'] = event.status
+    if event.http_status is not None:
+        attributes['http.response.status_code'] = event.http_status
+    if event.attempt is not None:
+        attributes['itunesiap.attempt'] = event.attempt
+    if event.error is not None:
+        attributes['error.type'] = event.error.__class__.__name__
+    return attributes
+
+
+class Tracer(instrument.Observer):
+    """Build a span tree for each verification and export the root span.
+
+    :param exporter: An object with `export(root)` method like
+        :class:`InMemoryExporter`.
+    """
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self._pending = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        # to convert monotonic time to the epoch
+        self._epoch_offset = time.time() - monotonic()
+
+    def __repr__(self):
+        return u'<{self.__class__.__name__} exporter={self.exporter!r}>'.format(self=self)
+
+    def _nanoseconds(self, monotonic_time):
+        return int((monotonic_time + self._epoch_offset) * 1e9)
+
+    def on_event(self, event):
+        if event.stage != instrument.VERIFY:
+            with self._lock:
+                self._pending.setdefault(event.probe, []).append(event)
+            return
+        with self._lock:
+            events = self._pending.pop(event.probe, [])
+        self.exporter.export(self.build(event, events))
+
+    def _span(self, event, parent, attributes):
+        return Span(
+            'itunesiap.' + event.stage,
+            self._nanoseconds(event.started_at),
+            self._nanoseconds(event.started_at + event.duration),
+            attributes, parent=parent, error=event.error)
+
+    def build(self, verify_event, events):
+        """Return the root span of `verify_event` with the children from
+        `events` of the same verification.
+        """
+        attributes = _attributes(verify_event)
+        attributes.pop('itunesiap.attempt', None)
+        attributes['itunesiap.receipt_digest'] = verify_event.probe.receipt_digest
+        attributes['itunesiap.fallback'] = verify_event.fallback
+        attributes['itunesiap.cache_hit'] = verify_event.cache_hit
+        attributes['itunesiap.retries'] = verify_event.retries
+        root = self._span(verify_event, None, attributes)
+
+        attempts = []
+        for event in events:
+            if event.stage == instrument.ATTEMPT:
+                attempts.append((event, self._span(event, root, _attributes(event))))
+        for event in events:
+            if event.stage == instrument.ATTEMPT:
+                continue
+            parent = root
+            ended_at = event.started_at + event.duration
+            for attempt, span in attempts:
+                if attempt.url == event.url and \
+                        attempt.started_at <= event.started_at and \
+                        ended_at <= attempt.started_at + attempt.duration:
+                    parent = span
+                    break
+            self._span(event, parent, _attributes(event))
+        return root
+
+
+class InMemoryExporter(object):
+    """Keep the exported spans in memory. Useful for tests."""
+
+    def __init__(self):
+        self.roots = []
+        self._lock = threading.Lock()
+
+    def export(self, root):
+        with self._lock:
+            self.roots.append(root)
+
+    @property
+    def spans(self):
+        """Every exported span in order."""
+        return [span for root in list(self.roots) for span in root.walk()]
+
+    def clear(self):
+        with self._lock:
+            del self.roots[:]
+
+
+class OpenTelemetryExporter(object):
+    """Replay the span trees to an OpenTelemetry tracer.
+
+    :param tracer: An `opentelemetry.trace.Tracer`. The tracer of the global
+        tracer provider is used if not given.
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+        self._trace = trace
+        if tracer is None:
+            tracer = trace.get_tracer('itunesiap')
+        self.tracer = tracer
+
+    def export(self, root):
+        self._export(root, None)
+
+    def _export(self, span, context):
+        trace = self._trace
+        otel_span = self.tracer.start_span(
+            span.name, context=context, start_time=span.start_time,
+            attributes=span.attributes)
+        if span.error is not None:
+            # the message of the exception may have the receipt data, e.g.
+            # `latest_receipt` of InvalidReceipt, so only the type is exported
+            error_type = span.error.__class__.__name__
+            event_attributes = {'exception.type': error_type}
+            status = getattr(span.error, 'status', None)
+            if isinstance(status, int):
+                event_attributes['itunesiap.status'] = status
+            otel_span.add_event('exception', event_attributes, timestamp=span.end_time)
+            otel_span.set_status(trace.Status(trace.StatusCode.ERROR, error_type))
+        child_context = trace.set_span_in_context(otel_span, context)
+        for child in sorted(span.children, key=lambda child: child.start_time):
+            self._export(child, child_context)
+        otel_span.end(end_time=span.end_time)
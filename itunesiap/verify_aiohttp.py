@@ -4,27 +4,289 @@ import aiohttp
 
 from . import receipt
 from . import exceptions
+from . import instrument
 from .environment import default as default_env
+from .tools import monotonic, nullcontext
 
 
-class AiohttpVerify:
+async def _aioacquire(rate_limiter, tier, deadline):
+    """Asynchronous version of
+    :meth:`itunesiap.ratelimit.RateLimiter.acquire`.
+    """
+    bucket = rate_limiter.bucket(tier)
+    if bucket is None:
+        return
+    timeout = rate_limiter.timeout
+    if deadline is not None:
+        timeout = deadline.timeout(timeout)
+    expires_at = None if timeout is None else monotonic() + timeout
+    while True:
+        wait = bucket.take()
+        if wait == 0.0:
+            return
+        if not rate_limiter.blocking or \
+                (expires_at is not None and monotonic() + wait > expires_at):
+            raise exceptions.RateLimited(tier=tier)
+        await asyncio.sleep(wait)
+
+
+async def _call_cache(cache, method, *args):
+    """Call `method` of :class:`itunesiap.cache.ResponseCache` in the default
+    executor when its backend blocks.
+    """
+    if not getattr(cache.backend, 'blocking', False):
+        return method(*args)
+    return await asyncio.get_event_loop().run_in_executor(None, method, *args)
+
+
+async def _on_connection_create_start(session, context, params):
+    context.connect_started_at = monotonic()
+
+
+async def _on_connection_create_end(session, context, params):
+    probe = context.trace_request_ctx
+    if probe is not None:
+        probe.emit(instrument.CONNECT, context.connect_started_at, url=probe.url)
+
+
+#: Reports `connect` stage to :class:`itunesiap.instrument.Probe` given as
+#: `trace_request_ctx`.
+_connect_trace = aiohttp.TraceConfig()
+_connect_trace.on_connection_create_start.append(_on_connection_create_start)
+_connect_trace.on_connection_create_end.append(_on_connection_create_end)
+
+
+class _AioNullContext:
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        pass
 
-    async def aioverify_from(self, url, timeout):
-        body = json.dumps(self.request_content).encode()
-        async with aiohttp.ClientSession() as session:
+
+_aionullcontext = _AioNullContext()
+
+
+class _AioSlot:
+    """Asynchronous version of a slot of :class:`itunesiap.bulkhead.Bulkhead`."""
+
+    def __init__(self, bulkhead, tier, deadline):
+        self.slots = bulkhead.aioslots(tier)
+        self.tier = tier
+        self.timeout = bulkhead.timeout
+        if deadline is not None:
+            self.timeout = deadline.timeout(self.timeout)
+
+    async def __aenter__(self):
+        slots = self.slots
+        if slots.semaphore.locked():
+            slots.waiting += 1
             try:
-                http_response = await session.post(url, data=body, timeout=timeout)
-            except asyncio.TimeoutError as e:
-                raise exceptions.ItunesServerNotReachable(exc=e)
-            if http_response.status != 200:
-                response_text = await http_response.text()
-                raise exceptions.ItunesServerNotAvailable(http_response.status, response_text)
+                await asyncio.wait_for(slots.semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                slots.rejected += 1
+                raise exceptions.BulkheadFull(tier=self.tier)
+            finally:
+                slots.waiting -= 1
+        else:
+            await slots.semaphore.acquire()
+        slots.in_use += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        self.slots.release()
+
+
+class AiohttpVerify:
+
+    async def _aioverify_once(self, session, url, body, timeout, probe=None):
+        """Send the encoded request body to `url` once."""
+        if probe is None:
+            post = session.post(url, data=body, timeout=timeout)
+        else:
+            post = session.post(url, data=body, timeout=timeout, trace_request_ctx=probe)
+        sent_at = monotonic()
+        try:
+            http_response = await post
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            raise exceptions.ItunesServerNotReachable(exc=e)
+        if probe is not None:
+            received_at = monotonic()
+            probe.emit(instrument.REQUEST, sent_at, received_at - sent_at, url=url, http_status=http_response.status)
+        try:
             response_body = await http_response.text()
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            raise exceptions.ItunesServerNotReachable(exc=e)
+        if http_response.status != 200:
+            raise exceptions.ItunesServerNotAvailable(http_response.status, response_body)
+        if probe is not None:
+            probe.emit(instrument.DOWNLOAD, received_at, url=url, http_status=http_response.status)
+        with instrument.stage(probe, instrument.DECODE, url=url):
             response_data = json.loads(response_body)
+        with instrument.stage(probe, instrument.MAP, url=url):
             response = receipt.Response(response_data)
-            if response.status != 0:
-                raise exceptions.InvalidReceipt(response_data)
-            return response
+        if response.status != 0:
+            raise exceptions.InvalidReceipt(response_data)
+        return response
+
+    async def _aioverify_timed(self, session, url, body, timeout, hedge, probe=None):
+        started_at = monotonic()
+        try:
+            response = await self._aioverify_once(session, url, body, timeout, probe)
+        except exceptions.InvalidReceipt:
+            hedge.record(url, monotonic() - started_at)
+            raise
+        hedge.record(url, monotonic() - started_at)
+        return response
+
+    async def _aioverify_hedged(self, session, url, body, timeout, hedge, probe=None, slots=None):
+        """Send the encoded request body to `url` with `hedge` policy.
+
+        The late request is cancelled when the other one answers first. The
+        hedged request takes a free one of the bulkhead `slots` until it is
+        done, and it is not sent without one.
+        """
+        delay = hedge.delay_for(url)
+        tasks = {asyncio.ensure_future(
+            self._aioverify_timed(session, url, body, timeout, hedge, probe))}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and (slots is None or not slots.semaphore.locked()) and hedge.acquire():
+                    if slots is not None:
+                        await slots.semaphore.acquire()  # free, no wait
+                        slots.in_use += 1
+                    task = asyncio.ensure_future(
+                        self._aioverify_timed(session, url, body, timeout, hedge, probe))
+                    if slots is not None:
+                        task.add_done_callback(lambda task: slots.release())
+                    tasks.add(task)
+            while True:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+                done = sorted(done, key=lambda task: task.exception() is not None)
+                for task in done:
+                    error = task.exception()
+                    if error is None or not tasks or \
+                            isinstance(error, exceptions.InvalidReceipt):
+                        return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _aioverify_attempts(self, session, url, body, timeout, env, deadline, probe=None):
+        tier = self._tier(url, env)
+        retry = env.retry if env is not None else None
+        circuit_breaker = env.circuit_breaker if env is not None else None
+        hedge = env.hedge if env is not None else None
+        rate_limiter = env.rate_limiter if env is not None else None
+        bulkhead = env.bulkhead if env is not None else None
+        adaptive_timeout = env.adaptive_timeout if env is not None else None
+        if circuit_breaker is None:
+            breaker = nullcontext
+        else:
+            breaker = circuit_breaker.get(url)
+
+        started_at = monotonic()
+        attempt = 1
+        while True:
+            attempt_started_at = monotonic()
+            attempt_timeout = timeout
+            if adaptive_timeout is not None:
+                attempt_timeout = adaptive_timeout.timeout_for(url, timeout)
+            if rate_limiter is not None:
+                await _aioacquire(rate_limiter, tier, deadline)
+            if bulkhead is None:
+                slot = _aionullcontext
+            else:
+                slot = _AioSlot(bulkhead, tier, deadline)
+            try:
+                async with slot:
+                    # the waits for the token and the slot are in the deadline
+                    if deadline is not None:
+                        if deadline.expired:
+                            raise exceptions.DeadlineExceeded(url=url)
+                        attempt_timeout = deadline.timeout(attempt_timeout)
+                    with breaker:
+                        sent_at = monotonic()
+                        try:
+                            if hedge is not None:
+                                response = await self._aioverify_hedged(
+                                    session, url, body, attempt_timeout, hedge, probe,
+                                    None if bulkhead is None else slot.slots)
+                            else:
+                                response = await self._aioverify_once(session, url, body, attempt_timeout, probe)
+                        except exceptions.InvalidReceipt:
+                            if adaptive_timeout is not None:
+                                adaptive_timeout.record(url, monotonic() - sent_at)
+                            raise
+                        except exceptions.ItunesServerNotReachable as e:
+                            # not a failure of the server if the deadline cut the attempt
+                            if deadline is not None and deadline.expired:
+                                raise exceptions.DeadlineExceeded(url=url, exc=e)
+                            if adaptive_timeout is not None:
+                                adaptive_timeout.record_timeout(url, attempt_timeout, monotonic() - sent_at)
+                            raise
+                        if adaptive_timeout is not None:
+                            adaptive_timeout.record(url, monotonic() - sent_at)
+            except exceptions.RequestError as e:
+                if probe is not None:
+                    probe.emit(instrument.ATTEMPT, attempt_started_at, url=url, attempt=attempt, error=e)
+                if retry is None or isinstance(e, exceptions.DeadlineExceeded):
+                    raise
+                delay = retry.next_delay(e, attempt, started_at, deadline)
+                if delay is None:
+                    raise
+            else:
+                if probe is not None:
+                    probe.emit(instrument.ATTEMPT, attempt_started_at, url=url, attempt=attempt, status=response.status)
+                return response
+            if probe is not None:
+                probe.retries += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _aioverify_from(self, url, timeout, env, deadline, probe=None):
+        if probe is not None:
+            probe.url = url
+            probe.tier = self._tier(url, env)
+        with instrument.stage(probe, instrument.ENCODE, url=url):
+            body = json.dumps(self.request_content).encode()
+        bulkhead = env.bulkhead if env is not None else None
+        dispatcher = env.dispatcher if env is not None else None
+        if dispatcher is None:
+            slot = _aionullcontext
+        else:
+            slot = dispatcher.slot(env.priority)
+        async with slot:
+            if bulkhead is not None:
+                session = bulkhead.aiosession(self._tier(url, env))
+                return await self._aioverify_attempts(session, url, body, timeout, env, deadline, probe)
+            if probe is None:
+                session = aiohttp.ClientSession()
+            else:
+                session = aiohttp.ClientSession(trace_configs=[_connect_trace])
+            async with session:
+                return await self._aioverify_attempts(session, url, body, timeout, env, deadline, probe)
+
+    async def aioverify_from(self, url, timeout, env=None, deadline=None, probe=None):
+        """The actual implemention of verification request.
+
+        When `deadline` is given, the whole attempts to `url` run in a
+        cancellation scope of the remaining budget. `probe` is the
+        :class:`itunesiap.instrument.Probe` of the verification if any.
+        """
+        if deadline is None:
+            return await self._aioverify_from(url, timeout, env, deadline, probe)
+        if deadline.expired:
+            raise exceptions.DeadlineExceeded(url=url)
+        try:
+            return await asyncio.wait_for(
+                self._aioverify_from(url, timeout, env, deadline, probe),
+                deadline.remaining())
+        except asyncio.TimeoutError as e:
+            raise exceptions.DeadlineExceeded(url=url, exc=e)
 
     async def aioverify(self, **options):
         """Try to verify the given receipt with current environment.
@@ -36,6 +298,9 @@ class AiohttpVerify:
 
         .. _Receipt_Validation_Programming_Guide: https://developer.apple.com/library/content/releasenotes/General/ValidateAppStoreReceipt/Chapters/ValidateRemotely.html
 
+        Any other item of :class:`itunesiap.environment.Environment` also can
+        be given to override the environment.
+
         :param itunesiap.environment.Environment env: Override the environment.
         :param float timeout: The value is connection timeout of the verifying
             request. The default value is 30.0 when no `env` is given.
@@ -47,26 +312,116 @@ class AiohttpVerify:
             when no `env` is given.
 
         :param bool verify_ssl: The value will be ignored.
+        :param itunesiap.retry.RetryPolicy retry: Retry policy for transient
+            failures. The default value is `None` (no retry) when no `env` is
+            given.
+        :param float deadline: The total time budget in seconds for every
+            attempts including the sandbox fallback. When the budget is
+            exhausted, :class:`itunesiap.exceptions.DeadlineExceeded` is
+            raised instead of trying the next one. The default value is `None`
+            (no limit) when no `env` is given.
+        :param itunesiap.circuitbreaker.CircuitBreakers circuit_breaker:
+            Circuit breakers for each verification URL. The default value is
+            `None` when no `env` is given.
+        :param itunesiap.hedge.HedgePolicy hedge: Hedging policy. The default
+            value is `None` (no hedge) when no `env` is given.
+        :param itunesiap.ratelimit.RateLimiter rate_limiter: Client-side rate
+            limiter. Each attempt takes a token of the server. The default
+            value is `None` (no limit) when no `env` is given.
+        :param itunesiap.bulkhead.Bulkhead bulkhead: Isolated connection
+            pools and concurrency limits for each server. The default value
+            is `None` (a new session for each verification) when no `env` is
+            given.
+        :param itunesiap.dispatcher.PriorityDispatcher dispatcher: Priority
+            aware admission control in front of each server. The default
+            value is `None` when no `env` is given.
+        :param str priority: The priority class for `dispatcher`,
+            `interactive` or `background`. The default value is
+            `interactive` when no `env` is given.
+        :param itunesiap.adaptive.AdaptiveTimeout adaptive_timeout: Timeout
+            policy by the observed latencies. The default value is `None`
+            (the fixed `timeout`) when no `env` is given.
+        :param observers: The sequence of
+            :class:`itunesiap.instrument.Observer` receiving the timed events
+            of the verification. The default value is empty when no `env` is
+            given.
+        :param itunesiap.precheck.Precheck precheck: Local pre-check of the
+            receipt data. Malformed one raises
+            :class:`itunesiap.exceptions.PrecheckFailed` without any request.
+            Give `None` to bypass it. The default value is `None` when no
+            `env` is given.
+        :param itunesiap.cache.ResponseCache cache: The cache of verified
+            responses. Give `None` to bypass it. The default value is `None`
+            when no `env` is given.
 
         :return: :class:`itunesiap.receipt.Receipt` object if succeed.
         :raises: Otherwise raise a request exception.
         """
-        env = options.get('env', default_env)
-        use_production = options.get('use_production', env.use_production)
-        use_sandbox = options.get('use_sandbox', env.use_sandbox)
-        verify_ssl = options.get('verify_ssl', env.verify_ssl)  # noqa
-        timeout = options.get('timeout', env.timeout)
+        env = self._resolve_environment(options, default_env)
+        deadline = self._start_deadline(env)
+        probe = instrument.Probe.start(env, self)
+        if probe is None:
+            return await self._aioverify_servers(env, deadline, probe)
+
+        started_at = monotonic()
+        try:
+            response = await self._aioverify_servers(env, deadline, probe)
+        except exceptions.RequestError as e:
+            probe.emit(instrument.VERIFY, started_at, url=probe.url, error=e)
+            raise
+        probe.emit(instrument.VERIFY, started_at, url=probe.url, status=response.status)
+        return response
+
+    async def _aioverify_tier(self, tier, env, deadline, probe):
+        """Verify with the endpoints of `tier` in `env`, failing over between
+        them.
+        """
+        endpoints = env.endpoints
+        if endpoints is None:
+            if tier == 'sandbox':
+                url = self.SANDBOX_VALIDATION_URL
+            else:
+                url = self.PRODUCTION_VALIDATION_URL
+            return await self.aioverify_from(url, timeout=env.timeout, env=env, deadline=deadline, probe=probe)
+
+        pool = endpoints[tier]
+        for url in pool.candidates():
+            try:
+                with pool.track(url):
+                    return await self.aioverify_from(url, timeout=env.timeout, env=env, deadline=deadline, probe=probe)
+            except exceptions.ItunesServerNotAvailable as e:
+                if not endpoints.is_failover(e):
+                    raise
+                error = e
+        raise error
+
+    async def _aioverify_servers(self, env, deadline, probe):
+        self._precheck(env)
+        cache = env.cache
+        if cache is not None:
+            response = await _call_cache(cache, cache.get, self, env)
+            if response is not None:
+                self._cache_hit(probe)
+                return response
+
+        response = await self._aioverify_tiers(env, deadline, probe)
+        if cache is not None:
+            await _call_cache(cache, cache.set, self, response, env)
+        return response
 
+    async def _aioverify_tiers(self, env, deadline, probe):
         response = None
-        if use_production:
+        if env.use_production:
             try:
-                response = await self.aioverify_from(self.PRODUCTION_VALIDATION_URL, timeout=timeout)
+                response = await self._aioverify_tier('production', env, deadline, probe)
             except exceptions.InvalidReceipt as e:
-                if not use_sandbox or e.status != self.STATUS_SANDBOX_RECEIPT_ERROR:
+                if not env.use_sandbox or e.status != self.STATUS_SANDBOX_RECEIPT_ERROR:
                     raise
-        if not response and use_sandbox:
+                if probe is not None:
+                    probe.fallback = True
+        if not response and env.use_sandbox:
             try:
-                response = await self.aioverify_from(self.SANDBOX_VALIDATION_URL, timeout=timeout)
+                response = await self._aioverify_tier('sandbox', env, deadline, probe)
             except exceptions.InvalidReceipt:
                 raise
         return response
@@ -1,11 +1,16 @@
 
 import json
+import time
 import functools
+import threading
 import requests
+from six.moves import queue
 
 from . import receipt
 from . import exceptions
+from . import instrument
 from .environment import Environment
+from .tools import monotonic, nullcontext
 
 
 class InvalidReceiptResponse(exceptions.InvalidReceipt, receipt.Response):
@@ -13,40 +18,189 @@ class InvalidReceiptResponse(exceptions.InvalidReceipt, receipt.Response):
 
 
 class RequestsVerify(object):
-    def verify_from(self, url, timeout=None, verify_ssl=True):
-        """The actual implemention of verification request.
-
-        :func:`verify` calls this method to try to verifying for each servers.
-
-        :param str url: iTunes verification API URL.
-        :param float timeout: The value is connection timeout of the verifying
-            request. The default value is 30.0 when no `env` is given.
-        :param bool verify_ssl: SSL verification.
-
-        :return: :class:`itunesiap.receipt.Receipt` object if succeed.
-        :raises: Otherwise raise a request exception.
-        """
-        post_body = json.dumps(self.request_content)
-        requests_post = requests.post
+    def _verify_once(self, url, post_body, timeout, verify_ssl, session=None, probe=None):
+        """Send the encoded request body to `url` once."""
+        requests_post = (session or requests).post
         if self.proxy_url:
             protocol = self.proxy_url.split('://')[0]
             requests_post = functools.partial(requests_post, proxies={protocol: self.proxy_url})
         if timeout is not None:
             requests_post = functools.partial(requests_post, timeout=timeout)
+        sent_at = monotonic()
         try:
             http_response = requests_post(url, post_body, verify=verify_ssl)
         except requests.exceptions.RequestException as e:
             raise exceptions.ItunesServerNotReachable(exc=e)
+        if probe is not None:
+            # `elapsed` is until the response headers are parsed
+            received_at = monotonic()
+            headers_at = min(sent_at + http_response.elapsed.total_seconds(), received_at)
+            http_status = http_response.status_code
+            probe.emit(instrument.REQUEST, sent_at, headers_at - sent_at, url=url, http_status=http_status)
+            probe.emit(instrument.DOWNLOAD, headers_at, received_at - headers_at, url=url, http_status=http_status)
 
         if http_response.status_code != 200:
             raise exceptions.ItunesServerNotAvailable(http_response.status_code, http_response.content)
 
-        response_data = json.loads(http_response.content.decode('utf-8'))
-        response = receipt.Response(response_data)
+        with instrument.stage(probe, instrument.DECODE, url=url):
+            response_data = json.loads(http_response.content.decode('utf-8'))
+        with instrument.stage(probe, instrument.MAP, url=url):
+            response = receipt.Response(response_data)
         if response.status != 0:
             raise exceptions.InvalidReceipt(response_data=response_data)
         return response
 
+    def _verify_hedged(
+            self, url, post_body, timeout, verify_ssl, session, hedge, probe=None,
+            bulkhead=None, tier=None):
+        """Send the encoded request body to `url` with `hedge` policy.
+
+        Requests run in threads. The late request is abandoned when the other
+        one answers first. The hedged request takes a free slot of `tier` in
+        `bulkhead` until it is done, and it is not sent without one.
+        """
+        results = queue.Queue()
+
+        def run(hedged):
+            started_at = monotonic()
+            try:
+                response = self._verify_once(url, post_body, timeout, verify_ssl, session, probe)
+            except exceptions.InvalidReceipt as e:
+                hedge.record(url, monotonic() - started_at)
+                results.put(e)
+            except Exception as e:
+                results.put(e)
+            else:
+                hedge.record(url, monotonic() - started_at)
+                results.put(response)
+            finally:
+                if hedged and bulkhead is not None:
+                    bulkhead.release(tier)
+
+        def launch(hedged=False):
+            thread = threading.Thread(target=run, args=(hedged,))
+            thread.daemon = True
+            thread.start()
+
+        launch()
+        pending = 1
+        try:
+            result = results.get(timeout=hedge.delay_for(url))
+        except queue.Empty:
+            if bulkhead is None or bulkhead.try_acquire(tier):
+                if hedge.acquire():
+                    launch(hedged=True)
+                    pending += 1
+                elif bulkhead is not None:
+                    bulkhead.release(tier)
+            result = results.get()
+        pending -= 1
+        while pending and isinstance(result, Exception) \
+                and not isinstance(result, exceptions.InvalidReceipt):
+            result = results.get()
+            pending -= 1
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def verify_from(
+            self, url, timeout=None, verify_ssl=True, env=None, deadline=None,
+            probe=None):
+        """The actual implemention of verification request.
+
+        :func:`verify` calls this method to try to verifying for each servers.
+
+        :param str url: iTunes verification API URL.
+        :param float timeout: The value is connection timeout of the verifying
+            request. The default value is 30.0 when no `env` is given.
+        :param bool verify_ssl: SSL verification.
+        :param itunesiap.environment.Environment env: The environment for
+            policies like `retry`, `circuit_breaker`, `hedge`, `rate_limiter`,
+            `bulkhead` and `adaptive_timeout`. The request body is encoded
+            once for every attempts.
+        :param itunesiap.deadline.Deadline deadline: The total time budget.
+            Each attempt gets only the remaining budget as its timeout.
+        :param itunesiap.instrument.Probe probe: The instrumentation of the
+            verification. `None` to measure nothing.
+
+        :return: :class:`itunesiap.receipt.Receipt` object if succeed.
+        :raises: Otherwise raise a request exception.
+        """
+        tier = self._tier(url, env)
+        retry = env.retry if env is not None else None
+        circuit_breaker = env.circuit_breaker if env is not None else None
+        hedge = env.hedge if env is not None else None
+        rate_limiter = env.rate_limiter if env is not None else None
+        bulkhead = env.bulkhead if env is not None else None
+        adaptive_timeout = env.adaptive_timeout if env is not None else None
+        if circuit_breaker is None:
+            breaker = nullcontext
+        else:
+            breaker = circuit_breaker.get(url)
+        session = bulkhead.session(tier) if bulkhead is not None else None
+
+        if probe is not None:
+            probe.url = url
+            probe.tier = tier
+        with instrument.stage(probe, instrument.ENCODE, url=url):
+            post_body = json.dumps(self.request_content)
+        started_at = monotonic()
+        attempt = 1
+        while True:
+            attempt_started_at = monotonic()
+            attempt_timeout = timeout
+            if adaptive_timeout is not None:
+                attempt_timeout = adaptive_timeout.timeout_for(url, timeout)
+            if deadline is not None and deadline.expired:
+                raise exceptions.DeadlineExceeded(url=url)
+            if rate_limiter is not None:
+                rate_limiter.acquire(tier, deadline)
+            slot = nullcontext if bulkhead is None else bulkhead.slot(tier, deadline)
+            try:
+                with slot:
+                    # the waits for the token and the slot are in the deadline
+                    if deadline is not None:
+                        if deadline.expired:
+                            raise exceptions.DeadlineExceeded(url=url)
+                        attempt_timeout = deadline.timeout(attempt_timeout)
+                    with breaker:
+                        sent_at = monotonic()
+                        try:
+                            if hedge is not None:
+                                response = self._verify_hedged(
+                                    url, post_body, attempt_timeout, verify_ssl, session, hedge, probe, bulkhead, tier)
+                            else:
+                                response = self._verify_once(url, post_body, attempt_timeout, verify_ssl, session, probe)
+                        except exceptions.InvalidReceipt:
+                            if adaptive_timeout is not None:
+                                adaptive_timeout.record(url, monotonic() - sent_at)
+                            raise
+                        except exceptions.ItunesServerNotReachable as e:
+                            # not a failure of the server if the deadline cut the attempt
+                            if deadline is not None and deadline.expired:
+                                raise exceptions.DeadlineExceeded(url=url, exc=e)
+                            if adaptive_timeout is not None:
+                                adaptive_timeout.record_timeout(url, attempt_timeout, monotonic() - sent_at)
+                            raise
+                        if adaptive_timeout is not None:
+                            adaptive_timeout.record(url, monotonic() - sent_at)
+            except exceptions.RequestError as e:
+                if probe is not None:
+                    probe.emit(instrument.ATTEMPT, attempt_started_at, url=url, attempt=attempt, error=e)
+                if retry is None or isinstance(e, exceptions.DeadlineExceeded):
+                    raise
+                delay = retry.next_delay(e, attempt, started_at, deadline)
+                if delay is None:
+                    raise
+            else:
+                if probe is not None:
+                    probe.emit(instrument.ATTEMPT, attempt_started_at, url=url, attempt=attempt, status=response.status)
+                return response
+            if probe is not None:
+                probe.retries += 1
+            time.sleep(delay)
+            attempt += 1
+
     def verify(self, **options):
         """Try verification with current environment.
 
@@ -55,6 +209,9 @@ class RequestsVerify(object):
 
         .. _Receipt_Validation_Programming_Guide: https://developer.apple.com/library/content/releasenotes/General/ValidateAppStoreReceipt/Chapters/ValidateRemotely.html
 
+        Any other item of :class:`itunesiap.environment.Environment` also can
+        be given to override the environment.
+
         :param itunesiap.environment.Environment env: Override the environment.
         :param float timeout: The value is connection timeout of the verifying
             request. The default value is 30.0 when no `env` is given.
@@ -68,30 +225,114 @@ class RequestsVerify(object):
         :param bool verify_ssl: The value is weather enabling SSL verification
             or not. WARNING: DO NOT TURN IT OFF WITHOUT A PROPER REASON. IF YOU
             DON'T UNDERSTAND WHAT IT MEANS, NEVER SET IT YOURSELF.
+        :param itunesiap.retry.RetryPolicy retry: Retry policy for transient
+            failures. The default value is `None` (no retry) when no `env` is
+            given.
+        :param float deadline: The total time budget in seconds for every
+            attempts including the sandbox fallback. When the budget is
+            exhausted, :class:`itunesiap.exceptions.DeadlineExceeded` is
+            raised instead of trying the next one. The default value is `None`
+            (no limit) when no `env` is given.
+        :param itunesiap.circuitbreaker.CircuitBreakers circuit_breaker:
+            Circuit breakers for each verification URL. The default value is
+            `None` when no `env` is given.
+        :param itunesiap.hedge.HedgePolicy hedge: Hedging policy. Hedged
+            requests run in threads. The default value is `None` (no hedge)
+            when no `env` is given.
+        :param itunesiap.ratelimit.RateLimiter rate_limiter: Client-side rate
+            limiter. Each attempt takes a token of the server. The default
+            value is `None` (no limit) when no `env` is given.
+        :param itunesiap.bulkhead.Bulkhead bulkhead: Isolated connection
+            pools and concurrency limits for each server. The default value
+            is `None` (a new connection for each request) when no `env` is
+            given.
+        :param itunesiap.adaptive.AdaptiveTimeout adaptive_timeout: Timeout
+            policy by the observed latencies. The default value is `None`
+            (the fixed `timeout`) when no `env` is given.
+        :param observers: The sequence of
+            :class:`itunesiap.instrument.Observer` receiving the timed events
+            of the verification. The default value is empty when no `env` is
+            given.
+        :param itunesiap.precheck.Precheck precheck: Local pre-check of the
+            receipt data. Malformed one raises
+            :class:`itunesiap.exceptions.PrecheckFailed` without any request.
+            Give `None` to bypass it. The default value is `None` when no
+            `env` is given.
+        :param itunesiap.cache.ResponseCache cache: The cache of verified
+            responses. Give `None` to bypass it. The default value is `None`
+            when no `env` is given.
 
         :return: :class:`itunesiap.receipt.Receipt` object if succeed.
         :raises: Otherwise raise a request exception.
         """
-        env = options.get('env')
-        if not env:  # backward compitibility
-            env = Environment._stack[-1]
-        use_production = options.get('use_production', env.use_production)
-        use_sandbox = options.get('use_sandbox', env.use_sandbox)
-        verify_ssl = options.get('verify_ssl', env.verify_ssl)
-        timeout = options.get('timeout', env.timeout)
+        # `Environment._stack` for backward compitibility
+        env = self._resolve_environment(options, Environment._stack[-1])
         assert(env.use_production or env.use_sandbox)
+        deadline = self._start_deadline(env)
+        probe = instrument.Probe.start(env, self)
+        if probe is None:
+            return self._verify_servers(env, deadline, probe)
+
+        started_at = monotonic()
+        try:
+            response = self._verify_servers(env, deadline, probe)
+        except exceptions.RequestError as e:
+            probe.emit(instrument.VERIFY, started_at, url=probe.url, error=e)
+            raise
+        probe.emit(instrument.VERIFY, started_at, url=probe.url, status=response.status)
+        return response
+
+    def _verify_tier(self, tier, env, deadline, probe):
+        """Verify with the endpoints of `tier` in `env`, failing over between
+        them.
+        """
+        endpoints = env.endpoints
+        if endpoints is None:
+            if tier == 'sandbox':
+                url = self.SANDBOX_VALIDATION_URL
+            else:
+                url = self.PRODUCTION_VALIDATION_URL
+            return self.verify_from(url, timeout=env.timeout, verify_ssl=env.verify_ssl, env=env, deadline=deadline, probe=probe)
+
+        pool = endpoints[tier]
+        for url in pool.candidates():
+            try:
+                with pool.track(url):
+                    return self.verify_from(url, timeout=env.timeout, verify_ssl=env.verify_ssl, env=env, deadline=deadline, probe=probe)
+            except exceptions.ItunesServerNotAvailable as e:
+                if not endpoints.is_failover(e):
+                    raise
+                error = e
+        raise error
+
+    def _verify_servers(self, env, deadline, probe):
+        self._precheck(env)
+        cache = env.cache
+        if cache is not None:
+            response = cache.get(self, env)
+            if response is not None:
+                self._cache_hit(probe)
+                return response
+
+        response = self._verify_tiers(env, deadline, probe)
+        if cache is not None:
+            cache.set(self, response, env)
+        return response
 
+    def _verify_tiers(self, env, deadline, probe):
         response = None
-        if use_production:
+        if env.use_production:
             try:
-                response = self.verify_from(self.PRODUCTION_VALIDATION_URL, timeout=timeout, verify_ssl=verify_ssl)
+                response = self._verify_tier('production', env, deadline, probe)
             except exceptions.InvalidReceipt as e:
-                if not use_sandbox or e.status != self.STATUS_SANDBOX_RECEIPT_ERROR:
+                if not env.use_sandbox or e.status != self.STATUS_SANDBOX_RECEIPT_ERROR:
                     raise
+                if probe is not None:
+                    probe.fallback = True
 
-        if not response and use_sandbox:
+        if not response and env.use_sandbox:
             try:
-                response = self.verify_from(self.SANDBOX_VALIDATION_URL, timeout=timeout, verify_ssl=verify_ssl)
+                response = self._verify_tier('sandbox', env, deadline, probe)
             except exceptions.InvalidReceipt:
                 raise
 
@@ -0,0 +1,103 @@
+import time
+import requests
+import itunesiap
+from itunesiap.adaptive import AdaptiveTimeout
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def test_default_timeout_until_min_samples():
+    adaptive = AdaptiveTimeout(minimum=1.0, maximum=30.0, min_samples=3)
+    url = itunesiap.Request.PRODUCTION_VALIDATION_URL
+    assert adaptive.timeout_for(url, 10.0) == 10.0
+    assert adaptive.timeout_for(url, 60.0) == 30.0
+    assert adaptive.timeout_for(url, None) == 30.0
+    adaptive.record(url, 0.2)
+    adaptive.record(url, 0.2)
+    assert adaptive.timeout_for(url, 10.0) == 10.0
+    adaptive.record(url, 0.2)
+    assert adaptive.timeout_for(url, 10.0) == 1.0  # clamped to minimum
+
+
+def test_percentile_headroom():
+    adaptive = AdaptiveTimeout(
+        percentile=0.9, factor=2.0, headroom=0.5, minimum=0.1, maximum=5.0,
+        min_samples=1)
+    url = itunesiap.Request.PRODUCTION_VALIDATION_URL
+    for latency in range(1, 11):
+        adaptive.record(url, latency / 10.0)
+    assert adaptive.timeout_for(url) == pytest.approx(0.9 * 2.0 + 0.5)
+    assert adaptive.timeout_for(itunesiap.Request.SANDBOX_VALIDATION_URL, 3.0) == 3.0
+
+    for _ in range(100):
+        adaptive.record(url, 10.0)
+    assert adaptive.timeout_for(url) == 5.0  # clamped to maximum
+
+
+def test_verify_adaptive_timeout(http_response):
+    adaptive = AdaptiveTimeout(
+        percentile=0.5, headroom=1.0, minimum=0.5, maximum=60.0, min_samples=1)
+    env = itunesiap.env.production.clone(adaptive_timeout=adaptive)
+    request = itunesiap.Request('receipt')
+    url = request.PRODUCTION_VALIDATION_URL
+    with patch.object(requests, 'post') as post:
+        post.return_value = http_response({'status': 0})
+        request.verify(env=env)
+        assert post.call_args[1]['timeout'] == 30.0
+        assert adaptive.latencies[url].count == 1
+        request.verify(env=env)
+        timeout = post.call_args[1]['timeout']
+        assert 1.0 <= timeout < 2.0
+
+        post.return_value = http_response({'status': 21002})
+        with pytest.raises(itunesiap.exc.InvalidReceipt):
+            request.verify(env=env)
+        assert adaptive.latencies[url].count == 3
+
+        post.side_effect = requests.exceptions.ReadTimeout()
+        with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+            request.verify(env=env)
+        assert adaptive.latencies[url].count == 3
+
+
+def test_record_timeout(http_response):
+    adaptive = AdaptiveTimeout(
+        percentile=0.99, headroom=0.05, minimum=0.01, maximum=1.0,
+        min_samples=1, window=4)
+    url = itunesiap.Request.PRODUCTION_VALIDATION_URL
+    adaptive.record_timeout(url, 0.5, 0.01)  # refused quickly
+    assert adaptive.latencies[url].count == 0
+    for _ in range(4):
+        adaptive.record(url, 0.01)
+    assert adaptive.timeout_for(url) == pytest.approx(0.06)
+
+    # the latency rises above the current timeout
+    def slow_post(url, data, **kwargs):
+        if kwargs['timeout'] < 0.2:
+            time.sleep(kwargs['timeout'])
+            raise requests.exceptions.ReadTimeout('Timeout')
+        return http_response({'status': 0})
+
+    env = itunesiap.env.production.clone(adaptive_timeout=adaptive)
+    with patch.object(requests, 'post') as post:
+        post.side_effect = slow_post
+        for _ in range(3):
+            with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+                itunesiap.verify('receipt', env=env)
+        assert adaptive.timeout_for(url) == pytest.approx(0.21)
+        assert itunesiap.verify('receipt', env=env).status == 0
+
+
+def test_verify_adaptive_timeout_with_deadline(http_response):
+    adaptive = AdaptiveTimeout(minimum=5.0, maximum=20.0)
+    env = itunesiap.env.production.clone(adaptive_timeout=adaptive, deadline=2.0)
+    request = itunesiap.Request('receipt')
+    with patch.object(requests, 'post') as post:
+        post.return_value = http_response({'status': 0})
+        request.verify(env=env)
+        assert post.call_args[1]['timeout'] <= 2.0
@@ -4,12 +4,50 @@
 .. [#document] https://developer.apple.com/library/ios/#documentation/NetworkingInternet/Conceptual/StoreKitGuide/VerifyingStoreReceipts/VerifyingStoreReceipts.html#//apple_ref/doc/uid/TP40008267-CH104-SW1
 """
 
+import json
+import asyncio
+import aiohttp
 import pytest
 import itunesiap
+import itunesiap.circuitbreaker
+import itunesiap.hedge
+import itunesiap.ratelimit
+import itunesiap.bulkhead
+import itunesiap.adaptive
+import itunesiap.instrument
+import itunesiap.deadline
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+
+def _aiohttp_response(data, status=200):
+    async def text():
+        return json.dumps(data)
+    http_response = Mock()
+    http_response.status = status
+    http_response.text = text
+    return http_response
+
+
+def _patch_post(*results):
+    """Patch `aiohttp.ClientSession.post` to return or raise `results`."""
+    results = list(results)
+    calls = []
+
+    async def post(session, url, data=None, timeout=None, trace_request_ctx=None):
+        calls.append((url, data, timeout))
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return patch.object(aiohttp.ClientSession, 'post', post), calls
 
 
 @pytest.mark.asyncio
-async def test_sandbox_aiorequest(raw_receipt_legacy):
+async def test_sandbox_aiorequest(raw_receipt_legacy, itunes_server):
     """Test sandbox receipt"""
     raw_receipt = raw_receipt_legacy
     request = itunesiap.Request(raw_receipt)
@@ -25,7 +63,7 @@ async def test_sandbox_aiorequest(raw_receipt_legacy):
 
 
 @pytest.mark.asyncio
-async def test_invalid_receipt():
+async def test_invalid_receipt(itunes_server):
     request = itunesiap.Request('wrong receipt')
 
     with pytest.raises(itunesiap.exc.InvalidReceipt):
@@ -46,3 +84,313 @@ async def test_timeout():
 def test_shortcut(raw_receipt_legacy):
     """Test shortcuts"""
     itunesiap.aioverify(raw_receipt_legacy, env=itunesiap.env.sandbox)
+
+
+@pytest.mark.asyncio
+async def test_retry():
+    patcher, calls = _patch_post(
+        _aiohttp_response({'status': 21100}),
+        asyncio.TimeoutError(),
+        _aiohttp_response({'status': 0}),
+    )
+    policy = itunesiap.retry.RetryPolicy(max_attempts=3, backoff=0.001)
+    with patcher:
+        response = await itunesiap.aioverify('DummyReceipt', retry=policy)
+    assert response.status == 0
+    assert len(calls) == 3
+    assert calls[0][1] is calls[2][1]
+
+
+@pytest.mark.asyncio
+async def test_retry_exhausted():
+    patcher, calls = _patch_post(
+        _aiohttp_response({'status': 21005}),
+        _aiohttp_response({'status': 21005}),
+    )
+    policy = itunesiap.retry.RetryPolicy(max_attempts=2, backoff=0.001)
+    with patcher:
+        with pytest.raises(itunesiap.exc.InvalidReceipt):
+            await itunesiap.aioverify('DummyReceipt', retry=policy)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_deadline():
+    async def slow_post(session, url, data=None, timeout=None):
+        await asyncio.sleep(1.0)
+        return _aiohttp_response({'status': 21007})
+
+    with patch.object(aiohttp.ClientSession, 'post', slow_post):
+        with pytest.raises(itunesiap.exc.DeadlineExceeded):
+            await itunesiap.aioverify(
+                'DummyReceipt', env=itunesiap.env.review, deadline=0.01)
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker():
+    patcher, calls = _patch_post(
+        _aiohttp_response({}, status=503),
+        _aiohttp_response({'status': 0}),
+    )
+    breakers = itunesiap.circuitbreaker.CircuitBreakers(
+        failure_threshold=1, recovery_timeout=0.01)
+    with patcher:
+        with pytest.raises(itunesiap.exc.ItunesServerNotAvailable):
+            await itunesiap.aioverify('DummyReceipt', circuit_breaker=breakers)
+        with pytest.raises(itunesiap.exc.CircuitOpen):
+            await itunesiap.aioverify('DummyReceipt', circuit_breaker=breakers)
+        await asyncio.sleep(0.02)
+        response = await itunesiap.aioverify('DummyReceipt', circuit_breaker=breakers)
+    assert response.status == 0
+    assert len(calls) == 2
+    assert set(breakers.states().values()) == {'closed'}
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_deadline():
+    async def timeout_post(session, url, data=None, timeout=None):
+        await asyncio.sleep(timeout)
+        raise asyncio.TimeoutError()
+
+    breakers = itunesiap.circuitbreaker.CircuitBreakers(failure_threshold=1)
+    env = itunesiap.env.review.clone(circuit_breaker=breakers)
+    request = itunesiap.Request('DummyReceipt')
+    url = request.PRODUCTION_VALIDATION_URL
+    with patch.object(aiohttp.ClientSession, 'post', timeout_post):
+        async with aiohttp.ClientSession() as session:
+            # the attempts without the cancellation scope of aioverify_from
+            with pytest.raises(itunesiap.exc.DeadlineExceeded):
+                await request._aioverify_attempts(
+                    session, url, b'{}', 30.0, env, itunesiap.deadline.Deadline(0.01))
+    assert breakers.states() == {url: 'closed'}
+    assert breakers[url].stats()['recent_calls'] == 0
+
+
+@pytest.mark.asyncio
+async def test_hedge():
+    calls = []
+    cancelled = []
+
+    async def post(session, url, data=None, timeout=None):
+        calls.append(url)
+        n = len(calls)
+        if n == 1:
+            try:
+                await asyncio.sleep(1.0)
+            except asyncio.CancelledError:
+                cancelled.append(n)
+                raise
+        return _aiohttp_response({'status': 0, 'n': n})
+
+    hedge = itunesiap.hedge.HedgePolicy(delay=0.01)
+    with patch.object(aiohttp.ClientSession, 'post', post):
+        response = await itunesiap.aioverify('DummyReceipt', hedge=hedge)
+    assert response['n'] == 2
+    assert cancelled == [1]
+    assert hedge.stats()['hedged'] == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter():
+    patcher, calls = _patch_post(*[_aiohttp_response({'status': 0})] * 3)
+    bucket = itunesiap.ratelimit.TokenBucket(rate=50.0, capacity=1)
+    limiter = itunesiap.ratelimit.RateLimiter(production=bucket)
+    with patcher:
+        for _ in range(2):
+            await itunesiap.aioverify('DummyReceipt', rate_limiter=limiter)
+        limiter.blocking = False
+        with pytest.raises(itunesiap.exc.RateLimited):
+            await itunesiap.aioverify('DummyReceipt', rate_limiter=limiter)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_bulkhead():
+    release = asyncio.Event()
+
+    async def post(session, url, data=None, timeout=None):
+        if url == itunesiap.Request.SANDBOX_VALIDATION_URL:
+            await release.wait()
+        return _aiohttp_response({'status': 0})
+
+    bulkhead = itunesiap.bulkhead.Bulkhead(production=2, sandbox=1, timeout=0.05)
+    env = itunesiap.env.sandbox.clone(bulkhead=bulkhead)
+    with patch.object(aiohttp.ClientSession, 'post', post):
+        blocked = asyncio.ensure_future(itunesiap.aioverify('DummyReceipt', env=env))
+        await asyncio.sleep(0.01)
+        with pytest.raises(itunesiap.exc.BulkheadFull):
+            await itunesiap.aioverify('DummyReceipt', env=env)
+        response = await itunesiap.aioverify('DummyReceipt', bulkhead=bulkhead)
+        assert response.status == 0
+        release.set()
+        await blocked
+    assert bulkhead.aiosession('production') is bulkhead.aiosession('production')
+    assert bulkhead.stats()['sandbox']['aio'] == {'loops': 1, 'in_use': 0, 'waiting': 0, 'rejected': 1}
+    await bulkhead.aioclose()
+    assert bulkhead.stats()['sandbox']['aio']['loops'] == 0
+
+
+def test_bulkhead_closed_loop():
+    bulkhead = itunesiap.bulkhead.Bulkhead(production=1)
+
+    async def use():
+        bulkhead.aioslots('production')
+        bulkhead.aiosession('production')
+
+    async def close():
+        await bulkhead.aioclose()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(use())
+    assert bulkhead.stats()['production']['aio']['loops'] == 1
+    loop.close()
+    assert bulkhead.stats()['production']['aio']['loops'] == 0
+    other = asyncio.new_event_loop()
+    other.run_until_complete(use())
+    assert list(bulkhead._aioslots) == [other] and list(bulkhead._aiosessions) == [other]
+    other.run_until_complete(close())
+    other.close()
+
+
+@pytest.mark.asyncio
+async def test_hedge_slot():
+    calls = []
+
+    async def post(session, url, data=None, timeout=None):
+        calls.append(url)
+        if len(calls) == 1:
+            await asyncio.sleep(0.2)
+        return _aiohttp_response({'status': 0})
+
+    bulkhead = itunesiap.bulkhead.Bulkhead(production=1)
+    hedge = itunesiap.hedge.HedgePolicy(delay=0.01)
+    with patch.object(aiohttp.ClientSession, 'post', post):
+        await itunesiap.aioverify('DummyReceipt', bulkhead=bulkhead, hedge=hedge)
+        # no free slot for the hedged request
+        assert len(calls) == 1
+        bulkhead = itunesiap.bulkhead.Bulkhead(production=2)
+        del calls[:]
+        await itunesiap.aioverify('DummyReceipt', bulkhead=bulkhead, hedge=hedge)
+        assert len(calls) == 2
+    assert bulkhead.stats()['production']['aio']['in_use'] == 0
+    await bulkhead.aioclose()
+
+
+@pytest.mark.asyncio
+async def test_adaptive_timeout():
+    adaptive = itunesiap.adaptive.AdaptiveTimeout(
+        percentile=0.5, headroom=1.0, minimum=0.5, maximum=60.0, min_samples=1)
+    env = itunesiap.env.production.clone(adaptive_timeout=adaptive)
+    patcher, calls = _patch_post(
+        _aiohttp_response({'status': 0}), _aiohttp_response({'status': 21002}))
+    with patcher:
+        await itunesiap.aioverify('DummyReceipt', env=env)
+        with pytest.raises(itunesiap.exc.InvalidReceipt):
+            await itunesiap.aioverify('DummyReceipt', env=env)
+    assert calls[0][2] == 30.0
+    assert 1.0 <= calls[1][2] < 2.0
+    assert adaptive.latencies[itunesiap.Request.PRODUCTION_VALIDATION_URL].count == 2
+
+
+@pytest.mark.asyncio
+async def test_instrument():
+    events = []
+    env = itunesiap.env.review.clone(
+        observers=[itunesiap.instrument.Callback(events.append)])
+    patcher, calls = _patch_post(
+        _aiohttp_response({'status': 21007}), _aiohttp_response({'status': 0}))
+    with patcher:
+        await itunesiap.aioverify('DummyReceipt', env=env)
+    stages = [e.stage for e in events]
+    assert stages == [
+        'encode', 'request', 'download', 'decode', 'map', 'attempt',
+        'encode', 'request', 'download', 'decode', 'map', 'attempt', 'verify']
+    assert events[5].status == 21007
+    assert events[-1].status == 0
+    assert events[-1].fallback is True
+    assert events[-1].url == itunesiap.Request.SANDBOX_VALIDATION_URL
+
+
+@pytest.mark.asyncio
+async def test_fake_itunes_server():
+    from itunesiap.testing import FakeItunesServer, Reply
+    events = []
+    env = itunesiap.env.review.clone(
+        observers=[itunesiap.instrument.Callback(events.append)])
+    with FakeItunesServer() as server:
+        server.sandbox_receipts.add('sandbox-receipt')
+        server.production.script(Reply(http_status=503))
+        request = server.bind(itunesiap.Request('sandbox-receipt'))
+        with pytest.raises(itunesiap.exc.ItunesServerNotAvailable):
+            await request.aioverify(env=env)
+        response = await request.aioverify(env=env)
+    assert response.status == 0
+    assert response._['environment'] == 'Sandbox'
+    assert [tier for tier, _ in server.requests] == ['production', 'production', 'sandbox']
+    assert 'connect' in [event.stage for event in events]
+
+
+@pytest.mark.asyncio
+async def test_endpoints_failover():
+    from itunesiap.endpoint import Endpoints
+    from itunesiap.testing import FakeItunesServer
+    with FakeItunesServer() as first, FakeItunesServer() as second:
+        first.production.error_rate = 1.0
+        endpoints = Endpoints(production=[first.production_url, second.production_url])
+        env = itunesiap.env.production.clone(endpoints=endpoints)
+        for _ in range(4):
+            response = await itunesiap.aioverify('receipt', env=env)
+            assert response.status == 0
+    assert second.production.calls == 4
+    assert 1 <= first.production.calls <= 4
+
+
+@pytest.mark.asyncio
+async def test_precheck():
+    from itunesiap.precheck import Precheck
+    from itunesiap.testing import FakeItunesServer
+    with FakeItunesServer() as server:
+        env = itunesiap.env.review.clone(
+            endpoints=server.as_endpoints(), precheck=Precheck())
+        with pytest.raises(itunesiap.exc.PrecheckFailed):
+            await itunesiap.aioverify('wrong receipt', env=env)
+        assert not server.requests
+        response = await itunesiap.aioverify('wrong receipt', env=env, precheck=None)
+        assert response.status == 0
+
+
+@pytest.mark.asyncio
+async def test_cache(tmpdir):
+    from itunesiap.cache import ResponseCache, SQLiteCache, LRUCache
+    from itunesiap.testing import FakeItunesServer
+    events = []
+    with FakeItunesServer() as server:
+        for backend in [LRUCache(), SQLiteCache(str(tmpdir.join('cache.db')))]:
+            env = itunesiap.env.review.clone(
+                endpoints=server.as_endpoints(), cache=ResponseCache(backend),
+                observers=[itunesiap.instrument.Callback(events.append)])
+            first = await itunesiap.aioverify('receipt', env=env)
+            second = await itunesiap.aioverify('receipt', env=env)
+            assert events[-1].cache_hit is True
+            assert second._ == first._
+    assert len(server.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_disconnect():
+    from itunesiap.retry import RetryPolicy
+    from itunesiap.testing import FakeItunesServer, Disconnect
+    with FakeItunesServer() as server:
+        request = server.bind(itunesiap.Request('receipt'))
+        server.production.script(Disconnect())
+        with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+            await request.aioverify()
+        server.production.script(Disconnect())
+        response = await request.aioverify(retry=RetryPolicy(backoff=0.0, jitter=0.0))
+        assert response.status == 0
+        port = server.port
+    # nobody listens
+    request = itunesiap.Request('receipt')
+    request.PRODUCTION_VALIDATION_URL = 'http://127.0.0.1:{0}/verifyReceipt'.format(port)
+    with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+        await request.aioverify()
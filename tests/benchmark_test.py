@@ -0,0 +1,30 @@
+import json
+
+from benchmarks import run
+
+
+def test_synthetic_receipt():
+    data = run.synthetic_receipt(3)
+    assert len(data['in_app']) == 3
+    assert data == run.synthetic_receipt(3)
+
+
+def test_run(tmpdir):
+    output = tmpdir.join('result.json')
+    assert run.main([
+        '--filter', 'date.ms_to_datetime', '--filter', 'receipt.in_app.10',
+        '--min-time', '0.001', '--repeat', '2', '--output', str(output)]) == 0
+    report = json.loads(output.read())
+    assert sorted(report['results']) == ['date.ms_to_datetime', 'receipt.in_app.10', 'receipt.in_app.1000', 'receipt.in_app.10000']
+    result = report['results']['date.ms_to_datetime']
+    assert result['repeat'] == 2
+    assert 0.0 < result['best'] <= result['median']
+
+    assert run.main([
+        '--filter', 'date.ms_to_datetime', '--min-time', '0.001',
+        '--repeat', '1', '--compare', str(output)]) == 0
+
+
+def test_transport():
+    report = run.run(['transport.verify.pooled'], min_time=0.001, repeat=1)
+    assert report['results']['transport.verify.pooled']['loops'] >= 1
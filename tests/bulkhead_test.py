@@ -0,0 +1,95 @@
+import time
+import threading
+import requests
+import itunesiap
+import itunesiap.hedge
+from itunesiap.bulkhead import Bulkhead
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def test_slots():
+    bulkhead = Bulkhead(production=1, sandbox=1, timeout=0.01)
+    with bulkhead.slot('production'):
+        with pytest.raises(itunesiap.exc.BulkheadFull):
+            with bulkhead.slot('production'):
+                pass
+        with bulkhead.slot('sandbox'):
+            assert bulkhead.stats()['sandbox']['in_use'] == 1
+    stats = bulkhead.stats()
+    assert stats['production'] == {
+        'size': 1, 'in_use': 0, 'waiting': 0, 'rejected': 1,
+        'aio': {'loops': 0, 'in_use': 0, 'waiting': 0, 'rejected': 0}}
+
+
+def test_slot_wait():
+    bulkhead = Bulkhead(production=1, timeout=1.0)
+    slot = bulkhead.slot('production')
+    slot.__enter__()
+    threading.Timer(0.02, slot.__exit__, (None, None, None)).start()
+    with bulkhead.slot('production'):
+        pass
+
+
+def test_session():
+    bulkhead = Bulkhead(production=3, sandbox=1)
+    production = bulkhead.session('production')
+    assert production is bulkhead.session('production')
+    assert production is not bulkhead.session('sandbox')
+    adapter = production.get_adapter(itunesiap.Request.PRODUCTION_VALIDATION_URL)
+    assert adapter._pool_maxsize == 3
+    bulkhead.close()
+
+
+def test_sandbox_isolated(http_response):
+    bulkhead = Bulkhead(production=2, sandbox=1, timeout=0.05)
+    env = itunesiap.env.sandbox.clone(bulkhead=bulkhead)
+    release = threading.Event()
+
+    def post(session, url, data, **kwargs):
+        if url == itunesiap.Request.SANDBOX_VALIDATION_URL:
+            release.wait(1.0)
+        return http_response({'status': 0})
+
+    with patch.object(requests.Session, 'post', post):
+        blocked = threading.Thread(
+            target=itunesiap.verify, args=('DummyReceipt',), kwargs={'env': env})
+        blocked.start()
+        time.sleep(0.01)
+        with pytest.raises(itunesiap.exc.BulkheadFull):
+            itunesiap.verify('DummyReceipt', env=env)
+        # production still has free slots
+        response = itunesiap.verify('DummyReceipt', bulkhead=bulkhead)
+        assert response.status == 0
+        release.set()
+        blocked.join()
+    bulkhead.close()
+
+
+@pytest.mark.parametrize('size', [1, 2])
+def test_hedge_slot(http_response, size):
+    bulkhead = Bulkhead(production=size)
+    hedge = itunesiap.hedge.HedgePolicy(delay=0.01)
+    calls = []
+    in_use = []
+
+    def post(session, url, data, **kwargs):
+        calls.append(url)
+        in_use.append(bulkhead.stats()['production']['in_use'])
+        if len(calls) == 1:
+            time.sleep(0.2)
+        return http_response({'status': 0})
+
+    with patch.object(requests.Session, 'post', post):
+        itunesiap.verify('DummyReceipt', bulkhead=bulkhead, hedge=hedge)
+    # the hedged request is sent only with a free slot
+    assert in_use == [1, 2][:size]
+    assert hedge.stats()['hedged'] == size - 1
+    time.sleep(0.3)
+    assert bulkhead.stats()['production']['in_use'] == 0
+    bulkhead.close()
@@ -0,0 +1,210 @@
+import time
+import threading
+
+import itunesiap
+import itunesiap.instrument
+from itunesiap import exceptions
+from itunesiap.cache import LRUCache, SQLiteCache, MemcachedCache, ResponseCache
+from itunesiap.endpoint import Endpoints
+from itunesiap.testing import FakeItunesServer, FakeMemcached, Synth
+
+import pytest
+
+
+@pytest.fixture
+def memcached():
+    with FakeMemcached() as server:
+        yield server
+
+
+@pytest.fixture(params=['lru', 'sqlite', 'memcached'])
+def backend(request, tmpdir):
+    if request.param == 'lru':
+        return LRUCache()
+    if request.param == 'sqlite':
+        return SQLiteCache(str(tmpdir.join('cache.db')))
+    server = request.getfixturevalue('memcached')
+    return MemcachedCache([server.address])
+
+
+def test_backend(backend):
+    assert backend.get('a') is None
+    backend.set('a', b'1')
+    backend.set('b', b'\x00\r\nEND\r\n' * 100)
+    assert backend.get('a') == b'1'
+    assert backend.get_many(['a', 'b', 'c']) == {'a': b'1', 'b': b'\x00\r\nEND\r\n' * 100}
+    backend.set('a', b'2')
+    assert backend.get('a') == b'2'
+    backend.delete('a')
+    backend.delete('a')
+    assert backend.get('a') is None
+
+    backend.set('short', b'x', ttl=1.0)
+    backend.set('long', b'y', ttl=60.0)
+    assert backend.get('short') == b'x'
+    time.sleep(1.1)
+    assert backend.get('short') is None
+    assert backend.get('long') == b'y'
+
+
+def test_lru():
+    backend = LRUCache(maxsize=2)
+    backend.set('a', b'1')
+    backend.set('b', b'2')
+    backend.get('a')
+    backend.set('c', b'3')
+    assert len(backend) == 2
+    assert backend.get('b') is None
+    assert backend.get_many(['a', 'c']) == {'a': b'1', 'c': b'3'}
+
+
+def test_sqlite_shared(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    writer = SQLiteCache(path, default_ttl=60.0, purge_interval=2)
+    reader = SQLiteCache(path)
+    writer.set('a', b'1')
+    writer.set('expired', b'2', ttl=-1.0)  # purged by this write
+    assert reader.get('a') == b'1'
+    assert reader.purge() == 0
+
+    values = {}
+    thread = threading.Thread(target=lambda: values.update(reader.get_many(['a'])))
+    thread.start()
+    thread.join()
+    assert values == {'a': b'1'}
+
+    keys = ['k{0}'.format(i) for i in range(1500)]
+    for key in keys:
+        writer.set(key, key.encode('ascii'))
+    assert len(reader.get_many(keys)) == 1500
+    writer.close()
+    reader.close()
+
+
+def test_memcached_distribution(memcached):
+    with FakeMemcached() as other:
+        backend = MemcachedCache([memcached.address, other.address])
+        for i in range(20):
+            backend.set('key{0}'.format(i), b'v')
+        assert len(memcached) and len(other)
+        assert len(backend.get_many(['key{0}'.format(i) for i in range(20)])) == 20
+    with pytest.raises(ValueError):
+        backend.get('invalid key')
+
+
+def test_memcached_reconnect(memcached):
+    backend = MemcachedCache([memcached.address])
+    backend.set('a', b'1')
+    port = memcached.port
+    memcached.stop()
+    with pytest.raises(exceptions.CacheError):
+        backend.get('a')
+    memcached.port = port
+    memcached.start()
+    assert backend.get('a') == b'1'
+
+
+def test_memcached_out_of_sync(memcached):
+    backend = MemcachedCache([memcached.address])
+    backend.set('a', b'1')
+    backend.set('b', b'2')
+    # the reply of a failed call is left unread
+    backend._local.connections[memcached.address].command(b'get a')
+    with pytest.raises(exceptions.CacheError):
+        backend.get('b')
+    assert backend.get('b') == b'2'
+
+    backend._local.connections[memcached.address].command(b'get a')
+    cache = ResponseCache(backend)
+    assert cache.get(itunesiap.Request('receipt')) is None
+    assert backend.get('a') == b'1'
+
+
+def test_response_cache_key():
+    cache = ResponseCache(LRUCache())
+    key = cache.key(itunesiap.Request('receipt'))
+    assert key.startswith('itunesiap:2:')
+    assert key == cache.key(itunesiap.Request(u'receipt'))
+    assert key != cache.key(itunesiap.Request('receipt', password='secret'))
+    assert key != cache.key(itunesiap.Request('receipt', exclude_old_transactions=True))
+    request = itunesiap.Request('receipt')
+    keys = set([
+        cache.key(request, itunesiap.env.production), cache.key(request, itunesiap.env.review),
+        cache.key(request, itunesiap.env.production.clone(endpoints=Endpoints('http://localhost/')))])
+    assert key not in keys and len(keys) == 3
+
+
+def test_response_cache_corrupted(memcached):
+    backend = LRUCache()
+    cache = ResponseCache(backend)
+    request = itunesiap.Request('receipt')
+    response = itunesiap.Response(Synth(seed=0).response(in_app=3))
+    cache.set(request, response)
+    key = cache.key(request)
+    value = backend.get(key)
+    assert cache.get(request).receipt.in_app == response.receipt.in_app
+
+    for corrupted in (b'garbage', value[:len(value) // 2], value[:-8] + b'\xff' * 8):
+        backend.set(key, corrupted)
+        assert cache.get(request) is None
+        assert backend.get(key) is None  # deleted
+        backend.set(key, corrupted)
+        assert cache.get_many([request]) == [None]
+        assert backend.get(key) is None
+
+    # a broken backend
+    cache = ResponseCache(MemcachedCache([memcached.address]))
+    memcached.stop()
+    cache.delete(request)
+    assert cache.get(request) is None
+
+
+def test_verify_cache(memcached):
+    events = []
+    cache = ResponseCache(MemcachedCache([memcached.address]), ttl=60.0)
+    synth = Synth(seed=0)
+    with FakeItunesServer(responder=synth.responder()) as server:
+        env = itunesiap.env.review.clone(
+            endpoints=server.as_endpoints(), cache=cache,
+            observers=[itunesiap.instrument.Callback(events.append)])
+        response = itunesiap.verify('receipt', env=env)
+        assert events[-1].cache_hit is False
+        cached = itunesiap.verify('receipt', env=env)
+        assert events[-1].cache_hit is True
+        assert len(server.requests) == 1
+        assert cached._ == response._
+        assert cached.receipt.in_app == response.receipt.in_app
+
+        # bypass
+        itunesiap.verify('receipt', env=env, cache=None)
+        assert len(server.requests) == 2
+
+        # errors are not cached
+        server.production.script(21010)
+        with pytest.raises(exceptions.InvalidReceipt):
+            itunesiap.verify('other', env=env)
+        itunesiap.verify('other', env=env)
+        assert len(server.requests) == 4
+
+        assert [response is not None for response in cache.get_many([
+            itunesiap.Request('receipt'), itunesiap.Request('unknown')], env)] == [True, False]
+
+        # a broken cache is a miss
+        memcached.stop()
+        itunesiap.verify('receipt', env=env)
+        assert len(server.requests) == 5
+
+
+def test_verify_cache_envs():
+    cache = ResponseCache(LRUCache(), ttl=60.0)
+    with FakeItunesServer(sandbox_receipts=['sandbox']) as server:
+        endpoints = server.as_endpoints()
+        review = itunesiap.env.review.clone(endpoints=endpoints, cache=cache)
+        production = itunesiap.env.production.clone(endpoints=endpoints, cache=cache)
+        assert itunesiap.verify('sandbox', env=review)
+        # the sandbox response of the review environment is not shared
+        with pytest.raises(exceptions.InvalidReceipt) as excinfo:
+            itunesiap.verify('sandbox', env=production)
+        assert excinfo.value.status == 21007
+        assert itunesiap.verify('sandbox', env=review.clone())
+        assert len(server.requests) == 3
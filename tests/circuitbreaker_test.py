@@ -0,0 +1,111 @@
+import time
+import requests
+import itunesiap
+from itunesiap.circuitbreaker import (
+    CircuitBreaker, CircuitBreakers, CLOSED, OPEN, HALF_OPEN)
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def test_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_failure_rate():
+    breaker = CircuitBreaker(
+        failure_threshold=None, failure_rate=0.75, window=4, min_calls=4)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state == CLOSED  # not enough calls
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def test_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.01)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(0.02)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()  # probe
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_outcome():
+    breaker = CircuitBreaker()
+    assert breaker.is_failure(itunesiap.exc.ItunesServerNotReachable())
+    assert breaker.is_failure(itunesiap.exc.InvalidReceipt({'status': 21005}))
+    assert not breaker.is_failure(itunesiap.exc.InvalidReceipt({'status': 21002}))
+
+
+def test_verify():
+    breakers = CircuitBreakers(failure_threshold=2, recovery_timeout=60.0)
+    env = itunesiap.env.review.clone(circuit_breaker=breakers)
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = requests.exceptions.ConnectTimeout('Timeout')
+        for _ in range(2):
+            with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+                itunesiap.verify('DummyReceipt', env=env)
+        assert mock_post.call_count == 2
+        with pytest.raises(itunesiap.exc.CircuitOpen):
+            itunesiap.verify('DummyReceipt', env=env)
+        assert mock_post.call_count == 2
+    production_url = itunesiap.Request.PRODUCTION_VALIDATION_URL
+    assert breakers.states() == {production_url: OPEN}
+    assert breakers[production_url].stats()['rejected'] == 1
+
+
+def test_deadline_not_failure():
+    def timeout_post(url, data, **kwargs):
+        time.sleep(kwargs['timeout'])
+        raise requests.exceptions.ReadTimeout('Timeout')
+
+    breakers = CircuitBreakers(failure_threshold=1, recovery_timeout=60.0)
+    env = itunesiap.env.review.clone(circuit_breaker=breakers)
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = timeout_post
+        with pytest.raises(itunesiap.exc.DeadlineExceeded):
+            itunesiap.verify('DummyReceipt', env=env, deadline=0.02)
+    production_url = itunesiap.Request.PRODUCTION_VALIDATION_URL
+    assert breakers.states() == {production_url: CLOSED}
+    assert breakers[production_url].stats()['recent_calls'] == 0
+
+
+def test_circuit_open_not_retried():
+    policy = itunesiap.retry.RetryPolicy(
+        retryable_exceptions=(itunesiap.exc.ItunesServerNotReachable,))
+    assert not policy.is_retryable(itunesiap.exc.CircuitOpen())
+    assert policy.next_delay(itunesiap.exc.CircuitOpen(), 1, itunesiap.tools.monotonic()) is None
+
+    breakers = CircuitBreakers(failure_threshold=1, recovery_timeout=60.0)
+    breakers[itunesiap.Request.PRODUCTION_VALIDATION_URL].record_failure()
+    env = itunesiap.env.review.clone(circuit_breaker=breakers, retry=policy)
+    with patch.object(requests, 'post') as mock_post, patch('time.sleep') as mock_sleep:
+        with pytest.raises(itunesiap.exc.CircuitOpen):
+            itunesiap.verify('DummyReceipt', env=env)
+        assert mock_post.call_count == 0
+        assert mock_sleep.call_count == 0
@@ -0,0 +1,126 @@
+# coding: utf-8
+import json
+import pickle
+import random
+
+import itunesiap
+from itunesiap import compact
+from itunesiap.testing import Synth
+
+import pytest
+
+
+def test_roundtrip(itunes_autorenew_response):
+    data = compact.dumps(itunes_autorenew_response)
+    assert len(data) < len(json.dumps(itunes_autorenew_response))
+    value = compact.loads(data)
+    assert isinstance(value, compact.LazyObject)
+    assert compact.materialize(value) == itunes_autorenew_response
+    assert value == itunes_autorenew_response
+
+
+@pytest.mark.parametrize('value', [
+    {'status': 0, 'int': -12345, 'big': 2 ** 70, 'float': 1.5, 'none': None,
+     'true': True, 'false': False, u'유니코드': u'값', 'empty': {}, 'list': []},
+    {'digits': ['0', '00', '012', '1234567890123456789012', '-1', '1.0', u'١٢']},
+    {'dates': [
+        '2013-01-01 00:00:00 Etc/GMT', '1969-12-31 23:59:59 Etc/GMT',
+        '2013-02-30 00:00:00 Etc/GMT', '2013-01-01 00:00:00 America/Los_Angeles',
+        # not ASCII digits
+        u'2013-01-0١ 00:00:00 Etc/GMT', u'2013-01-01 0١:00:00 Etc/GMT', u'2013-01-01 00:00:00 Etc/GMT١']},
+    [{'product_id': 'com.example.product'}] * 3,
+    'plain',
+])
+def test_values(value):
+    decoded = compact.materialize(compact.loads(compact.dumps(value)))
+    assert decoded == value
+    assert json.dumps(decoded, sort_keys=True) == json.dumps(value, sort_keys=True)
+
+
+def test_projection():
+    data = Synth(seed=0).response(in_app=3, subscriptions=1, renewals=2)
+    data['latest_receipt'] = 'A' * 1000
+    full = compact.dumps(data)
+    lean = compact.dumps(data, fields=compact.without_bloat)
+    assert len(lean) < len(full)
+    value = compact.materialize(compact.loads(lean))
+    assert 'latest_receipt' not in value
+    assert not any(key.endswith('_pst') for key in value['receipt']['in_app'][0])
+    assert value['receipt']['in_app'][0]['purchase_date_ms'] == data['receipt']['in_app'][0]['purchase_date_ms']
+
+    value = compact.materialize(compact.loads(compact.dumps(data, fields=['status', 'receipt', 'bundle_id'])))
+    assert value == {'status': 0, 'receipt': {'bundle_id': data['receipt']['bundle_id']}}
+
+
+def test_lazy():
+    data = Synth(seed=0).response(in_app=10, subscriptions=1, renewals=3)
+    response = itunesiap.Response.from_bytes(itunesiap.Response(data).to_bytes())
+    assert response.status == 0
+    receipt = response._['receipt']
+    assert receipt._items is None
+    in_app = response.receipt.in_app
+    assert len(in_app) == len(data['receipt']['in_app'])
+    assert all(purchase._._items is None for purchase in in_app)
+    assert in_app[0].product_id == data['receipt']['in_app'][0]['product_id']
+    assert in_app[0]._._items is not None
+    assert in_app[1]._._items is None
+    assert [purchase._ for purchase in response.latest_receipt_info] == data['latest_receipt_info']
+
+
+def test_response_pickle():
+    data = Synth(seed=0).response(in_app=5)
+    for response in [itunesiap.Response(data), itunesiap.Response.from_bytes(itunesiap.Response(data).to_bytes())]:
+        restored = pickle.loads(pickle.dumps(response, protocol=2))
+        assert isinstance(restored, itunesiap.Response)
+        assert restored._ == data
+    # the encoded data is reused
+    data = itunesiap.Response(data).to_bytes()
+    assert itunesiap.Response.from_bytes(data).to_bytes() is data
+    # lazy values are pickled as plain ones
+    value = compact.loads(data)
+    assert pickle.loads(pickle.dumps(value['receipt'])) == value['receipt']
+    assert type(pickle.loads(pickle.dumps(value['receipt']['in_app']))) is list
+
+
+def test_exception_pickle():
+    error = itunesiap.exc.PrecheckFailed('Too small: 3')
+    restored = pickle.loads(pickle.dumps(error, protocol=2))
+    assert type(restored) is itunesiap.exc.PrecheckFailed
+    assert (restored.reason, restored.status) == ('Too small: 3', 21002)
+
+    data = itunesiap.Response({'status': 21010, 'latest_receipt': 'receipt'}).to_bytes()
+    error = itunesiap.exc.InvalidReceipt(compact.loads(data))
+    restored = pickle.loads(pickle.dumps(error, protocol=2))
+    assert type(restored) is itunesiap.exc.InvalidReceipt
+    assert restored.status == 21010
+    assert restored._ == {'status': 21010, 'latest_receipt': 'receipt'}
+
+
+@pytest.mark.parametrize('data', [b'', b'JSON', b'IAP\x02', b'IAP\x01\x00\x00\x07\x10\x00'])
+def test_malformed(data):
+    with pytest.raises(ValueError):
+        compact.loads(data)
+
+
+def test_corrupted():
+    value = Synth(seed=0).response(in_app=5, subscriptions=1, renewals=2)
+    value['float'] = 0.5
+    data = compact.dumps(value)
+    rng = random.Random(0)
+    for _ in range(3000):
+        corrupted = bytearray(data)
+        for _ in range(rng.randint(1, 4)):
+            pos = rng.randrange(4, len(corrupted))
+            choice = rng.random()
+            if choice < 0.6:
+                corrupted[pos] = rng.randrange(256)
+            elif choice < 0.8:
+                del corrupted[pos:pos + rng.randint(1, 8)]
+            else:
+                corrupted[pos:pos] = bytearray(rng.randrange(256) for _ in range(rng.randint(1, 8)))
+        if rng.random() < 0.2:
+            corrupted = corrupted[:rng.randrange(len(corrupted))]
+        try:
+            compact.materialize(compact.loads(bytes(corrupted)))
+        except ValueError:
+            pass
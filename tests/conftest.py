@@ -1,8 +1,17 @@
 # coding: utf-8
 import json
+import datetime
 import itunesiap
+import itunesiap.legacy
 import pytest
 from pytest_lazyfixture import lazy_fixture
+from itunesiap.local import decode_legacy
+from itunesiap.testing import FakeItunesServer
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
 
 
 def _raw_receipt_legacy():
@@ -12,9 +21,45 @@ def _raw_receipt_legacy():
 raw_receipt_legacy = pytest.fixture(scope='session')(_raw_receipt_legacy)
 
 
+def _legacy_responder(tier, request_content, reply):
+    """Answer the purchase info of legacy receipts like the servers of Apple
+    did, and 21002 for the others.
+    """
+    data = {'status': reply.status}
+    if reply.status != 0:
+        return data
+    try:
+        receipt = decode_legacy(request_content.get('receipt-data') or '')
+    except ValueError:
+        return {'status': 21002}
+    data['receipt'] = dict(receipt.purchase_info._)
+    return data
+
+
+@pytest.fixture(scope='session')
+def _itunes_server():
+    server = FakeItunesServer(
+        sandbox_receipts=[_raw_receipt_legacy()], responder=_legacy_responder)
+    with server:
+        yield server
+
+
+@pytest.fixture
+def itunes_server(_itunes_server):
+    """The fake server in place of the verifyReceipt servers of Apple,
+    including the URLs of :mod:`itunesiap.legacy`.
+    """
+    server = _itunes_server
+    with server.patch(), \
+            patch.object(itunesiap.legacy, 'RECEIPT_PRODUCTION_VALIDATION_URL', server.production_url), \
+            patch.object(itunesiap.legacy, 'RECEIPT_SANDBOX_VALIDATION_URL', server.sandbox_url):
+        yield server
+
+
 @pytest.fixture(scope='session')
-def itunes_response_legacy1(raw_receipt_legacy):
-    response = itunesiap.verify(raw_receipt_legacy, env=itunesiap.env.sandbox)
+def itunes_response_legacy1(_itunes_server, raw_receipt_legacy):
+    with _itunes_server.patch():
+        response = itunesiap.verify(raw_receipt_legacy, env=itunesiap.env.sandbox)
     return getattr(response, '_')
 
 
@@ -759,3 +804,15 @@ def itunes_autorenew_response3():
 ])
 def itunes_autorenew_response(request):
     return request.param
+
+
+@pytest.fixture
+def http_response():
+    """The factory of mocked :mod:`requests` responses of the data."""
+    def http_response(data, status_code=200):
+        mock_response = Mock()
+        mock_response.content = json.dumps(data).encode('utf-8')
+        mock_response.status_code = status_code
+        mock_response.elapsed = datetime.timedelta(0)
+        return mock_response
+    return http_response
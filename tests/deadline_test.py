@@ -0,0 +1,78 @@
+import time
+import threading
+import requests
+import itunesiap
+import itunesiap.bulkhead
+from itunesiap.deadline import Deadline
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def test_deadline():
+    deadline = Deadline(10.0)
+    assert not deadline.expired
+    assert deadline.timeout(30.0) <= 10.0
+    assert deadline.timeout(1.0) == 1.0
+    assert deadline.timeout() <= 10.0
+    assert Deadline(0.0).expired
+    assert Deadline(-1.0).remaining() == 0.0
+
+
+def test_attempt_timeout_capped(http_response):
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.return_value = http_response({'status': 0})
+        itunesiap.verify('DummyReceipt', timeout=30.0, deadline=2.0)
+        assert mock_post.call_args[1]['timeout'] <= 2.0
+
+
+def test_fallback_skipped(http_response):
+    def slow_post(url, data, **kwargs):
+        time.sleep(0.05)
+        return http_response({'status': 21007})
+
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = slow_post
+        with pytest.raises(itunesiap.exc.DeadlineExceeded) as excinfo:
+            itunesiap.verify('DummyReceipt', env=itunesiap.env.review, deadline=0.01)
+        assert excinfo.value['url'] == itunesiap.Request.SANDBOX_VALIDATION_URL
+        assert mock_post.call_count == 1
+
+
+def test_timeout_in_deadline():
+    def timeout_post(url, data, **kwargs):
+        time.sleep(kwargs['timeout'])
+        raise requests.exceptions.ReadTimeout('Timeout')
+
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = timeout_post
+        with pytest.raises(itunesiap.exc.ItunesServerNotReachable) as excinfo:
+            itunesiap.verify(
+                'DummyReceipt', retry=itunesiap.retry.RetryPolicy(max_attempts=5),
+                deadline=0.05)
+        assert isinstance(excinfo.value, itunesiap.exc.DeadlineExceeded)
+
+
+def test_bulkhead_wait_in_deadline(http_response):
+    bulkhead = itunesiap.bulkhead.Bulkhead(production=1)
+    slots = bulkhead._slots['production']
+    with patch.object(requests.Session, 'post') as mock_post:
+        mock_post.return_value = http_response({'status': 0})
+        # the slot is freed after a part of the deadline
+        slots.acquire()
+        timer = threading.Timer(0.3, slots.release)
+        timer.start()
+        itunesiap.verify('DummyReceipt', timeout=30.0, deadline=0.5, bulkhead=bulkhead)
+        timer.join()
+        assert mock_post.call_args[1]['timeout'] <= 0.25
+
+        # the deadline runs out while waiting
+        slots.acquire()
+        with pytest.raises(itunesiap.exc.RequestError):
+            itunesiap.verify('DummyReceipt', timeout=30.0, deadline=0.1, bulkhead=bulkhead)
+        slots.release()
+        assert mock_post.call_count == 1
@@ -0,0 +1,101 @@
+import copy
+
+import itunesiap
+from itunesiap.delta import State, diff
+from itunesiap.testing import Synth
+
+import pytest
+
+
+def _data():
+    synth = Synth(seed=0)
+    data = synth.response(in_app=3, subscriptions=2, renewals=4)
+    return synth, data
+
+
+def test_first():
+    _, data = _data()
+    delta = itunesiap.Response(data).diff()
+    transaction_ids = set(record['transaction_id'] for record in data['receipt']['in_app'])
+    assert set(purchase.transaction_id for purchase in delta.purchases) == transaction_ids
+    assert len(delta.purchases) == len(transaction_ids)
+    assert all(isinstance(purchase, itunesiap.InApp) for purchase in delta.purchases)
+    assert len(delta.renewals) == 2
+    assert delta.state.transaction_ids == transaction_ids
+    assert delta
+
+
+def test_unchanged():
+    _, data = _data()
+    state = itunesiap.Response(data).diff().state
+    delta = itunesiap.Response(copy.deepcopy(data)).diff(state)
+    assert not delta
+    assert delta.state is state
+    # from a response
+    assert not itunesiap.Response(data).diff(itunesiap.Response(data))
+
+
+def test_changes():
+    synth, data = _data()
+    state = itunesiap.Response(data).diff().state
+
+    data = copy.deepcopy(data)
+    chain = data['latest_receipt_info']
+    renewal = dict(chain[-1], transaction_id='9' * 16, web_order_line_item_id='1')
+    # exclude_old_transactions
+    data['latest_receipt_info'] = [renewal]
+    data['receipt']['in_app'] = [renewal]
+    cancelled = dict(data['receipt']['in_app'][0], transaction_id=chain[0]['transaction_id'], cancellation_date_ms='1500000000000')
+    data['latest_receipt_info'].append(cancelled)
+    data['pending_renewal_info'][0]['auto_renew_status'] = '0' if data['pending_renewal_info'][0]['auto_renew_status'] == '1' else '1'
+
+    delta = itunesiap.Response(data).diff(state)
+    assert [purchase.transaction_id for purchase in delta.purchases] == ['9' * 16]
+    assert [purchase.transaction_id for purchase in delta.cancelled] == [chain[0]['transaction_id']]
+    assert [info['original_transaction_id'] for info in delta.renewals] == [data['pending_renewal_info'][0]['original_transaction_id']]
+    assert delta.state.transaction_ids == state.transaction_ids | {'9' * 16}
+    assert state.renewals != delta.state.renewals
+
+    # applied once
+    assert not itunesiap.Response(data).diff(delta.state)
+
+
+def test_state_layers():
+    previous = State(str(i) for i in range(10000))
+    layer = previous._transaction_ids[0]
+    state = previous
+    expected = set(previous.transaction_ids)
+    for i in range(10000, 10300):
+        data = {'status': 0, 'latest_receipt_info': [{'transaction_id': str(i)}, {'transaction_id': str(i - 1)}]}
+        state = diff(itunesiap.Response(data), state).state
+        expected.add(str(i))
+        # the history is shared, not copied
+        assert state._transaction_ids[0] is layer
+        assert len(state._transaction_ids) <= 10
+        assert len(state) == len(expected)
+    assert previous._transaction_ids == (layer,)
+    assert len(previous) == 10000
+    assert state.transaction_ids == expected
+    assert State.from_bytes(state.to_bytes()) == state
+
+
+def test_legacy():
+    data = Synth(seed=1).legacy_response(subscription=True)
+    delta = diff(itunesiap.Response(data))
+    assert [purchase.transaction_id for purchase in delta.purchases] == [data['receipt']['transaction_id']]
+
+
+def test_state_bytes():
+    _, data = _data()
+    state = itunesiap.Response(data).diff().state
+    restored = State.from_bytes(state.to_bytes())
+    assert restored == state
+    assert not itunesiap.Response(data).diff(restored)
+    with pytest.raises(ValueError):
+        State.from_bytes(itunesiap.Response({'status': 0}).to_bytes())
+    for corrupted in (b'', b'garbage', state.to_bytes()[:-3]):
+        with pytest.raises(ValueError, match='Not a state'):
+            State.from_bytes(corrupted)
+    # lazy responses
+    response = itunesiap.Response.from_bytes(itunesiap.Response(data).to_bytes())
+    assert not response.diff(state)
@@ -6,8 +6,8 @@ Test for deprecated methods to ensure they are not broken.
 import itunesiap
 
 
-def test_context(raw_receipt_legacy):
-    """Test sandbox receipts with real itunes server."""
+def test_context(raw_receipt_legacy, itunes_server):
+    """Test sandbox receipts with the fake itunes server."""
     sandbox_receipt = raw_receipt_legacy
     request = itunesiap.Request(sandbox_receipt)
 
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+import itunesiap
+from itunesiap.dispatcher import PriorityDispatcher, INTERACTIVE, BACKGROUND
+
+
+@pytest.mark.asyncio
+async def test_background_keeps_reserve():
+    dispatcher = PriorityDispatcher(capacity=3, reserved=1)
+    await dispatcher.acquire(BACKGROUND)
+    await dispatcher.acquire(BACKGROUND)
+    waiting = asyncio.ensure_future(dispatcher.acquire(BACKGROUND))
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    assert dispatcher.stats()[BACKGROUND]['queued'] == 1
+    # the reserved slot is still available for interactive requests
+    await dispatcher.acquire(INTERACTIVE)
+    assert dispatcher.in_use == 3
+    dispatcher.release()
+    dispatcher.release()
+    await waiting
+    assert dispatcher.stats()[BACKGROUND]['admitted'] == 3
+    assert dispatcher.stats()[BACKGROUND]['wait_max'] > 0.0
+
+
+@pytest.mark.asyncio
+async def test_interactive_first():
+    dispatcher = PriorityDispatcher(capacity=1, reserved=0)
+    order = []
+
+    async def run(priority, name):
+        async with dispatcher.slot(priority):
+            order.append(name)
+            await asyncio.sleep(0.001)
+
+    await dispatcher.acquire(INTERACTIVE)
+    tasks = [
+        asyncio.ensure_future(run(BACKGROUND, 'b1')),
+        asyncio.ensure_future(run(BACKGROUND, 'b2')),
+        asyncio.ensure_future(run(INTERACTIVE, 'i1')),
+    ]
+    await asyncio.sleep(0)
+    stats = dispatcher.stats()
+    assert stats[BACKGROUND]['queued'] == 2
+    assert stats[INTERACTIVE]['queued'] == 1
+    dispatcher.release()
+    await asyncio.gather(*tasks)
+    assert order == ['i1', 'b1', 'b2']
+    assert dispatcher.in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_cancel():
+    dispatcher = PriorityDispatcher(capacity=1, reserved=0)
+    await dispatcher.acquire(INTERACTIVE)
+    interactive = asyncio.ensure_future(dispatcher.acquire(INTERACTIVE))
+    background = asyncio.ensure_future(dispatcher.acquire(BACKGROUND))
+    await asyncio.sleep(0)
+    interactive.cancel()
+    await asyncio.sleep(0)
+    dispatcher.release()
+    await background
+    assert dispatcher.in_use == 1
+
+
+@pytest.mark.asyncio
+async def test_aioverify_priority():
+    from .aiohttp_test_py35 import _patch_post, _aiohttp_response
+
+    patcher, calls = _patch_post(_aiohttp_response({'status': 0}))
+    dispatcher = PriorityDispatcher(capacity=2, reserved=1)
+    env = itunesiap.env.production.clone(dispatcher=dispatcher)
+    with patcher:
+        await itunesiap.aioverify('DummyReceipt', env=env, priority=BACKGROUND)
+    stats = dispatcher.stats()
+    assert stats[BACKGROUND]['admitted'] == 1
+    assert stats[INTERACTIVE]['admitted'] == 0
+    assert stats['in_use'] == 0
@@ -0,0 +1,123 @@
+import threading
+import itunesiap
+from itunesiap.endpoint import Endpoints, EndpointPool
+from itunesiap.circuitbreaker import CircuitBreakers
+from itunesiap.testing import FakeItunesServer, Reply, Disconnect
+
+import pytest
+
+
+def test_pool_candidates():
+    pool = EndpointPool(['a', 'b', 'c'])
+    orders = [pool.candidates() for _ in range(3)]
+    assert sorted(order[0] for order in orders) == ['a', 'b', 'c']
+    with pool.track('a'), pool.track('b'):
+        assert pool.candidates()[0] == 'c'
+        with pool.track('c'), pool.track('c'):
+            assert pool.candidates()[-1] == 'c'
+    assert pool.stats()['c'] == {'outstanding': 0, 'requests': 2, 'failures': 0}
+    with pytest.raises(ValueError):
+        EndpointPool([])
+
+
+def test_endpoints():
+    endpoints = Endpoints(production=['p1', 'p2'], sandbox='s1')
+    assert endpoints['production'].urls == ('p1', 'p2')
+    assert endpoints['sandbox'].urls == ('s1',)
+    assert endpoints.tier('p2') == 'production'
+    assert endpoints.tier('s1') == 'sandbox'
+    assert endpoints.tier('unknown') is None
+
+    default = Endpoints()
+    assert default['production'].urls == (itunesiap.Request.PRODUCTION_VALIDATION_URL,)
+
+    request = itunesiap.Request('receipt')
+    env = itunesiap.env.review.clone(endpoints=endpoints)
+    assert request._tier('s1', env) == 'sandbox'
+    assert request._tier('p1', env) == 'production'
+    assert request._tier(request.SANDBOX_VALIDATION_URL) == 'sandbox'
+
+
+def test_verify_endpoints():
+    with FakeItunesServer() as server:
+        server.sandbox_receipts.add('sandbox-receipt')
+        env = itunesiap.env.review.clone(endpoints=server.as_endpoints())
+        response = itunesiap.verify('sandbox-receipt', env=env)
+        assert response._['environment'] == 'Sandbox'
+        assert [tier for tier, _ in server.requests] == ['production', 'sandbox']
+
+
+def test_balance_and_failover():
+    with FakeItunesServer() as first, FakeItunesServer() as second:
+        endpoints = Endpoints(
+            production=[first.production_url, second.production_url],
+            sandbox=[first.sandbox_url, second.sandbox_url])
+        env = itunesiap.env.production.clone(endpoints=endpoints)
+        for _ in range(4):
+            itunesiap.verify('receipt', env=env)
+        assert first.production.calls == 2
+        assert second.production.calls == 2
+
+        first.production.error_rate = 1.0
+        for _ in range(4):
+            assert itunesiap.verify('receipt', env=env).status == 0
+        assert second.production.calls == 6
+        stats = endpoints.stats()['production']
+        assert stats[first.production_url]['failures'] == first.production.calls - 2
+        assert stats[second.production_url]['failures'] == 0
+        assert all(s['outstanding'] == 0 for s in stats.values())
+        first.production.error_rate = 0.0
+
+        first.production.script(Disconnect())
+        second.production.script(Disconnect())
+        with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+            itunesiap.verify('receipt', env=env)
+
+        # every endpoint failed
+        first.production.script(Reply(http_status=503))
+        second.production.script(Reply(http_status=503))
+        with pytest.raises(itunesiap.exc.ItunesServerNotAvailable):
+            itunesiap.verify('receipt', env=env)
+
+        # no failover for invalid receipts
+        calls = first.production.calls + second.production.calls
+        first.production.script(21002)
+        second.production.script(21002)
+        with pytest.raises(itunesiap.exc.InvalidReceipt):
+            itunesiap.verify('receipt', env=env)
+        assert first.production.calls + second.production.calls == calls + 1
+
+
+def test_failover_open_circuit():
+    with FakeItunesServer() as first, FakeItunesServer() as second:
+        breakers = CircuitBreakers(failure_threshold=1, recovery_timeout=60.0)
+        endpoints = Endpoints(production=[first.production_url, second.production_url])
+        env = itunesiap.env.production.clone(endpoints=endpoints, circuit_breaker=breakers)
+        breakers.get(first.production_url).record_failure()
+        for _ in range(3):
+            itunesiap.verify('receipt', env=env)
+        assert first.production.calls == 0
+        assert second.production.calls == 3
+
+
+def test_least_outstanding():
+    with FakeItunesServer() as slow, FakeItunesServer() as fast:
+        slow.production.latency = 0.3
+        endpoints = Endpoints(production=[slow.production_url, fast.production_url])
+        env = itunesiap.env.production.clone(endpoints=endpoints)
+        threads = [
+            threading.Thread(target=itunesiap.verify, args=('receipt',), kwargs={'env': env})
+            for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert slow.production.calls == 1
+        assert fast.production.calls == 1
+        for _ in range(3):
+            slow_thread = threading.Thread(target=itunesiap.verify, args=('receipt',), kwargs={'env': env})
+            slow_thread.start()
+            threading.Event().wait(0.05)
+            itunesiap.verify('receipt', env=env)
+            slow_thread.join()
+        assert fast.production.calls >= 4
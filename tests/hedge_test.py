@@ -0,0 +1,99 @@
+import time
+import random
+import threading
+import requests
+import itunesiap
+from itunesiap.hedge import HedgePolicy
+from itunesiap.stats import LatencyWindow
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def _slow_then_fast_post(http_response, first_delay):
+    lock = threading.Lock()
+    calls = []
+
+    def post(url, data, **kwargs):
+        with lock:
+            calls.append(url)
+            n = len(calls)
+        if n == 1:
+            time.sleep(first_delay)
+            return http_response({'status': 0, 'n': 1})
+        return http_response({'status': 0, 'n': n})
+    return post, calls
+
+
+def test_latency_window():
+    window = LatencyWindow(size=100)
+    assert window.percentile(0.5) is None
+    for i in range(1, 201):
+        window.add(i)
+    assert window.count == 100
+    assert window.percentile(0.5) == 150
+    assert window.percentile(0.95) == 195
+    assert window.percentile(1.0) == 200
+
+    # the sorted samples follow the rolling window
+    rng = random.Random(0)
+    samples = []
+    window = LatencyWindow(size=50)
+    for _ in range(500):
+        seconds = rng.choice([0.1, 0.2, rng.random()])
+        samples = (samples + [seconds])[-50:]
+        window.add(seconds)
+        assert window._sorted == sorted(samples)
+        assert window.percentile(0.9) == sorted(samples)[min(len(samples) - 1, int(0.9 * len(samples) + 0.5) - 1)]
+
+
+def test_delay_for():
+    hedge = HedgePolicy(percentile=0.9, min_samples=10)
+    assert hedge.delay_for('url') is None
+    for i in range(10):
+        hedge.record('url', i / 10.0)
+    assert hedge.delay_for('url') == 0.8
+    assert HedgePolicy(delay=0.2).delay_for('url') == 0.2
+
+
+def test_rate_limit():
+    hedge = HedgePolicy(max_per_second=0.001, burst=2)
+    assert hedge.acquire()
+    assert hedge.acquire()
+    assert not hedge.acquire()
+    assert hedge.stats() == {'hedged': 2, 'suppressed': 1}
+
+
+def test_hedged_verify(http_response):
+    post, calls = _slow_then_fast_post(http_response, 0.5)
+    hedge = HedgePolicy(delay=0.01)
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = post
+        started_at = time.time()
+        response = itunesiap.verify('DummyReceipt', hedge=hedge)
+        assert time.time() - started_at < 0.5
+    assert response['n'] == 2
+    assert len(calls) == 2
+    assert hedge.stats()['hedged'] == 1
+
+
+def test_hedge_suppressed(http_response):
+    post, calls = _slow_then_fast_post(http_response, 0.05)
+    hedge = HedgePolicy(delay=0.01, max_per_second=0.001, burst=0)
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = post
+        response = itunesiap.verify('DummyReceipt', hedge=hedge)
+    assert response['n'] == 1
+    assert len(calls) == 1
+
+
+def test_hedge_transport_error():
+    hedge = HedgePolicy(delay=0.01)
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = requests.exceptions.ConnectTimeout('Timeout')
+        with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+            itunesiap.verify('DummyReceipt', hedge=hedge)
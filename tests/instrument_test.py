@@ -0,0 +1,92 @@
+import hashlib
+import requests
+import itunesiap
+from itunesiap import instrument
+from itunesiap.retry import RetryPolicy
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def test_no_observer():
+    env = itunesiap.env.production
+    assert env.observers == ()
+    assert instrument.Probe.start(env, itunesiap.Request('receipt')) is None
+    assert instrument.stage(None, instrument.DECODE) is itunesiap.tools.nullcontext
+
+
+def test_probe():
+    events = []
+    probe = instrument.Probe([instrument.Callback(events.append)], 'receipt')
+    assert probe.receipt_digest == hashlib.sha256(b'receipt').hexdigest()
+    with pytest.raises(ValueError):
+        with probe.stage(instrument.DECODE, url='url'):
+            raise ValueError
+    event, = events
+    assert event.stage == instrument.DECODE
+    assert event.url == 'url'
+    assert isinstance(event.error, ValueError)
+    assert event.duration >= 0.0
+    assert 'decode' in repr(event)
+
+
+def test_verify_events(http_response):
+    events = []
+    env = itunesiap.env.production.clone(
+        observers=[instrument.Callback(events.append)])
+    request = itunesiap.Request('receipt')
+    with patch.object(requests, 'post') as post:
+        post.return_value = http_response({'status': 0})
+        request.verify(env=env)
+    assert [e.stage for e in events] == [
+        'encode', 'request', 'download', 'decode', 'map', 'attempt', 'verify']
+    url = request.PRODUCTION_VALIDATION_URL
+    assert all(e.url == url for e in events)
+    assert events[1].http_status == 200
+    assert events[-2].attempt == 1
+    assert events[-1].status == 0
+    assert events[-1].fallback is False
+    assert events[-1].cache_hit is False
+    assert events[-1].retries == 0
+    assert events[-1].probe.receipt_digest == hashlib.sha256(b'receipt').hexdigest()
+
+
+def test_verify_events_retry_and_fallback(http_response):
+    events = []
+    env = itunesiap.env.review.clone(
+        observers=[instrument.Callback(events.append)],
+        retry=RetryPolicy(max_attempts=2, backoff=0.0, jitter=0.0))
+    request = itunesiap.Request('receipt')
+    with patch.object(requests, 'post') as post:
+        post.side_effect = [
+            http_response({}, status_code=503),
+            http_response({'status': 21007}),
+            http_response({'status': 0}),
+        ]
+        request.verify(env=env)
+    attempts = [e for e in events if e.stage == instrument.ATTEMPT]
+    assert [(e.attempt, e.status) for e in attempts] == [(1, None), (2, 21007), (1, 0)]
+    assert isinstance(attempts[0].error, itunesiap.exc.ItunesServerNotAvailable)
+    assert attempts[2].url == request.SANDBOX_VALIDATION_URL
+    verify_event = events[-1]
+    assert verify_event.stage == instrument.VERIFY
+    assert verify_event.url == request.SANDBOX_VALIDATION_URL
+    assert verify_event.fallback is True
+    assert verify_event.retries == 1
+
+
+def test_verify_events_error(http_response):
+    events = []
+    env = itunesiap.env.production.clone(
+        observers=[instrument.Callback(events.append)])
+    with patch.object(requests, 'post') as post:
+        post.return_value = http_response({'status': 21002})
+        with pytest.raises(itunesiap.exc.InvalidReceipt):
+            itunesiap.verify('receipt', env=env)
+    assert events[-1].stage == instrument.VERIFY
+    assert events[-1].status == 21002
+    assert isinstance(events[-1].error, itunesiap.exc.InvalidReceipt)
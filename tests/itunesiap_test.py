@@ -16,7 +16,7 @@ except ImportError:
     from mock import patch
 
 
-def test_sandbox_request(raw_receipt_legacy):
+def test_sandbox_request(raw_receipt_legacy, itunes_server):
     """Test sandbox receipt"""
     raw_receipt = raw_receipt_legacy
     request = itunesiap.Request(raw_receipt)
@@ -32,7 +32,7 @@ def test_sandbox_request(raw_receipt_legacy):
     assert response.status == 0
 
 
-def test_old_transaction_exclusion(raw_receipt_legacy):
+def test_old_transaction_exclusion(raw_receipt_legacy, itunes_server):
     """Test optional old transaction exclusion parameter"""
     raw_receipt = raw_receipt_legacy
     request = itunesiap.Request(raw_receipt)
@@ -97,7 +97,7 @@ def test_ssl_request_fail():
             assert type(e['exc']) == requests.exceptions.SSLError
 
 
-def test_invalid_receipt():
+def test_invalid_receipt(itunes_server):
     request = itunesiap.Request('wrong receipt')
 
     with pytest.raises(itunesiap.exc.InvalidReceipt):
@@ -118,7 +118,7 @@ def test_timeout():
         itunesiap.verify('DummyReceipt', timeout=0.0001)
 
 
-def test_shortcut(raw_receipt_legacy):
+def test_shortcut(raw_receipt_legacy, itunes_server):
     """Test shortcuts"""
     itunesiap.verify(raw_receipt_legacy, env=itunesiap.env.sandbox)
 
@@ -0,0 +1,126 @@
+import multiprocessing
+
+import itunesiap
+from itunesiap.ledger import Ledger, Binding, BloomFilter
+from itunesiap.testing import Synth
+
+import pytest
+
+
+@pytest.fixture
+def ledger(tmpdir):
+    ledger = Ledger(str(tmpdir.join('ledger.db')), capacity=10000)
+    yield ledger
+    ledger.close()
+
+
+def test_bloom(tmpdir):
+    path = str(tmpdir.join('bloom'))
+    bloom = BloomFilter(path, capacity=1000, error_rate=0.01)
+    assert bloom.created
+    keys = ['{0}'.format(1000000000 + i) for i in range(1000)]
+    assert all(bloom.add(key) for key in keys[:500])
+    bloom.update(keys[500:])
+    assert all(key in bloom for key in keys)
+    assert len(bloom) >= 990
+    false_positives = sum(str(i) in bloom for i in range(10000))
+    assert false_positives < 300
+    assert 0.005 < bloom.error_rate < 0.02
+    bloom.flush()
+
+    other = BloomFilter(path)
+    assert not other.created
+    assert (other.bits, other.hashes) == (bloom.bits, bloom.hashes)
+    assert keys[0] in other
+    other.add(u'shared')
+    assert u'shared' in bloom
+    other.close()
+    bloom.close()
+
+    memory = BloomFilter(capacity=10)
+    memory.add(b'key')
+    assert b'key' in memory and u'key' in memory
+
+    tmpdir.join('invalid').write('invalid')
+    with pytest.raises(ValueError):
+        BloomFilter(str(tmpdir.join('invalid')))
+
+
+def test_claim(ledger):
+    data = Synth(seed=0).response(in_app=5, subscriptions=1, renewals=3)
+    response = itunesiap.Response(data)
+    assert ledger.claim(response, 'alice') == []
+    assert len(ledger) == len(data['receipt']['in_app'])
+    # restoring the purchases
+    assert ledger.claim(response, 'alice') == []
+
+    record = data['receipt']['in_app'][0]
+    conflicts = ledger.claim(response.receipt, 'bob')
+    assert len(conflicts) == len(data['receipt']['in_app'])
+    assert {binding.account for binding in conflicts} == {u'alice'}
+    binding = ledger.lookup(record['transaction_id'])
+    assert binding == Binding(record['transaction_id'], record['original_transaction_id'], u'alice')
+    assert ledger.lookup('unknown') is None
+
+    # a new purchase with a replayed one
+    new = Synth(seed=1).purchase()
+    conflicts = ledger.claim([new, record], 'bob')
+    assert [binding.transaction_id for binding in conflicts] == [record['transaction_id']]
+    assert ledger.lookup(new['transaction_id']).account == u'bob'
+
+
+def test_claim_original(ledger):
+    records, _ = Synth(seed=2).subscription(3)
+    assert ledger.claim(records[:2], 'alice') == []
+    # the renewal of the subscription of alice
+    conflicts = ledger.claim(records[2:], 'bob')
+    assert conflicts == [Binding(records[0]['transaction_id'], records[0]['original_transaction_id'], u'alice')]
+    assert ledger.lookup(records[2]['transaction_id']) is None
+    assert ledger.claim(records, 'alice') == []
+    assert ledger.lookup(records[2]['transaction_id']).account == u'alice'
+
+
+def test_load(tmpdir):
+    path = str(tmpdir.join('ledger.db'))
+    ledger = Ledger(path, capacity=10000)
+    bindings = (('{0}'.format(i), '{0}'.format(i - i % 3), 'account{0}'.format(i % 7)) for i in range(5000))
+    assert ledger.load(bindings, chunk_size=1000) == 5000
+    assert ledger.load([Binding('1', '0', 'other'), ('5000', None, 'other')]) == 1
+    assert ledger.lookup('1').account == u'account1'
+    seen = ledger.lookup_many(['10', '4999', '5000', 'unknown'])
+    assert sorted(seen) == ['10', '4999', '5000']
+    ledger.close()
+
+    # the filter is rebuilt from the bindings
+    tmpdir.join('ledger.db.bloom').remove()
+    ledger = Ledger(path, capacity=10000)
+    assert ledger.bloom.created
+    assert ledger.lookup('4999').account == u'account1'
+    ledger.close()
+
+
+def _claim(path, account, transaction_ids, queue):
+    ledger = Ledger(path, capacity=10000)
+    purchases = [{'transaction_id': transaction_id} for transaction_id in transaction_ids]
+    queue.put((account, len(ledger.claim(purchases, account))))
+    ledger.close()
+
+
+def test_processes(tmpdir):
+    path = str(tmpdir.join('ledger.db'))
+    queue = multiprocessing.Queue()
+    transaction_ids = [str(i) for i in range(200)]
+    processes = [
+        multiprocessing.Process(target=_claim, args=(path, 'account{0}'.format(i), transaction_ids, queue))
+        for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    results = sorted(queue.get() for _ in processes)
+    # only one of them got the purchases
+    assert sorted(conflicts for _, conflicts in results) == [0, 200, 200, 200]
+    ledger = Ledger(path)
+    assert len(ledger) == 200
+    assert len(ledger.lookup_many(transaction_ids)) == 200
+    ledger.close()
@@ -5,6 +5,7 @@
 """
 import json
 from mock import patch
+import pytest
 import requests
 import unittest
 
@@ -15,6 +16,7 @@ from itunesiap.legacy import exceptions
 from tests.conftest import _raw_receipt_legacy as raw_receipt_legacy
 
 
+@pytest.mark.usefixtures('itunes_server')
 class TestsIAP(unittest.TestCase):
 
     def __init__(self, *args, **kwargs):
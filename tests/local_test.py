@@ -0,0 +1,267 @@
+import base64
+import datetime
+
+import itunesiap
+from itunesiap.exceptions import MalformedReceipt
+from itunesiap.local import decode_legacy, parse_plist
+
+import six
+import pytest
+import pytz
+
+
+def test_decode_legacy(raw_receipt_legacy):
+    receipt = decode_legacy(raw_receipt_legacy)
+    assert receipt.environment == 'Sandbox'
+    assert receipt.is_sandbox
+    assert receipt.signing_status == '0'
+    assert receipt.transaction_id == '1000000056161764'
+    assert receipt.product_id == 'BattleGold50'
+    purchase = receipt.purchase_info
+    assert isinstance(purchase, itunesiap.receipt.Purchase)
+    assert purchase.quantity == 1
+    assert purchase.original_transaction_id == '1000000056161764'
+    assert purchase.purchase_date == datetime.datetime(2012, 9, 21, 1, 31, 38, tzinfo=pytz.timezone('Etc/GMT'))
+    assert purchase.purchase_date_ms == 1348191098192
+
+    assert decode_legacy(raw_receipt_legacy.encode('ascii')).transaction_id == receipt.transaction_id
+
+
+def test_parse_plist():
+    assert parse_plist('(' * 32 + ')' * 32)
+    assert parse_plist(b'{ "a" = "b"; c = 1; }') == {'a': 'b', 'c': '1'}
+    assert parse_plist('(a, "b", (c,), {})') == ['a', 'b', ['c'], {}]
+    assert parse_plist('"tab\\there \\"q\\" \\U00e9 \\101"') == u'tab\there "q" é A'
+    assert parse_plist('<0fa1 ff>') == b'\x0f\xa1\xff'
+    assert parse_plist('/* comment */ {\n // line\n a = b;\n}') == {'a': 'b'}
+
+
+@pytest.mark.parametrize('data', [
+    '',
+    '{ a = b }',
+    '{ a b; }',
+    '(a b)',
+    '"unterminated',
+    '<0g>',
+    '{ a = b; } trailing',
+    '(' * 10000 + ')' * 10000,
+    '{ a = ' * 100 + 'b;' + ' }' * 100,
+])
+def test_parse_plist_malformed(data):
+    with pytest.raises(MalformedReceipt):
+        parse_plist(data)
+
+
+@pytest.mark.parametrize('data', [
+    'not base64 at all!',
+    base64.b64encode(b'\xff\xfe').decode('ascii'),
+    base64.b64encode(b'("a")').decode('ascii'),
+    base64.b64encode(b'{ "environment" = "Sandbox"; }').decode('ascii'),
+    u'가',
+])
+def test_decode_legacy_malformed(data):
+    with pytest.raises(MalformedReceipt):
+        decode_legacy(data)
+    with pytest.raises(ValueError):
+        decode_legacy(data)
+
+
+def test_decode_legacy_strict_base64(raw_receipt_legacy):
+    assert decode_legacy(raw_receipt_legacy)
+    for data in (raw_receipt_legacy[:8] + '*' + raw_receipt_legacy[8:], raw_receipt_legacy + '\n'):
+        with pytest.raises(MalformedReceipt):
+            decode_legacy(data)
+
+
+def test_decode_unified():
+    from itunesiap.local import decode_unified
+    from itunesiap.testing.appreceipt import build_receipt
+    from itunesiap.testing.synth import Synth
+
+    synth = Synth(seed=0)
+    data = synth.receipt(synth.iter_in_app(30))
+    receipt = decode_unified(build_receipt(data))
+    assert isinstance(receipt, itunesiap.Receipt)
+    assert receipt.bundle_id == data['bundle_id']
+    assert receipt.receipt_creation_date_ms == int(data['receipt_creation_date_ms'])
+    assert len(receipt.in_app) == 30
+    records = dict((record['transaction_id'], record) for record in data['in_app'])
+    for in_app in receipt.in_app:
+        expected = records[in_app.transaction_id]
+        assert isinstance(in_app, itunesiap.InApp)
+        for key in ('transaction_id', 'original_transaction_id', 'product_id', 'purchase_date_ms'):
+            assert in_app[key] == expected[key]
+        assert in_app.purchase_date == itunesiap.receipt._ms_to_datetime(expected['purchase_date_ms'])
+        assert in_app.is_trial_period == (expected['is_trial_period'] == 'true')
+        if 'expires_date_ms' in expected:
+            assert in_app.expires_date == itunesiap.receipt._ms_to_datetime(expected['expires_date_ms'])
+    assert receipt.last_in_app.transaction_id == max(
+        data['in_app'], key=lambda record: record['original_purchase_date_ms'])['transaction_id']
+
+    binary = base64.b64decode(build_receipt(data))
+    assert decode_unified(binary).bundle_id == data['bundle_id']
+
+
+@pytest.mark.parametrize('data', [
+    base64.b64encode(b'\x30\x03\x02\x01\x01').decode('ascii'),
+    base64.b64encode(b'\x30\x80\x06\x01\x01').decode('ascii'),
+    base64.b64encode(b'\x30\x05\x06\x03\x2a\x03\x04').decode('ascii'),
+    base64.b64encode(b'\x30\x84\xff\xff\xff\xff').decode('ascii'),
+    base64.b64encode(b'\x30\x80' * 5000 + b'\x00\x00' * 5000).decode('ascii'),
+    base64.b64encode(b'\x30\x03\x06\x01\x81').decode('ascii'),
+    'not base64',
+])
+def test_decode_unified_malformed(data):
+    from itunesiap.local import decode_unified
+    with pytest.raises(MalformedReceipt):
+        decode_unified(data)
+
+
+def test_decode_payload_value_types():
+    from itunesiap.local.unified import decode_payload
+    from itunesiap.testing.appreceipt import _attribute, _integer, _set, _tlv
+
+    payload = _set([_attribute(2, _tlv(0x0c, b'com.example')), _attribute(1, _integer(7))])
+    assert decode_payload(payload) == {'in_app': [], 'bundle_id': u'com.example', 'app_item_id': '7'}
+    for attribute in (
+            _attribute(2, _integer(7)),  # a string as an integer
+            _attribute(1, _tlv(0x0c, b'\x07')),  # an integer as a string
+            _attribute(12, _tlv(0x04, b'2013-01-01T00:00:00Z'))):
+        with pytest.raises(MalformedReceipt):
+            decode_payload(_set([attribute]))
+
+
+def test_asn1_limits():
+    from itunesiap.local import asn1
+    nested = b'\x24\x80' * 40 + b'\x04\x01a' + b'\x00\x00' * 40
+    with pytest.raises(MalformedReceipt):
+        asn1.read(nested)
+    nested = b'\x24\x80' * 10 + b'\x04\x01a' + b'\x00\x00' * 10
+    assert asn1.read(nested).octets() == b'a'
+    nested = b'\x04\x01a'
+    for _ in range(40):
+        nested = b'\x24\x81' + bytes(bytearray([len(nested)])) + nested
+    with pytest.raises(MalformedReceipt):
+        asn1.read(nested).octets()
+    with pytest.raises(MalformedReceipt):
+        asn1.read(b'\x06\x02\x2a\x83').oid()
+
+
+def _certificate(name, key, issuer_name=None, issuer_key=None, ca=True):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.x509.oid import NameOID
+    from itunesiap.local.pkcs7 import RECEIPT_SIGNING
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    issuer = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer_name)]) if issuer_name else subject
+    now = datetime.datetime(2020, 1, 1)
+    builder = x509.CertificateBuilder().subject_name(subject).issuer_name(issuer) \
+        .public_key(key.public_key()).serial_number(x509.random_serial_number()) \
+        .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1)) \
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True) \
+        .add_extension(x509.KeyUsage(
+            digital_signature=not ca, content_commitment=False, key_encipherment=False,
+            data_encipherment=False, key_agreement=False, key_cert_sign=ca, crl_sign=ca,
+            encipher_only=False, decipher_only=False), critical=True)
+    if not ca:
+        builder = builder.add_extension(x509.UnrecognizedExtension(
+            x509.ObjectIdentifier(RECEIPT_SIGNING), b'\x05\x00'), critical=False)
+    return builder.sign(issuer_key or key, hashes.SHA256())
+
+
+@pytest.fixture(scope='module')
+def chain():
+    pytest.importorskip('cryptography')
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    root_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    root = _certificate(u'Test Root', root_key)
+    intermediate_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    intermediate = _certificate(u'Test Intermediate', intermediate_key, u'Test Root', root_key)
+    leaf_key = ec.generate_private_key(ec.SECP256R1())
+    leaf = _certificate(u'Test Leaf', leaf_key, u'Test Intermediate', intermediate_key, ca=False)
+    return root, intermediate, leaf_key, leaf, intermediate_key
+
+
+@pytest.mark.parametrize('digest,attributes,signer', [
+    ('sha256', True, 'leaf'),
+    ('sha256', False, 'leaf'),
+    ('sha384', True, 'intermediate'),
+])
+def test_certificate_verifier(chain, digest, attributes, signer):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from itunesiap.exceptions import InvalidSignature
+    from itunesiap.local import CertificateVerifier, decode_unified, parse_signed_data
+    from itunesiap.local.pkcs7 import RECEIPT_SIGNING
+    from itunesiap.testing.appreceipt import build_receipt
+    from itunesiap.testing.synth import Synth
+
+    root, intermediate, leaf_key, leaf, intermediate_key = chain
+    if signer == 'leaf':
+        key, certificate, certificates = leaf_key, leaf, [intermediate]
+    else:
+        key, certificate, certificates = intermediate_key, intermediate, []
+    synth = Synth(seed=0)
+    data = synth.receipt(synth.iter_in_app(3))
+    receipt_data = build_receipt(
+        data, key, certificate, certificates, digest=digest, attributes=attributes)
+
+    # the intermediate has no extension of receipt signing
+    verifier = CertificateVerifier(
+        [root.public_bytes(serialization.Encoding.PEM)],
+        leaf_extension=None if signer == 'intermediate' else RECEIPT_SIGNING)
+    assert decode_unified(receipt_data, verifier=verifier).bundle_id == data['bundle_id']
+    signed_data = parse_signed_data(base64.b64decode(receipt_data))
+    assert (signed_data.signers[0].signed_attributes is not None) == attributes
+    assert signed_data.signers[0].digest_name == digest
+
+    untrusted = _certificate(u'Other Root', ec.generate_private_key(ec.SECP256R1()))
+    with pytest.raises(InvalidSignature):
+        decode_unified(receipt_data, verifier=CertificateVerifier([untrusted.public_bytes(serialization.Encoding.DER)]))
+
+    # tamper the signature
+    signature = signed_data.signers[0].signature
+    signed_data.signers[0].signature = signature[:-1] + six.int2byte(six.indexbytes(signature, -1) ^ 0xff)
+    with pytest.raises(InvalidSignature):
+        verifier(signed_data)
+    with pytest.raises(InvalidSignature):
+        decode_unified(build_receipt(data), verifier=verifier)
+
+
+def test_certificate_verifier_constraints(chain):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from itunesiap.exceptions import InvalidSignature
+    from itunesiap.local import CertificateVerifier, decode_unified
+    from itunesiap.testing.appreceipt import build_receipt
+
+    root, intermediate, leaf_key, leaf, intermediate_key = chain
+    verifier = CertificateVerifier([root.public_bytes(serialization.Encoding.PEM)])
+    data = {'bundle_id': 'test'}
+
+    # a chain signed by a leaf certificate
+    forged_key = ec.generate_private_key(ec.SECP256R1())
+    forged = _certificate(u'Forged Leaf', forged_key, u'Test Leaf', leaf_key, ca=False)
+    with pytest.raises(InvalidSignature):
+        decode_unified(build_receipt(data, forged_key, forged, [leaf, intermediate]), verifier=verifier)
+
+    # the intermediate without the extension of receipt signing
+    with pytest.raises(InvalidSignature):
+        decode_unified(build_receipt(data, intermediate_key, intermediate, []), verifier=verifier)
+
+
+def test_custom_verifier():
+    from itunesiap.exceptions import InvalidSignature
+    from itunesiap.local import decode_unified
+    from itunesiap.testing.appreceipt import build_receipt
+
+    seen = []
+
+    def verifier(signed_data):
+        seen.append(signed_data)
+        raise InvalidSignature('rejected')
+
+    with pytest.raises(InvalidSignature):
+        decode_unified(build_receipt({'bundle_id': 'test'}), verifier=verifier)
+    assert seen[0].signers == []
+    assert seen[0].content.startswith(b'\x31')
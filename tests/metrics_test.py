@@ -0,0 +1,83 @@
+import requests
+import itunesiap
+from itunesiap.metrics import Counter, Histogram, MetricsRegistry
+from itunesiap.retry import RetryPolicy
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def test_counter():
+    counter = Counter()
+    counter.inc(('a',))
+    counter.inc(('a',), 2)
+    counter.inc(('b',))
+    assert counter.get(('a',)) == 3
+    assert counter.get(('c',)) == 0
+    assert counter.total() == 4
+    assert sorted(counter.items()) == [(('a',), 3), (('b',), 1)]
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(0.5) is None
+    for i in range(1, 1001):
+        histogram.record(i / 1000.0)
+    assert histogram.count == 1000
+    assert histogram.min == 0.001
+    assert histogram.max == 1.0
+    for q in (0.5, 0.95, 0.99):
+        assert histogram.percentile(q) == pytest.approx(q, rel=histogram.growth - 1)
+    assert histogram.percentile(1.0) == 1.0
+
+    histogram.record(0.0)
+    histogram.record(1000.0)
+    snapshot = histogram.snapshot()
+    assert snapshot['min'] == 0.0
+    assert snapshot['max'] == 1000.0
+    assert snapshot['count'] == 1002
+
+
+def test_registry(http_response):
+    metrics = MetricsRegistry()
+    env = itunesiap.env.review.clone(
+        observers=[metrics],
+        retry=RetryPolicy(max_attempts=2, backoff=0.0, jitter=0.0))
+    production = itunesiap.Request.PRODUCTION_VALIDATION_URL
+    sandbox = itunesiap.Request.SANDBOX_VALIDATION_URL
+    with patch.object(requests, 'post') as post:
+        post.side_effect = [
+            http_response({}, status_code=503),
+            http_response({'status': 21007}),
+            http_response({'status': 0}),
+            http_response({'status': 0}),
+        ]
+        itunesiap.verify('receipt', env=env)
+        itunesiap.verify('receipt', env=env)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['verifications'] == 2
+    assert snapshot['fallbacks'] == 1
+    assert snapshot['fallback_rate'] == 0.5
+    assert snapshot['calls'] == {production: 3, sandbox: 1}
+    assert snapshot['retries'] == 1
+    assert snapshot['retry_rate'] == 0.25
+    assert snapshot['statuses'] == {0: 2, 21007: 1}
+    assert snapshot['errors'] == {'ItunesServerNotAvailable': 1}
+    assert snapshot['stages']['verify']['count'] == 2
+    assert snapshot['stages']['request']['count'] == 4
+    assert snapshot['stages']['decode']['count'] == 3
+
+    text = metrics.to_prometheus()
+    assert '# TYPE itunesiap_calls_total counter' in text
+    assert 'itunesiap_calls_total{endpoint="%s"} 3' % production in text
+    assert 'itunesiap_status_total{endpoint="%s",status="21007"} 1' % production in text
+    assert 'itunesiap_verifications_total{fallback="true"} 1' in text
+    assert '# TYPE itunesiap_stage_seconds summary' in text
+    assert 'itunesiap_stage_seconds_count{stage="verify"} 2' in text
+    assert 'itunesiap_stage_seconds{quantile="0.99",stage="request"}' in text
+    assert text.endswith('\n')
@@ -0,0 +1,102 @@
+import base64
+
+import itunesiap
+from itunesiap import exceptions
+from itunesiap.precheck import Precheck, LEGACY, PKCS7
+from itunesiap.testing import FakeItunesServer
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def _unified_receipt(count=3):
+    from itunesiap.testing.appreceipt import build_receipt
+    from itunesiap.testing.synth import Synth
+    synth = Synth(seed=0)
+    return build_receipt(synth.receipt(synth.iter_in_app(count)))
+
+
+def test_check_legacy(raw_receipt_legacy):
+    precheck = Precheck()
+    assert precheck.check(raw_receipt_legacy) == LEGACY
+    assert precheck.check(raw_receipt_legacy.encode('ascii')) == LEGACY
+    # line-wrapped base64
+    wrapped = '\n'.join(raw_receipt_legacy[i:i + 76] for i in range(0, len(raw_receipt_legacy), 76))
+    assert precheck.check(wrapped) == LEGACY
+    assert Precheck(decode=True).check(raw_receipt_legacy) == LEGACY
+
+
+def test_check_pkcs7():
+    receipt_data = _unified_receipt()
+    assert Precheck().check(receipt_data) == PKCS7
+    assert Precheck(decode=True).check(receipt_data) == PKCS7
+    assert Precheck(sniff=False, decode=True).check(receipt_data) == PKCS7
+
+
+@pytest.mark.parametrize(('receipt_data', 'reason'), [
+    ('wrong receipt', 'Too small'),
+    ('A' * 65, 'Not base64'),
+    ('A' * 62 + '!!', 'Not base64'),
+    ('A' * 60 + '=AAA', 'Not base64'),
+    (u'가' * 64, 'Not base64'),
+    (None, 'Not a string'),
+    (base64.b64encode(b'not a receipt' * 8).decode('ascii'), 'Unknown container'),
+    (base64.b64encode(b'\x30\x80\x06\x03\x2a\x03\x04' * 10).decode('ascii'), 'Unknown container'),
+])
+def test_check_malformed(receipt_data, reason):
+    with pytest.raises(exceptions.PrecheckFailed) as excinfo:
+        Precheck().check(receipt_data)
+    assert excinfo.value.reason.startswith(reason)
+    assert excinfo.value.status == 21002
+    assert isinstance(excinfo.value, exceptions.InvalidReceipt)
+
+
+def test_check_bounds():
+    receipt_data = base64.b64encode(b'{' * 300).decode('ascii')
+    with pytest.raises(exceptions.PrecheckFailed) as excinfo:
+        Precheck(max_size=100).check(receipt_data)
+    assert excinfo.value.reason.startswith('Too large')
+    assert Precheck(min_size=4).check(base64.b64encode(b'{}').decode('ascii')) == LEGACY
+    assert Precheck(sniff=False).check('A' * 64) is None
+
+
+def test_check_truncated(raw_receipt_legacy):
+    truncated = _unified_receipt()[:200]
+    assert Precheck().check(truncated) == PKCS7
+    with pytest.raises(exceptions.PrecheckFailed) as excinfo:
+        Precheck(decode=True).check(truncated)
+    assert excinfo.value.reason.startswith('Not decodable')
+    with pytest.raises(exceptions.PrecheckFailed):
+        Precheck(decode=True).check(raw_receipt_legacy[:200])
+
+
+def test_check_decoder_failure():
+    import itunesiap.local
+    receipt_data = _unified_receipt()
+    for error in (RuntimeError('maximum recursion depth exceeded'), IndexError('index out of range')):
+        with patch.object(itunesiap.local, 'decode_unified', side_effect=error):
+            with pytest.raises(exceptions.PrecheckFailed) as excinfo:
+                Precheck(decode=True).check(receipt_data)
+            assert excinfo.value.reason.startswith('Not decodable')
+            with pytest.raises(exceptions.PrecheckFailed):
+                Precheck(sniff=False, decode=True).check(receipt_data)
+
+
+def test_verify_precheck(raw_receipt_legacy):
+    with FakeItunesServer() as server:
+        env = itunesiap.env.review.clone(
+            endpoints=server.as_endpoints(), precheck=Precheck())
+        with pytest.raises(exceptions.PrecheckFailed):
+            itunesiap.verify('wrong receipt', env=env)
+        assert not server.requests
+
+        itunesiap.verify(raw_receipt_legacy, env=env)
+        assert len(server.requests) == 1
+
+        # bypass
+        itunesiap.verify('wrong receipt', env=env, precheck=None)
+        assert len(server.requests) == 2
@@ -0,0 +1,66 @@
+import os
+import time
+import tempfile
+import requests
+import itunesiap
+from itunesiap.ratelimit import TokenBucket, FileTokenBucket, RateLimiter
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100.0, capacity=2)
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert 0.0 < bucket.take() <= 0.01
+    assert bucket.acquire(timeout=1.0)
+    assert not TokenBucket(rate=0.001, capacity=0).acquire(timeout=0.1)
+    assert TokenBucket(rate=0.0, capacity=1).take(2) == float('inf')
+
+
+def test_file_token_bucket():
+    path = os.path.join(tempfile.mkdtemp(), 'bucket')
+    bucket1 = FileTokenBucket(path, rate=0.001, capacity=3)
+    bucket2 = FileTokenBucket(path, rate=0.001, capacity=3)
+    assert bucket1.try_acquire()
+    assert bucket2.try_acquire()
+    assert bucket1.try_acquire()
+    assert not bucket2.try_acquire()
+    assert not bucket1.try_acquire()
+
+
+def test_verify_non_blocking(http_response):
+    limiter = RateLimiter(
+        production=TokenBucket(rate=0.001, capacity=1), blocking=False)
+    env = itunesiap.env.review.clone(rate_limiter=limiter)
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.return_value = http_response({'status': 21007})
+        # production takes the only token and the sandbox has no limit
+        with pytest.raises(itunesiap.exc.InvalidReceipt):
+            itunesiap.verify('DummyReceipt', env=env)
+        assert mock_post.call_count == 2
+        with pytest.raises(itunesiap.exc.RateLimited) as excinfo:
+            itunesiap.verify('DummyReceipt', env=env)
+        assert excinfo.value['tier'] == 'production'
+        assert mock_post.call_count == 2
+
+
+def test_verify_blocking(http_response):
+    limiter = RateLimiter(production=TokenBucket(rate=50.0, capacity=1))
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.return_value = http_response({'status': 0})
+        started_at = time.time()
+        for _ in range(3):
+            itunesiap.verify('DummyReceipt', rate_limiter=limiter)
+        assert time.time() - started_at >= 0.03
+    with pytest.raises(itunesiap.exc.RateLimited):
+        itunesiap.verify(
+            'DummyReceipt', rate_limiter=RateLimiter(
+                production=TokenBucket(rate=1.0, capacity=0.5)),
+            deadline=0.1)
@@ -0,0 +1,77 @@
+import requests
+import itunesiap
+from itunesiap.retry import RetryPolicy
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+@pytest.fixture
+def no_sleep():
+    with patch('time.sleep') as mock_sleep:
+        yield mock_sleep
+
+
+def test_retryable():
+    policy = RetryPolicy()
+    assert policy.is_retryable(itunesiap.exc.InvalidReceipt({'status': 21005}))
+    assert policy.is_retryable(itunesiap.exc.InvalidReceipt({'status': 21150}))
+    assert policy.is_retryable(
+        itunesiap.exc.InvalidReceipt({'status': 21009, 'is-retryable': True}))
+    assert not policy.is_retryable(itunesiap.exc.InvalidReceipt({'status': 21002}))
+    assert policy.is_retryable(itunesiap.exc.ItunesServerNotReachable())
+    assert policy.is_retryable(itunesiap.exc.ItunesServerNotAvailable(500, ''))
+
+
+def test_delay():
+    policy = RetryPolicy(backoff=1.0, multiplier=2.0, max_backoff=3.0, jitter=0.0)
+    assert [policy.delay(n) for n in (1, 2, 3)] == [1.0, 2.0, 3.0]
+    policy = RetryPolicy(backoff=1.0, jitter=0.5)
+    for _ in range(100):
+        assert 0.5 <= policy.delay(1) <= 1.0
+
+
+def test_next_delay():
+    policy = RetryPolicy(max_attempts=2, backoff=1.0, jitter=0.0, deadline=5.0)
+    error = itunesiap.exc.ItunesServerNotReachable()
+    started_at = itunesiap.tools.monotonic()
+    assert policy.next_delay(error, 1, started_at) == 1.0
+    assert policy.next_delay(error, 2, started_at) is None
+    assert policy.next_delay(error, 1, started_at - 4.5) is None
+
+
+def test_retry_status(no_sleep, http_response):
+    env = itunesiap.env.production.clone(retry=RetryPolicy(max_attempts=3))
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = [
+            http_response({'status': 21005}),
+            http_response({'status': 0}),
+        ]
+        response = itunesiap.verify('DummyReceipt', env=env)
+        assert response.status == 0
+        assert mock_post.call_count == 2
+        # the request body is encoded only once
+        assert mock_post.call_args_list[0][0][1] is mock_post.call_args_list[1][0][1]
+    assert no_sleep.call_count == 1
+
+
+def test_retry_exhausted(no_sleep):
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.side_effect = requests.exceptions.ConnectTimeout('Timeout')
+        with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+            itunesiap.verify('DummyReceipt', retry=RetryPolicy(max_attempts=3))
+        assert mock_post.call_count == 3
+    assert no_sleep.call_count == 2
+
+
+def test_no_retry_for_invalid_receipt(no_sleep, http_response):
+    with patch.object(requests, 'post') as mock_post:
+        mock_post.return_value = http_response({'status': 21002})
+        with pytest.raises(itunesiap.exc.InvalidReceipt):
+            itunesiap.verify('DummyReceipt', retry=RetryPolicy())
+        assert mock_post.call_count == 1
+    assert no_sleep.call_count == 0
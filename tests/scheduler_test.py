@@ -0,0 +1,10 @@
+import sys
+
+if sys.version_info[:2] >= (3, 5):
+    from .scheduler_test_py35 import *  # noqa
+else:
+    import pytest
+
+    @pytest.mark.skip
+    def test_no_asyncio_supported_version():
+        pass
@@ -0,0 +1,197 @@
+import time
+import asyncio
+
+import pytest
+import itunesiap
+from itunesiap.ratelimit import TokenBucket
+from itunesiap.request import Request
+from itunesiap.scheduler import RefreshScheduler, next_refresh
+from itunesiap.testing import FakeItunesServer, Synth
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+DAY = 86400.0
+
+
+def _subscription(expires_at, **renewal_info):
+    records, pending = Synth(seed=0).subscription(2, start_ms=int((expires_at - 60 * DAY) * 1000))
+    records[-1]['expires_date_ms'] = str(int(expires_at * 1000))
+    pending.update(renewal_info)
+    return {
+        'status': 0, 'latest_receipt': 'latest',
+        'latest_receipt_info': records, 'pending_renewal_info': [pending]}
+
+
+def test_next_refresh():
+    now = 1500000000.0
+    assert next_refresh(_subscription(now + DAY), now) == now + DAY + 60.0
+    # billing retry with and without the grace period
+    retrying = _subscription(now - DAY, is_in_billing_retry_period='1')
+    assert next_refresh(retrying, now) == now + 3600.0
+    retrying['pending_renewal_info'][0]['grace_period_expires_date_ms'] = str(int((now + 600) * 1000))
+    assert next_refresh(retrying, now, margin=0.0) == now + 600
+    # expired
+    assert next_refresh(_subscription(now - DAY, auto_renew_status='1'), now, retry_interval=10.0) == now + 10.0
+    assert next_refresh(_subscription(now - DAY, auto_renew_status='0'), now) is None
+    # the earliest one
+    data = _subscription(now + DAY)
+    other = _subscription(now + 2 * DAY)
+    for record in other['latest_receipt_info']:
+        record['original_transaction_id'] = 'other'
+    data['latest_receipt_info'] += other['latest_receipt_info']
+    assert next_refresh(itunesiap.Response(data), now) == now + DAY + 60.0
+    # not a subscription
+    assert next_refresh(Synth(seed=0).response(subscriptions=0), now) is None
+
+
+def test_schedule(tmpdir):
+    path = str(tmpdir.join('refresh.db'))
+    scheduler = RefreshScheduler(path)
+    now = float(int(time.time()))
+    assert scheduler.ingest('alice', _subscription(now + DAY), password='secret') == now + DAY + 60.0
+    scheduler.schedule(u'bob', 'receipt', now + 10)
+    assert scheduler.ingest('carol', _subscription(now - DAY, auto_renew_status='0'), 'receipt') is None
+    assert 'carol' not in scheduler
+    with pytest.raises(ValueError):
+        scheduler.ingest('dave', {'status': 0})
+    scheduler.close()
+
+    # restored
+    scheduler = RefreshScheduler(path)
+    assert len(scheduler) == 2
+    assert scheduler.due_at('alice') == now + DAY + 60.0
+    assert scheduler._entries['alice'].password == 'secret'
+    scheduler.unschedule('bob')
+    assert scheduler.due_at('bob') is None
+    assert len(RefreshScheduler(path)) == 1
+
+
+@pytest.mark.asyncio
+async def test_run(tmpdir):
+    now = time.time()
+    responses = []
+    errors = []
+    synth = Synth(seed=0, period_ms=30 * 86400 * 1000, start_ms=int((now - 45 * DAY) * 1000))
+
+    with FakeItunesServer(responder=synth.responder(in_app=0, subscriptions=1, renewals=1, billing_retry_ratio=0.0)) as server:
+        env = itunesiap.env.production.clone(endpoints=server.as_endpoints())
+        scheduler = RefreshScheduler(
+            str(tmpdir.join('refresh.db')), env=env, concurrency=2,
+            budget=TokenBucket(rate=1000.0, capacity=5),
+            on_response=lambda key, response: responses.append(key),
+            on_error=lambda key, error: errors.append((key, error)),
+            error_delay=3600.0)
+        for i in range(8):
+            scheduler.schedule('user{0}'.format(i), 'receipt{0}'.format(i), now - i)
+        scheduler.schedule('later', 'receipt', now + DAY)
+
+        task = asyncio.ensure_future(scheduler.run())
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if len(responses) == 8:
+                break
+        scheduler.stop()
+        await task
+
+    assert sorted(responses) == sorted('user{0}'.format(i) for i in range(8))
+    assert scheduler.refreshed == 8
+    # rescheduled by the responses
+    assert all(scheduler.due_at('user{0}'.format(i)) > now for i in range(8))
+    assert scheduler.due_at('later') == now + DAY
+    assert errors == []
+    assert len(server.requests) == 8
+
+
+@pytest.mark.asyncio
+async def test_errors():
+    now = time.time()
+    errors = []
+    with FakeItunesServer() as server:
+        env = itunesiap.env.production.clone(endpoints=server.as_endpoints())
+        scheduler = RefreshScheduler(
+            env=env, concurrency=1, error_delay=60.0,
+            on_error=lambda key, error: errors.append((key, error)))
+        scheduler.schedule('invalid', 'receipt', now - 1)
+        scheduler.schedule('retryable', 'receipt', now)
+        server.production.script(21010, 21005)
+        task = asyncio.ensure_future(scheduler.run())
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if len(errors) == 2:
+                break
+        scheduler.stop()
+        await task
+    assert sorted(key for key, _ in errors) == ['invalid', 'retryable']
+    assert 'invalid' not in scheduler
+    assert scheduler.due_at('retryable') >= now + 60.0
+    assert scheduler.failed == 2
+
+
+@pytest.mark.asyncio
+async def test_unexpected_error():
+    errors = []
+
+    async def aioverify(self, **options):
+        raise ConnectionResetError()
+
+    scheduler = RefreshScheduler(error_delay=60.0, on_error=lambda key, error: errors.append((key, error)))
+    scheduler.schedule('user', 'receipt', time.time())
+    with patch.object(Request, 'aioverify', aioverify):
+        task = asyncio.ensure_future(scheduler.run())
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if errors:
+                break
+        scheduler.stop()
+        await asyncio.wait_for(task, 5.0)
+    assert [key for key, _ in errors] == ['user']
+    assert isinstance(errors[0][1], ConnectionResetError)
+    assert scheduler.due_at('user') >= time.time() + 50.0
+    assert scheduler.failed == 1
+
+
+@pytest.mark.asyncio
+async def test_unscheduled_before_start():
+    responses = []
+
+    async def aioverify(self, **options):
+        return itunesiap.Response(_subscription(time.time() + DAY))
+
+    scheduler = RefreshScheduler(on_response=lambda key, response: responses.append(key))
+    scheduler.schedule('user', 'receipt', time.time())
+    next_due = scheduler._next
+
+    async def unscheduling_next():
+        due = await next_due()
+        if due is not None:
+            scheduler.unschedule(due[0])
+        return due
+
+    scheduler._next = unscheduling_next
+    with patch.object(Request, 'aioverify', aioverify):
+        task = asyncio.ensure_future(scheduler.run())
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if responses:
+                break
+        scheduler.stop()
+        await asyncio.wait_for(task, 5.0)
+    assert responses == ['user']
+    assert 'user' not in scheduler
+
+
+@pytest.mark.asyncio
+async def test_callback_error():
+    with FakeItunesServer() as server:
+        env = itunesiap.env.production.clone(endpoints=server.as_endpoints())
+
+        async def on_response(key, response):
+            raise RuntimeError(key)
+
+        scheduler = RefreshScheduler(env=env, on_response=on_response)
+        scheduler.schedule('user', 'receipt', time.time())
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(scheduler.run(), 5.0)
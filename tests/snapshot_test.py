@@ -0,0 +1,110 @@
+import os
+import time
+
+import itunesiap
+from itunesiap.snapshot import (
+    SnapshotBuilder, Snapshot, SnapshotReader, Entitlement,
+    ACTIVE, GRACE, BILLING_RETRY, REVOKED, NEVER)
+from itunesiap.testing import Synth
+
+import pytest
+
+DAY_MS = 86400 * 1000
+
+
+def test_snapshot(tmpdir):
+    path = str(tmpdir.join('entitlements'))
+    builder = SnapshotBuilder()
+    for i in range(1000):
+        builder.add('user{0}'.format(i), 'com.example.premium', expires_ms=i * 1000)
+        if i % 3 == 0:
+            builder.add(i, u'com.example.상품')
+    builder.add('user1', 'com.example.premium', expires_ms=5000, state=REVOKED)
+    builder.write(path)
+    assert not tmpdir.join('entitlements.{0}.tmp'.format(os.getpid())).exists()
+
+    snapshot = Snapshot(path)
+    assert len(snapshot) == 1334
+    assert sorted(snapshot.products) == ['com.example.premium', u'com.example.상품']
+    assert snapshot.lookup('user5', 'com.example.premium') == Entitlement('com.example.premium', 5000, ACTIVE)
+    assert snapshot.lookup('user1', 'com.example.premium').state == REVOKED
+    assert snapshot.lookup(u'user5', 'com.example.unknown') is None
+    assert snapshot.lookup('unknown', 'com.example.premium') is None
+    assert snapshot.lookup(3, u'com.example.상품').expires_ms == NEVER
+    assert snapshot.entitled('user5', 'com.example.premium', now_ms=4999)
+    assert not snapshot.entitled('user5', 'com.example.premium', now_ms=5000)
+    assert not snapshot.entitled('user1', 'com.example.premium', now_ms=0)
+    assert snapshot.entitled(999, u'com.example.상품')
+    assert [entitlement.product_id for entitlement in snapshot.entitlements('3')] == [u'com.example.상품']
+    assert snapshot.entitlements('unknown') == []
+    snapshot.close()
+
+    tmpdir.join('invalid').write('invalid' * 10)
+    with pytest.raises(ValueError):
+        Snapshot(str(tmpdir.join('invalid')))
+
+
+def test_empty(tmpdir):
+    path = str(tmpdir.join('entitlements'))
+    SnapshotBuilder().write(path)
+    snapshot = Snapshot(path)
+    assert len(snapshot) == 0
+    assert snapshot.lookup('user', 'product') is None
+
+
+def test_add_response():
+    synth = Synth(seed=0)
+    now_ms = synth.start_ms + 100 * DAY_MS
+    active, _ = synth.subscription(3, product_id='com.example.active', start_ms=now_ms - 65 * DAY_MS)
+    retrying, retrying_info = synth.subscription(
+        1, product_id='com.example.retrying', start_ms=now_ms - 40 * DAY_MS, billing_retry=True)
+    cancelled, _ = synth.subscription(2, product_id='com.example.cancelled', cancelled=True)
+    purchase = synth.purchase()
+    data = synth.response(in_app=0, subscriptions=0)
+    data['receipt']['in_app'] = [purchase]
+    data['latest_receipt_info'] = active + retrying + cancelled
+    retrying_info['grace_period_expires_date_ms'] = str(now_ms + DAY_MS)
+    data['pending_renewal_info'] = [retrying_info]
+
+    builder = SnapshotBuilder()
+    assert builder.add_response('user', itunesiap.Response(data)) == 4
+    retrying_info['grace_period_expires_date_ms'] = None
+    builder.add_response('no-grace', data)
+    entitlements = {}
+    for record in builder._records:
+        key, code, expires_ms, state = builder.RECORD.unpack(record)
+        entitlements[key, builder._products[builder.CODE.unpack(code)[0]]] = expires_ms, state
+    user = itunesiap.snapshot.user_key('user')
+    assert entitlements[user, 'com.example.active'] == (int(active[-1]['expires_date_ms']), ACTIVE)
+    assert entitlements[user, 'com.example.retrying'] == (now_ms + DAY_MS, GRACE)
+    assert entitlements[user, 'com.example.cancelled'] == (int(cancelled[-1]['expires_date_ms']), REVOKED)
+    assert entitlements[user, purchase['product_id']] == (NEVER, ACTIVE)
+    no_grace = itunesiap.snapshot.user_key('no-grace')
+    assert entitlements[no_grace, 'com.example.retrying'][1] == BILLING_RETRY
+
+    legacy = synth.legacy_response(subscription=True)
+    builder.add_response('legacy', legacy)
+    assert builder.RECORD.unpack(builder._records[-1])[2] == int(legacy['receipt']['expires_date'])
+
+
+def test_reader_swap(tmpdir):
+    path = str(tmpdir.join('entitlements'))
+    builder = SnapshotBuilder()
+    builder.add('user', 'com.example.old')
+    builder.write(path)
+    reader = SnapshotReader(path, check_interval=0.0)
+    old = reader.snapshot
+    assert reader.entitled('user', 'com.example.old')
+    assert not reader.reload()
+
+    builder = SnapshotBuilder()
+    builder.add('user', 'com.example.new')
+    time.sleep(0.01)
+    builder.write(path)
+    assert reader.entitled('user', 'com.example.new')
+    assert reader.snapshot is not old
+    assert not reader.entitled('user', 'com.example.old')
+    # the old one is still usable
+    assert old.entitled('user', 'com.example.old')
+    assert [entitlement.product_id for entitlement in reader.entitlements('user')] == ['com.example.new']
+    assert reader.lookup('user', 'com.example.new').state == ACTIVE
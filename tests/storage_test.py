@@ -0,0 +1,119 @@
+import threading
+
+import itunesiap
+from itunesiap import storage
+from itunesiap.storage import PurchaseStore
+from itunesiap.testing import Synth
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = PurchaseStore(str(tmpdir.join('purchases.db')), chunk_size=50)
+    yield store
+    store.close()
+
+
+def test_write(store):
+    synth = Synth(seed=0)
+    data = [synth.response(in_app=5, subscriptions=2, renewals=6) for _ in range(20)]
+    responses = [itunesiap.Response(item) for item in data]
+    stats = store.write(iter(responses))
+    purchases = sum(len(item['receipt']['in_app']) for item in data)
+    assert stats.responses == 20
+    assert stats.purchases == purchases
+    assert stats.renewals == 40
+    assert stats.transactions > 1
+    assert stats.purchases_per_second > 0
+
+    # idempotent
+    store.write(responses)
+    assert store._connections().execute('SELECT COUNT(*) FROM purchases').fetchone()[0] == purchases
+
+    record = data[0]['receipt']['in_app'][0]
+    purchase = store.get(record['transaction_id'])
+    assert isinstance(purchase, itunesiap.receipt.InApp)
+    assert purchase.product_id == record['product_id']
+    assert purchase.purchase_date == itunesiap.receipt.InApp(record).purchase_date
+    assert purchase['bundle_id'] == data[0]['receipt']['bundle_id']
+    assert purchase['environment'] == 'Production'
+    assert store.get('unknown') is None
+
+
+def test_latest(store):
+    synth = Synth(seed=1)
+    chains = [synth.subscription(renewals) for renewals in (1, 3, 7)]
+    data = synth.response(in_app=0, subscriptions=0)
+    data['latest_receipt_info'] = [record for records, _ in chains for record in records]
+    data['pending_renewal_info'] = [pending for _, pending in chains]
+    store.write(itunesiap.Response(data))
+
+    ids = [records[0]['original_transaction_id'] for records, _ in chains]
+    latest = store.latest_many(ids + ['unknown'])
+    assert set(latest) == set(ids)
+    for records, pending in chains:
+        original_transaction_id = records[0]['original_transaction_id']
+        assert latest[original_transaction_id].transaction_id == records[-1]['transaction_id']
+        assert store.latest(original_transaction_id).expires_date == itunesiap.receipt.InApp(records[-1]).expires_date
+        history = store.history(original_transaction_id)
+        assert [purchase.transaction_id for purchase in history] == [record['transaction_id'] for record in records]
+        info = store.renewal_info(original_transaction_id)
+        assert info.auto_renew_status == int(pending['auto_renew_status'])
+    assert store.latest('unknown') is None
+
+
+def test_renewals_chunk(store):
+    synth = Synth(seed=5)
+    responses = [
+        itunesiap.Response({'status': 0, 'pending_renewal_info': [synth.subscription(1)[1] for _ in range(5)]})
+        for _ in range(20)]
+    stats = store.write(responses)
+    assert stats.renewals == 100
+    # the renewal infos fill the transactions too
+    assert stats.transactions > 1
+
+
+@pytest.mark.parametrize('version', [None, (3, 23, 0)])
+def test_partial_update(tmpdir, version):
+    if version is None:
+        store = PurchaseStore(str(tmpdir.join('purchases.db')))
+    else:
+        # without UPSERT
+        with patch.object(storage.sqlite3, 'sqlite_version_info', version):
+            store = PurchaseStore(str(tmpdir.join('purchases.db')))
+        assert len(store._upsert_purchase) == 2
+    records, _ = Synth(seed=2).subscription(1)
+    record = records[0]
+    store.write(itunesiap.Response({'status': 0, 'latest_receipt_info': [record]}))
+    cancelled = dict(record, cancellation_date_ms='1500000000000', cancellation_reason='1')
+    del cancelled['product_id']
+    store.write(itunesiap.Response({'status': 0, 'latest_receipt_info': cancelled}))
+    purchase = store.get(record['transaction_id'])
+    assert purchase.product_id == record['product_id']
+    assert purchase.cancellation_reason == 1
+    assert store._connections().execute('SELECT COUNT(*) FROM purchases').fetchone()[0] == 1
+    store.close()
+
+
+def test_legacy(store):
+    data = {'status': 0, 'receipt': Synth(seed=3).legacy_receipt(subscription=True)}
+    store.write(itunesiap.Response(data))
+    purchase = store.get(data['receipt']['transaction_id'])
+    assert purchase.original_transaction_id == data['receipt']['original_transaction_id']
+
+
+def test_threads(store):
+    synth = Synth(seed=4)
+    batches = [[itunesiap.Response(synth.response(in_app=10, subscriptions=0)) for _ in range(10)] for _ in range(4)]
+    threads = [threading.Thread(target=store.write, args=(batch,)) for batch in batches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store._connections().execute('SELECT COUNT(*) FROM purchases').fetchone()[0] == 400
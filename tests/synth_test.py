@@ -0,0 +1,71 @@
+import json
+
+import itunesiap
+from itunesiap.testing import FakeItunesServer, Reply
+from itunesiap.testing.synth import Synth
+
+
+def test_deterministic():
+    assert Synth(seed=1).response(in_app=20, subscriptions=5) == Synth(seed=1).response(in_app=20, subscriptions=5)
+    assert Synth(seed=1).response() != Synth(seed=2).response()
+    records = list(Synth(seed=3).iter_in_app(1000))
+    assert len(records) == 1000
+    assert len(set(record['transaction_id'] for record in records)) == 1000
+
+
+def test_subscription_chain():
+    synth = Synth(seed=0)
+    records, pending = synth.subscription(5, trial=True, cancelled=True)
+    assert len(records) == 5
+    assert len(set(record['original_transaction_id'] for record in records)) == 1
+    assert records[0]['is_trial_period'] == 'true'
+    assert records[1]['is_trial_period'] == 'false'
+    for previous, record in zip(records, records[1:]):
+        assert previous['expires_date_ms'] == record['purchase_date_ms']
+    assert 'cancellation_date_ms' in records[-1]
+    assert pending['auto_renew_status'] == '0'
+
+    records, pending = synth.subscription(2, billing_retry=True)
+    assert pending['is_in_billing_retry_period'] == '1'
+    assert pending['expiration_intent'] == '2'
+    assert int(pending['grace_period_expires_date_ms']) > int(records[-1]['expires_date_ms'])
+    _, pending = synth.subscription(0, billing_retry=True)
+    assert 'grace_period_expires_date_ms' not in pending
+
+    in_app = itunesiap.receipt.InApp(records[-1])
+    assert in_app.expires_date == itunesiap.receipt._ms_to_datetime(records[-1]['expires_date_ms'])
+    assert in_app.purchase_date == itunesiap.receipt._ms_to_datetime(records[-1]['purchase_date_ms'])
+
+
+def test_response():
+    data = Synth(seed=0).response(in_app=10, subscriptions=3, renewals=4)
+    response = itunesiap.Response(data)
+    assert response.status == 0
+    assert len(response.pending_renewal_info) == 3
+    latest = response.latest_receipt_info
+    assert isinstance(latest, list)
+    assert len(response.receipt.in_app) == 10 + len(latest)
+    purchase_dates = [in_app.purchase_date for in_app in response.receipt.in_app]
+    assert purchase_dates == sorted(purchase_dates)
+
+    legacy = itunesiap.Response(Synth(seed=0).legacy_response(subscription=True))
+    assert isinstance(legacy.latest_receipt_info, itunesiap.receipt.Purchase)
+    assert legacy.receipt.expires_date == legacy.latest_receipt_info.expires_date
+
+
+def test_responder():
+    responder = Synth(seed=0).responder(in_app=50, subscriptions=2)
+    with FakeItunesServer(responder=responder) as server:
+        response = server.bind(itunesiap.Request('receipt-a')).verify()
+        assert len(response.receipt.in_app) >= 52
+        assert response.receipt['receipt_type'] == 'Production'
+        again = server.bind(itunesiap.Request('receipt-a')).verify()
+        assert again._ == response._
+        other = server.bind(itunesiap.Request('receipt-b')).verify()
+        assert other._ != response._
+
+    data = responder('sandbox', {'receipt-data': 'receipt-a'}, Reply(0))
+    assert data['environment'] == 'Sandbox'
+    assert data['receipt']['receipt_type'] == 'ProductionSandbox'
+    assert responder('production', None, Reply(21002)) == {'status': 21002, 'environment': 'Production'}
+    json.dumps(data)
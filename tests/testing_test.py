@@ -0,0 +1,112 @@
+import json
+import random
+import itunesiap
+from itunesiap.retry import RetryPolicy
+from itunesiap.testing import (
+    FakeItunesServer, Reply, Timeout, Disconnect, constant, uniform, lognormal)
+from itunesiap.tools import monotonic
+
+import pytest
+
+
+@pytest.fixture
+def server():
+    with FakeItunesServer(seed=0) as server:
+        yield server
+
+
+def test_latency_distributions():
+    rng = random.Random(0)
+    assert constant(0.5)(rng) == 0.5
+    assert all(0.1 <= uniform(0.1, 0.2)(rng) <= 0.2 for _ in range(100))
+    samples = sorted(lognormal(0.1, 0.5)(rng) for _ in range(1001))
+    assert 0.08 < samples[500] < 0.12
+
+
+def test_verify(server):
+    request = server.bind(itunesiap.Request('receipt', password='secret'))
+    response = request.verify()
+    assert response.status == 0
+    assert response.receipt.in_app[0].product_id == 'org.youknowone.itunesiap.product'
+    assert list(server.requests) == [('production', request.request_content)]
+    assert server.production.calls == 1
+
+
+def test_max_requests():
+    with FakeItunesServer(max_requests=2) as server:
+        request = server.bind(itunesiap.Request('receipt'))
+        for _ in range(3):
+            request.verify()
+        assert len(server.requests) == 2
+        assert server.production.calls == 3
+    with FakeItunesServer(max_requests=0) as server:
+        server.bind(itunesiap.Request('receipt')).verify()
+        assert not server.requests
+        assert server.production.calls == 1
+
+
+def test_sandbox_fallback(server):
+    server.sandbox_receipts.add('sandbox-receipt')
+    with server.patch():
+        response = itunesiap.verify('sandbox-receipt', env=itunesiap.env.review)
+        assert response.status == 0
+        assert [tier for tier, _ in server.requests] == ['production', 'sandbox']
+        with pytest.raises(itunesiap.exc.InvalidReceipt) as excinfo:
+            itunesiap.verify('sandbox-receipt', env=itunesiap.env.production)
+        assert excinfo.value.status == 21007
+    assert itunesiap.Request.PRODUCTION_VALIDATION_URL == 'https://buy.itunes.apple.com/verifyReceipt'
+
+
+def test_scripted_outcomes(server):
+    request = server.bind(itunesiap.Request('receipt'))
+    server.production.script(
+        21005, Reply(http_status=503), Disconnect(), Timeout(), Reply(status=21002),
+        Reply(status=21005, is_retryable=True))
+    with pytest.raises(itunesiap.exc.InvalidReceipt) as excinfo:
+        request.verify()
+    assert excinfo.value.status == 21005
+    with pytest.raises(itunesiap.exc.ItunesServerNotAvailable) as excinfo:
+        request.verify()
+    assert type(excinfo.value) is itunesiap.exc.ItunesServerNotAvailable
+    with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+        request.verify()
+    started_at = monotonic()
+    with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+        request.verify(timeout=0.2)
+    assert monotonic() - started_at < 1.0
+    with pytest.raises(itunesiap.exc.InvalidReceipt) as excinfo:
+        request.verify()
+    assert excinfo.value.status == 21002
+    with pytest.raises(itunesiap.exc.InvalidReceipt) as excinfo:
+        request.verify()
+    assert excinfo.value.is_retryable
+
+
+def test_retry_against_server(server):
+    request = server.bind(itunesiap.Request('receipt'))
+    server.production.script(Reply(http_status=503), 21005)
+    retry = RetryPolicy(max_attempts=3, backoff=0.0, jitter=0.0)
+    assert request.verify(retry=retry).status == 0
+    assert server.production.calls == 3
+
+
+def test_latency_and_body_size():
+    with FakeItunesServer(latency=constant(0.05), body_size=100000) as server:
+        request = server.bind(itunesiap.Request('receipt'))
+        started_at = monotonic()
+        response = request.verify()
+        assert monotonic() - started_at >= 0.05
+        assert len(json.dumps(response._)) >= 100000
+        assert len(response.receipt.in_app) > 100
+
+
+def test_faults():
+    with FakeItunesServer(seed=1) as server:
+        server.production.error_rate = 1.0
+        request = server.bind(itunesiap.Request('receipt'))
+        with pytest.raises(itunesiap.exc.ItunesServerNotAvailable):
+            request.verify()
+        server.production.error_rate = 0.0
+        server.production.timeout_rate = 1.0
+        with pytest.raises(itunesiap.exc.ItunesServerNotReachable):
+            request.verify(timeout=0.1)
@@ -0,0 +1,112 @@
+import hashlib
+import requests
+import itunesiap
+from itunesiap.tracing import Tracer, InMemoryExporter, OpenTelemetryExporter
+from itunesiap.retry import RetryPolicy
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def _verify_with_fallback(http_response, tracer):
+    env = itunesiap.env.review.clone(
+        observers=[tracer],
+        retry=RetryPolicy(max_attempts=2, backoff=0.0, jitter=0.0))
+    with patch.object(requests, 'post') as post:
+        post.side_effect = [
+            http_response({}, status_code=503),
+            http_response({'status': 21007}),
+            http_response({'status': 0}),
+        ]
+        itunesiap.verify('receipt', env=env)
+
+
+def test_span_tree(http_response):
+    exporter = InMemoryExporter()
+    _verify_with_fallback(http_response, Tracer(exporter))
+
+    root, = exporter.roots
+    assert root.name == 'itunesiap.verify'
+    assert root.parent is None
+    assert root.attributes['itunesiap.status'] == 0
+    assert root.attributes['itunesiap.fallback'] is True
+    assert root.attributes['itunesiap.retries'] == 1
+    assert root.attributes['itunesiap.receipt_digest'] == hashlib.sha256(b'receipt').hexdigest()
+
+    attempts = [span for span in root.walk() if span.name == 'itunesiap.attempt']
+    assert [(span.attributes['itunesiap.tier'], span.attributes['itunesiap.attempt'])
+            for span in attempts] == [('production', 1), ('production', 2), ('sandbox', 1)]
+    assert attempts[0].attributes['error.type'] == 'ItunesServerNotAvailable'
+    assert attempts[1].attributes['itunesiap.status'] == 21007
+    assert attempts[2].attributes['itunesiap.status'] == 0
+    assert all(span.parent is root for span in attempts)
+
+    decodes = [span for span in root.walk() if span.name == 'itunesiap.decode']
+    assert [span.parent for span in decodes] == attempts[1:]
+    encodes = [span for span in root.walk() if span.name == 'itunesiap.encode']
+    assert all(span.parent is root for span in encodes)
+    for span in exporter.spans:
+        assert span.trace_id == root.trace_id
+        assert 'receipt' not in span.attributes.values()
+        assert span.start_time <= span.end_time
+
+    exporter.clear()
+    assert exporter.spans == []
+
+
+def test_opentelemetry_exporter(http_response):
+    pytest.importorskip('opentelemetry.sdk')
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    otel_exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(otel_exporter))
+    exporter = OpenTelemetryExporter(provider.get_tracer('test'))
+    in_memory = InMemoryExporter()
+
+    class BothExporter(object):
+        def export(self, root):
+            in_memory.export(root)
+            exporter.export(root)
+
+    _verify_with_fallback(http_response, Tracer(BothExporter()))
+    spans = otel_exporter.get_finished_spans()
+    assert len(spans) == len(in_memory.spans)
+    root = [span for span in spans if span.parent is None]
+    assert [span.name for span in root] == ['itunesiap.verify']
+    root = root[0]
+    assert root.start_time == in_memory.roots[0].start_time
+    assert root.end_time == in_memory.roots[0].end_time
+    attempts = [span for span in spans if span.name == 'itunesiap.attempt']
+    assert all(span.parent.span_id == root.context.span_id for span in attempts)
+    assert not attempts[0].status.is_ok
+
+
+def test_opentelemetry_exporter_sanitized(http_response):
+    pytest.importorskip('opentelemetry.sdk')
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    otel_exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(otel_exporter))
+    env = itunesiap.env.production.clone(
+        observers=[Tracer(OpenTelemetryExporter(provider.get_tracer('test')))])
+    with patch.object(requests, 'post') as post:
+        post.return_value = http_response({'status': 21010, 'latest_receipt': 'SECRET'})
+        with pytest.raises(itunesiap.exc.InvalidReceipt):
+            itunesiap.verify('receipt', env=env)
+    spans = otel_exporter.get_finished_spans()
+    events = [event for span in spans for event in span.events]
+    assert events
+    for event in events:
+        assert event.name == 'exception'
+        assert dict(event.attributes) == {'exception.type': 'InvalidReceipt', 'itunesiap.status': 21010}
+    assert 'SECRET' not in repr([span.to_json() for span in spans])